@@ -0,0 +1,219 @@
+# admission.py
+# LLM 呼び出しの前段に置くアドミッション制御
+# docker-compose では Ollama に 4 CPU しか割り当てていないのに、api_server はチャットを無制限に受け付けて
+# すべてを LLM に流していたため、バーストが来ると全員が遅くなり、多くがタイムアウトしていた。
+# バックエンドごとに同時実行数を制限し、あふれた分は優先度付きキューで待たせる（短い・対話的な質問が先、バッチは後）。
+# キューが一杯なら待たせずに 429、待ち時間の上限を過ぎたら 503 を Retry-After 付きで返す
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+from metrics import metrics
+from ollama_client import percentile
+
+log = logging.getLogger(__name__)
+
+ADMISSION_LIMITS = {
+    "ollama": int(os.getenv("ADMISSION_OLLAMA_CONCURRENCY", "2")),
+    "gemini": int(os.getenv("ADMISSION_GEMINI_CONCURRENCY", "8")),
+}
+ADMISSION_DEFAULT_LIMIT = 2
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))     # バックエンドごとの待ち行列の上限
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))       # 秒。これ以上待たせずに 503 を返す
+ADMISSION_SHORT_CHARS = 120     # これ以下の質問は対話的（interactive）として扱う
+BATCH_QUEUE_SHARE = 0.5         # batch はキューのこの割合までしか使えない（対話的な質問の枠を残す）
+SERVICE_SMOOTHING = 0.2         # 1件あたりの処理時間の指数移動平均の係数（Retry-After の見積もり用）
+STATS_WINDOW = 512
+
+PRIORITIES = {"interactive": 0, "normal": 1, "batch": 2}
+
+admission_wait_seconds = metrics.histogram("admission_wait_seconds", "Time a request waited for an LLM slot.",
+                                           ("backend", "priority"))
+admission_rejected = metrics.counter("admission_rejected_total", "Requests rejected by admission control.",
+                                     ("backend", "reason"))
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of queueing: status_code is 429 (queue full) or 503 (waited too long)."""
+
+    def __init__(self, backend: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"{backend}: {reason}")
+        self.backend = backend
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def request_priority(message: str, requested: Optional[str] = None, streaming: bool = False) -> str:
+    """Explicit priority if given, otherwise interactive for streaming or short questions."""
+    if requested:
+        if requested not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{requested}' (choose from {list(PRIORITIES)})")
+        return requested
+    return "interactive" if streaming or len(message) <= ADMISSION_SHORT_CHARS else "normal"
+
+
+class _Lane:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self.heap = []          # [priority, seq, future]
+        self.service_seconds = None
+        self.waits = deque(maxlen=STATS_WINDOW)
+        self.max_depth = 0
+        self.counters = Counter()
+
+
+class AdmissionController:
+    """
+    Per-backend in-flight limit with a priority queue in front of it.
+
+    acquire() returns at once while a backend has a free slot and nobody is
+    waiting, otherwise it queues by (priority, arrival). A full queue is
+    rejected immediately with 429, a request still queued after max_wait with
+    503; both carry a Retry-After estimated from the queue depth and the
+    smoothed service time. try_acquire() takes a free slot without queueing
+    (llm_router uses it for hedged requests). release() hands the slot to the
+    best waiter.
+    Everything runs on the event loop thread, so no locks are needed.
+    """
+
+    def __init__(self, limits: Dict[str, int] = None, max_queue: int = ADMISSION_QUEUE_SIZE,
+                 max_wait: float = ADMISSION_MAX_WAIT):
+        self.limits = dict(ADMISSION_LIMITS if limits is None else limits)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lanes: Dict[str, _Lane] = {}
+        self._seq = itertools.count()
+
+    def _lane(self, backend: str) -> _Lane:
+        lane = self._lanes.get(backend)
+        if lane is None:
+            lane = self._lanes[backend] = _Lane(self.limits.get(backend, ADMISSION_DEFAULT_LIMIT))
+        return lane
+
+    def retry_after(self, backend: str) -> int:
+        lane = self._lane(backend)
+        service = lane.service_seconds or 1.0
+        return max(1, math.ceil(service * (lane.waiting + 1) / lane.limit))
+
+    def _reject(self, backend: str, lane: _Lane, status_code: int, reason: str):
+        lane.counters[f"rejected_{reason}"] += 1
+        admission_rejected.inc(backend=backend, reason=reason)
+        log.warning("Admission rejected (%s, %s): in_flight=%d queued=%d", backend, reason, lane.in_flight, lane.waiting)
+        raise AdmissionRejected(backend, status_code, self.retry_after(backend), reason)
+
+    def try_acquire(self, backend: str, priority: str = "normal") -> Optional[float]:
+        """Take a slot if one is free and nobody is waiting, else return None without queueing."""
+        lane = self._lane(backend)
+        if lane.in_flight >= lane.limit or lane.waiting:
+            return None
+        lane.in_flight += 1
+        lane.counters["admitted"] += 1
+        lane.waits.append(0.0)
+        admission_wait_seconds.observe(0.0, backend=backend, priority=priority)
+        return time.monotonic()
+
+    async def acquire(self, backend: str, priority: str = "normal") -> float:
+        """Wait for a slot; returns the time the slot was granted (pass it to release())."""
+        granted = self.try_acquire(backend, priority)
+        if granted is not None:
+            return granted
+        lane = self._lane(backend)
+        started = time.monotonic()
+        queue_limit = self.max_queue * (BATCH_QUEUE_SHARE if priority == "batch" else 1.0)
+        if lane.waiting >= queue_limit:
+            self._reject(backend, lane, 429, "queue_full")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.heap, [PRIORITIES[priority], next(self._seq), future])
+        lane.waiting += 1
+        lane.max_depth = max(lane.max_depth, lane.waiting)
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            lane.waiting -= 1
+            self._reject(backend, lane, 503, "timeout")
+        except asyncio.CancelledError:
+            # クライアントが切断した。直前に枠を渡されていたら返す
+            if future.done() and not future.cancelled():
+                self.release(backend, time.monotonic())
+            else:
+                lane.waiting -= 1
+                future.cancel()
+            raise
+        granted = time.monotonic()
+        lane.counters["admitted"] += 1
+        lane.counters["queued"] += 1
+        lane.waits.append(granted - started)
+        admission_wait_seconds.observe(granted - started, backend=backend, priority=priority)
+        return granted
+
+    def release(self, backend: str, granted: float):
+        lane = self._lane(backend)
+        held = time.monotonic() - granted
+        lane.service_seconds = held if lane.service_seconds is None else \
+            lane.service_seconds + SERVICE_SMOOTHING * (held - lane.service_seconds)
+        lane.in_flight -= 1
+        while lane.heap:
+            _, _, future = heapq.heappop(lane.heap)
+            if future.cancelled():
+                continue  # タイムアウトまたは切断で待つのをやめたリクエスト
+            lane.waiting -= 1
+            lane.in_flight += 1
+            future.set_result(None)
+            break
+
+    def router_acquire(self, priority: str = "normal"):
+        """
+        acquire(backend, wait) hook for llm_router: returns the slot's release
+        function; with wait=False, None instead of queueing when the backend is full.
+        """
+        async def acquire(backend: str, wait: bool = True) -> Optional[Callable[[], None]]:
+            granted = await self.acquire(backend, priority) if wait else self.try_acquire(backend, priority)
+            return None if granted is None else functools.partial(self.release, backend, granted)
+        return acquire
+
+    @asynccontextmanager
+    async def slot(self, backend: str, priority: str = "normal"):
+        granted = await self.acquire(backend, priority)
+        try:
+            yield
+        finally:
+            self.release(backend, granted)
+
+    def stats(self) -> Dict:
+        stats = {}
+        for backend, lane in list(self._lanes.items()):
+            waits = list(lane.waits)
+            stats[backend] = {
+                "limit": lane.limit,
+                "in_flight": lane.in_flight,
+                "queue_depth": lane.waiting,
+                "max_queue_depth": lane.max_depth,
+                "queue_size": self.max_queue,
+                **dict(lane.counters),
+                "wait_seconds": {"p50": percentile(waits, 50), "p95": percentile(waits, 95), "max": max(waits, default=None)},
+                "service_seconds": round(lane.service_seconds, 3) if lane.service_seconds is not None else None,
+            }
+        return stats
+
+    def metric_lines(self):
+        """In-flight and queue-depth gauges for /metrics (read at scrape time)."""
+        lines = ["# HELP admission_in_flight LLM calls currently holding a slot.", "# TYPE admission_in_flight gauge"]
+        lines += [f'admission_in_flight{{backend="{name}"}} {lane.in_flight}' for name, lane in list(self._lanes.items())]
+        lines += ["# HELP admission_queue_depth Requests waiting for an LLM slot.", "# TYPE admission_queue_depth gauge"]
+        lines += [f'admission_queue_depth{{backend="{name}"}} {lane.waiting}' for name, lane in list(self._lanes.items())]
+        return lines
+
+
+admission = AdmissionController()
+metrics.add_collector(admission.metric_lines)
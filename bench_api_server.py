@@ -0,0 +1,342 @@
+# bench_api_server.py
+# api_server の負荷試験とレイテンシ計測を再現可能な形で行う
+#
+# 一時ディレクトリに小さなフィクスチャの Chroma DB とチャット履歴を作り、fake_llm_server.py（Ollama/Gemini のスタブ）を
+# 起動したうえで、api_server.app を uvicorn の子プロセスとして起動する。各シナリオを指定した同時実行数で叩き、
+# p50/p95/p99 レイテンシ・スループット・サーバープロセスの RSS を表示し、コミット間で比較できるよう JSON に保存する。
+#   python bench_api_server.py                                  # 全シナリオを同時実行数 1/4/16 で
+#   python bench_api_server.py --scenarios ollama history --concurrency 8 32 --requests 200
+#   python bench_api_server.py --first-token-delay 1 --tokens-per-second 20 --compare bench_results/old.json
+# 結果は既定で bench_results/api_server-<コミット>-<日時>.json に保存する
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import httpx
+
+import fake_llm_server
+from chat_store import ChatHistoryStore, CHAT_HISTORY_LOG
+from ollama_client import percentile
+from save_book_to_chroma import COLLECTION_NAME, EMBEDDING_MODEL, sync_book
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, "bench_results")
+RSS_SAMPLE_SECONDS = 0.2
+
+SCENARIOS = {
+    "ollama": ("POST", "/api/messages"),
+    "gemini": ("POST", "/api/messages/gemini"),
+    "history": ("GET", "/api/messages"),
+    "delete": ("DELETE", "/api/messages/0"),   # 先頭の往復を消す（履歴はあらかじめ十分な件数を用意する）
+}
+
+# フィクスチャの本文（書籍の代わり）。1行ずつ文書として登録する
+FIXTURE_TEXT = """\
+ストーリーとは、登場人物が目的に向かって行動し、その結果として変化していく過程である。
+シーンは目的・葛藤・結末の三つで構成され、結末が次のシーンの目的を生む。
+キャラクターの魅力は、アクションとリアクションの積み重ねから生まれる。
+プロットは出来事の並びではなく、原因と結果の連鎖である。
+テーマは物語全体を貫く問いであり、答えは読者に委ねてもよい。
+主人公には、外的な目標と内的な欠落の両方を持たせると物語に厚みが出る。
+冒頭の数ページで、日常と、それを揺るがす出来事を示すとよい。
+中盤では、主人公の選択が状況を悪化させる展開を用意すると緊張が続く。
+クライマックスでは、主人公が自分の欠落と向き合う選択を迫られる。
+結末では、変化した主人公の新しい日常を短く描く。
+伏線は、読者が気づかない程度にさりげなく、しかし確実に置いておく。
+会話文は情報を伝えるだけでなく、人物の関係性を示すために使う。
+視点人物を決めたら、その人物が知らないことは書かないようにする。
+描写は五感のうち少なくとも二つを使うと、場面が立ち上がる。
+敵役にも、彼なりの正しさと目的を与えると物語が深まる。
+サブプロットは、メインプロットのテーマを別の角度から照らす。
+章の終わりには、次の章を読みたくなる問いを残す。
+推敲では、まず構成を見直し、次に場面、最後に文章を直す。
+"""
+
+QUESTIONS = [
+    "ストーリーとは何ですか",
+    "シーンの作り方を教えてください",
+    "キャラクターを魅力的にするには",
+    "プロットと出来事の並びの違いは",
+    "伏線の置き方について",
+    "クライマックスで主人公は何をすべきですか",
+    "会話文の役割を詳しく説明してください",
+    "推敲の順番はどうすればよいですか",
+]
+
+
+def rss_bytes(pid: int):
+    """Resident set size of a process (psutil if installed, otherwise /proc)."""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RSSSampler:
+    """Samples a process's RSS on a background thread while a scenario runs."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = rss_bytes(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return {"rss_start_mb": None, "rss_end_mb": None, "rss_peak_mb": None}
+        mb = lambda value: round(value / 2 ** 20, 1)
+        return {"rss_start_mb": mb(self.samples[0]), "rss_end_mb": mb(self.samples[-1]), "rss_peak_mb": mb(max(self.samples))}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# --- 準備 ---
+def build_fixture(workdir: str, history_pairs: int):
+    """Fixture Chroma DB (embedded with the server's model) and a chat history of history_pairs turns."""
+    import chromadb
+    from sentence_transformers import SentenceTransformer
+
+    source = os.path.join(workdir, "fixture.txt")
+    with open(source, "w", encoding="utf-8") as f:
+        f.write(FIXTURE_TEXT)
+    collection = chromadb.PersistentClient(path=os.path.join(workdir, "chroma_db")).get_or_create_collection(COLLECTION_NAME)
+    counts = sync_book(collection, source, SentenceTransformer(EMBEDDING_MODEL), chunking="lines")
+    print(f"--- Fixture DB: {counts['added']} documents ---")
+
+    store = ChatHistoryStore(os.path.join(workdir, CHAT_HISTORY_LOG), legacy_json_path=None, fsync=False)
+    turns = []
+    for i in range(history_pairs):
+        turns.append({"role": "user", "content": [{"type": "text", "text": f"{QUESTIONS[i % len(QUESTIONS)]}（履歴{i}）"}]})
+        turns.append({"role": "assistant", "content": [{"type": "text", "text": FIXTURE_TEXT.splitlines()[i % 18]}]})
+    store.append_many(turns)
+    print(f"--- Fixture history: {len(store)} messages ---")
+
+
+def start_stub_llm(args):
+    config = fake_llm_server.FakeLLMConfig(args.first_token_delay, args.tokens_per_second,
+                                           gemini_first_token_delay=args.gemini_first_token_delay)
+    server = fake_llm_server.make_server(port=args.llm_port, config=config)
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server
+
+
+def start_api_server(args, workdir: str) -> subprocess.Popen:
+    stub = f"http://127.0.0.1:{args.llm_port}"
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])),
+        "OLLAMA_API_BASE": stub,
+        "GEMINI_API_ENDPOINT": stub,
+        "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "dummy"),
+        "CHROMA_DB_PATH": os.path.join(workdir, "chroma_db"),
+    }
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log = open(os.path.join(workdir, "server.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 600):
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"api_server exited with code {process.returncode} (see server.log)")
+        try:
+            if (await client.get("/api/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass  # サーバーがまだ起動していない
+        if time.monotonic() > deadline:
+            raise TimeoutError("api_server did not become ready")
+        await asyncio.sleep(0.5)
+
+
+# --- 計測 ---
+async def run_level(client: httpx.AsyncClient, scenario: str, concurrency: int, requests: int, unique: bool):
+    """Closed loop: `concurrency` workers issue `requests` requests in total."""
+    method, path = SCENARIOS[scenario]
+    latencies, statuses = [], {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            kwargs = {}
+            if method == "POST":
+                question = QUESTIONS[i % len(QUESTIONS)]
+                # 既定では質問を毎回変えて、検索結果・意味キャッシュに当たらないようにする
+                kwargs["json"] = {"message": f"{question}（{i}）" if unique else question}
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            statuses[status] = statuses.get(status, 0) + 1
+            if status.startswith("2"):
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - started
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(max(latencies, default=None)),
+    }
+
+
+def print_row(result, previous=None):
+    def delta(key):
+        if not previous or previous.get(key) in (None, 0) or result.get(key) is None:
+            return ""
+        return f"({(result[key] - previous[key]) / previous[key] * 100:+.0f}%)"
+
+    errors = sum(count for status, count in result["statuses"].items() if not status.startswith("2"))
+    print(f"{result['scenario']:8s} {result['concurrency']:5d} {result['ok']:5d} {errors:5d} "
+          f"{result['throughput_rps'] or 0:8.2f}{delta('throughput_rps'):>7s} "
+          f"{result['p50_ms'] or 0:9.1f}{delta('p50_ms'):>7s} {result['p95_ms'] or 0:9.1f}{delta('p95_ms'):>7s} "
+          f"{result['p99_ms'] or 0:9.1f}{delta('p99_ms'):>7s} {result['rss_peak_mb'] or 0:8.1f}")
+
+
+async def run(args, process: subprocess.Popen):
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2, max_keepalive_connections=max(args.concurrency) * 2)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout, limits=limits) as client:
+        await wait_ready(client, process)
+        print(f"{'scenario':8s} {'conc':>5s} {'ok':>5s} {'err':>5s} {'req/s':>15s} {'p50 ms':>16s} "
+              f"{'p95 ms':>16s} {'p99 ms':>16s} {'RSS MB':>8s}")
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                with RSSSampler(process.pid) as sampler:
+                    result = await run_level(client, scenario, concurrency, args.requests, not args.repeat_questions)
+                result.update(sampler.summary())
+                results.append(result)
+                print_row(result, previous.get((scenario, concurrency)))
+        try:
+            server_stats = (await client.get("/api/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+    return results, server_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test api_server against stub LLM backends")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=40, help="requests per scenario and concurrency level")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="stub LLM time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="stub LLM token rate")
+    parser.add_argument("--gemini-first-token-delay", type=float, help="defaults to --first-token-delay")
+    parser.add_argument("--history", type=int, default=200, help="chat history turns to start with")
+    parser.add_argument("--repeat-questions", action="store_true", help="reuse questions (lets caches hit)")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--llm-port", type=int, default=11435)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--server-env", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="extra environment for api_server, e.g. ADMISSION_OLLAMA_CONCURRENCY=4")
+    parser.add_argument("--output", help="JSON results path (default: bench_results/api_server-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_api_server_")
+    # DELETE は1回で1往復を消すので、消し切らない件数の履歴を用意する
+    deletes = args.requests * len(args.concurrency) if "delete" in args.scenarios else 0
+    build_fixture(workdir, max(args.history, deletes + 1))
+    stub = start_stub_llm(args)
+    process = start_api_server(args, workdir)
+    try:
+        results, server_stats = asyncio.run(run(args, process))
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        stub.shutdown()
+        if args.keep_workdir:
+            print(f"--- Work directory kept: {workdir} ---")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = git_commit()
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"api_server-{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    report = {
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+        "server_stats": server_stats,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"--- Results saved to {output} ---")
+
+
+if __name__ == "__main__":
+    main()
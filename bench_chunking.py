@@ -0,0 +1,89 @@
+# bench_chunking.py
+# 1行=1文書 と 文単位チャンク（chunking.py）で、索引サイズ・検索レイテンシ・再現率を比較する
+#
+# 書籍から文をランダムに選んでクエリにし、
+#   recall     : 上位k件のどれかにその文が含まれている割合
+#   ctx recall : その文と次の文の両方が上位k件（＝プロンプトに入る文脈）に含まれている割合
+# を測る。あわせて、1クエリあたりにプロンプトへ入る文字数（n_results件の合計）も出す。
+#   python bench_chunking.py --source story.txt --queries 200
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+import chromadb
+
+from chunking import CHUNK_TOKENS, OVERLAP_TOKENS, iter_sentences
+from save_book_to_chroma import EMBEDDING_MODEL, batched, read_chunks
+
+EMBED_BATCH = 256
+
+
+def build_index(client, embedder, documents):
+    collection = client.create_collection(f"bench_{uuid.uuid4().hex[:8]}")
+    started = time.perf_counter()
+    for offset, batch in enumerate(batched(iter(documents), EMBED_BATCH)):
+        collection.add(ids=[f"doc_{offset * EMBED_BATCH + i}" for i in range(len(batch))],
+                       documents=batch, embeddings=embedder.encode(batch).tolist())
+    return collection, time.perf_counter() - started
+
+
+def evaluate(collection, query_vectors, queries, k):
+    latencies, hits, context_hits, context_chars = [], 0, 0, []
+    for (query, following), vector in zip(queries, query_vectors):
+        started = time.perf_counter()
+        results = collection.query(query_embeddings=[vector], n_results=k)
+        latencies.append(time.perf_counter() - started)
+        documents = results["documents"][0]
+        hits += any(query in document for document in documents)
+        context_hits += any(query in document for document in documents) and \
+            any(following in document for document in documents)
+        context_chars.append(sum(len(document) for document in documents))
+    latencies.sort()
+    return {
+        "recall": hits / len(queries),
+        "context_recall": context_hits / len(queries),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "context_chars": statistics.mean(context_chars),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare line-level documents with packed sentence chunks")
+    parser.add_argument("--source", default="story.txt")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=OVERLAP_TOKENS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    embedder = SentenceTransformer(args.model)
+    dim = embedder.encode(["dim"]).shape[1]
+
+    with open(args.source, encoding="utf-8") as f:
+        sentences = [s.text for s in iter_sentences(f)]
+    pairs = [(sentences[i], sentences[i + 1]) for i in range(len(sentences) - 1) if len(sentences[i]) >= 8]
+    queries = random.Random(args.seed).sample(pairs, min(args.queries, len(pairs)))
+    query_vectors = embedder.encode([query for query, _ in queries]).tolist()
+
+    client = chromadb.EphemeralClient()
+    variants = {
+        "lines": [text for text, _ in read_chunks(args.source, "lines")],
+        "chunks": [text for text, _ in read_chunks(args.source, "sentences", args.chunk_tokens, args.overlap_tokens)],
+    }
+    print(f"{'variant':8s} {'vectors':>8s} {'index MB':>9s} {'build s':>8s} {'recall@' + str(args.k):>9s} "
+          f"{'ctx recall':>10s} {'p50 ms':>7s} {'p95 ms':>7s} {'ctx chars':>9s}")
+    for name, documents in variants.items():
+        collection, build_seconds = build_index(client, embedder, documents)
+        result = evaluate(collection, query_vectors, queries, args.k)
+        print(f"{name:8s} {len(documents):8d} {len(documents) * dim * 4 / 1e6:9.2f} {build_seconds:8.2f} "
+              f"{result['recall']:9.3f} {result['context_recall']:10.3f} {result['p50_ms']:7.2f} {result['p95_ms']:7.2f} {result['context_chars']:9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench_hybrid.py
+# 現行のベクトル検索（collection.query）と、BM25単独・ハイブリッド検索（retrieval.py）の精度とレイテンシを比べる
+#
+# クエリは2種類を本文から自動生成する:
+#   keyword : 本文中のカタカナ/漢字の語 + 「について」（例: シーンについて）。その語を含む文書を正解とする
+#   sentence: 本文中の1文。その文を含む文書を正解とする
+# レイテンシには質問の埋め込み時間も含める（キャッシュは無効）。
+#   python bench_hybrid.py --db chroma_db --collection book
+#   python bench_hybrid.py --source story.txt          # 一時コレクションにチャンクを登録して測る
+import argparse
+import random
+import re
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+from chunking import iter_sentences
+from retrieval import RetrievalCache
+from save_book_to_chroma import EMBEDDING_MODEL, batched, content_id, read_chunks
+from vector_store import open_client
+
+_TERM = re.compile(r"[ァ-ヶー]{3,8}|[一-龥]{2,4}")
+
+
+def make_queries(documents, n, seed):
+    rng = random.Random(seed)
+    terms = Counter(term for document in documents for term in set(_TERM.findall(document)))
+    # どの文書にも出る語や1回しか出ない語は除く
+    candidates = [term for term, df in terms.items() if 2 <= df <= max(2, len(documents) // 10)]
+    keyword = [(f"{term}について", term) for term in rng.sample(candidates, min(n, len(candidates)))]
+    sentences = [s.text for document in documents for s in iter_sentences(document.splitlines(keepends=True))
+                 if len(s.text) >= 10]
+    sentence = [(text, text) for text in rng.sample(sentences, min(n, len(sentences)))]
+    return {"keyword": keyword, "sentence": sentence}
+
+
+def run(search, queries, k):
+    latencies, precision, hit = [], [], 0
+    for query, needle in queries:
+        started = time.perf_counter()
+        documents = search(query)
+        latencies.append(time.perf_counter() - started)
+        relevant = sum(needle in document for document in documents)
+        precision.append(relevant / k)
+        hit += relevant > 0
+    latencies.sort()
+    return {
+        "precision": statistics.mean(precision),
+        "hit": hit / len(queries),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vector, BM25 and hybrid retrieval")
+    parser.add_argument("--db", default="chroma_db")
+    parser.add_argument("--collection", default="book")
+    parser.add_argument("--source", help="build a temporary collection from this text file instead")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    embedder = SentenceTransformer(args.model)
+
+    if args.source:
+        # RetrievalCache は write_version() を使うので、一時ディレクトリでも open_client 経由で開く
+        workdir = tempfile.mkdtemp(prefix="bench_hybrid_")
+        collection = open_client(workdir, numpy_path=workdir).get_or_create_collection("bench_hybrid")
+        for batch in batched(read_chunks(args.source), 256):
+            documents = [text for text, _ in batch]
+            collection.upsert(ids=[content_id(text) for text in documents], documents=documents,
+                              embeddings=embedder.encode(documents).tolist(), metadatas=[meta for _, meta in batch])
+    else:
+        collection = open_client(args.db).get_collection(args.collection)
+    documents = collection.get(include=["documents"])["documents"]
+
+    # キャッシュを無効にして毎回検索させる
+    retrieval = RetrievalCache(maxsize=0, hybrid=True)
+    index = retrieval.lexical_index(args.collection, collection)
+
+    def vector(query):
+        query_vec = embedder.encode([query])[0].tolist()
+        return collection.query(query_embeddings=[query_vec], n_results=args.k)["documents"][0]
+
+    def lexical(query):
+        return index.documents([doc_id for doc_id, _ in index.search(query, args.k)])[0]
+
+    def hybrid(query):
+        return retrieval.query(embedder, args.collection, collection, query, args.k)["documents"][0]
+
+    modes = {"vector": vector, "bm25": lexical, "hybrid": hybrid}
+    print(f"{len(documents)} documents, k={args.k}")
+    print(f"{'queries':9s} {'mode':7s} {'P@' + str(args.k):>6s} {'hit':>6s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for kind, queries in make_queries(documents, args.queries, args.seed).items():
+        for name, search in modes.items():
+            result = run(search, queries, args.k)
+            print(f"{kind:9s} {name:7s} {result['precision']:6.3f} {result['hit']:6.3f} "
+                  f"{result['p50_ms']:8.2f} {result['p95_ms']:8.2f}")
+    print(f"hybrid search paths: {retrieval.stats()['search_paths']}")
+
+
+if __name__ == "__main__":
+    main()
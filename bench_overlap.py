@@ -0,0 +1,79 @@
+# bench_overlap.py
+# 同時リクエストが重なって処理されるか（イベントループが塞がれていないか）を確認する簡易負荷試験
+#
+# 遅いLLM（fake_llm_server.py）に対して POST /api/messages を同時に投げ、
+# その間に軽い GET /api/messages?limit=1 の応答時間を測る。
+#   python fake_llm_server.py --port 11434 --first-token-delay 2
+#   OLLAMA_API_BASE=http://127.0.0.1:11434 ADMISSION_OLLAMA_CONCURRENCY=4 uvicorn api_server:app --port 8001
+#   python bench_overlap.py --concurrency 4
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def timed(client, method, path, **kwargs):
+    started = time.perf_counter()
+    response = await client.request(method, path, **kwargs)
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def wait_ready(client, timeout=300):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/api/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass  # サーバーがまだ起動していない
+        if time.monotonic() > deadline:
+            raise TimeoutError("server did not become ready")
+        await asyncio.sleep(0.5)
+
+
+async def probe_light_endpoint(client, stop: asyncio.Event, latencies):
+    while not stop.is_set():
+        latencies.append(await timed(client, "GET", "/api/messages", params={"limit": 1}))
+        await asyncio.sleep(0.05)
+
+
+async def run(args):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=600) as client:
+        await wait_ready(client)
+        probe_latencies = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_light_endpoint(client, stop, probe_latencies))
+        started = time.perf_counter()
+        try:
+            chat_latencies = await asyncio.gather(*[
+                timed(client, "POST", args.path, json={"message": f"{args.message} ({i})"})
+                for i in range(args.concurrency)
+            ])
+            wall = time.perf_counter() - started
+        finally:
+            stop.set()
+            await probe
+
+    serial = sum(chat_latencies)
+    print(f"chat requests     : {args.concurrency} x {args.path}")
+    print(f"wall time         : {wall:.2f}s (sum of latencies {serial:.2f}s)")
+    print(f"overlap factor    : {serial / wall:.2f} (1.0 = fully serialized, {args.concurrency}.0 = fully parallel)")
+    if probe_latencies:
+        print(f"GET /api/messages : n={len(probe_latencies)} median={statistics.median(probe_latencies) * 1000:.1f}ms "
+              f"max={max(probe_latencies) * 1000:.1f}ms while chats were in flight")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent chat requests overlap")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--path", default="/api/messages")
+    parser.add_argument("--message", default="ストーリーとは")
+    parser.add_argument("--concurrency", type=int, default=4)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
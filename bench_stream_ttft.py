@@ -0,0 +1,57 @@
+# bench_stream_ttft.py
+# ストリーミングエンドポイントの TTFT(最初のトークンまでの時間) と全体の所要時間を測る
+#
+# 例: fake_llm_server.py を起動し、api_server をそこへ向けてから実行する
+#   python fake_llm_server.py --port 11434 --first-token-delay 2 --tokens-per-second 10
+#   OLLAMA_API_BASE=http://127.0.0.1:11434 GEMINI_API_ENDPOINT=http://127.0.0.1:11434 GEMINI_API_KEY=dummy \
+#       uvicorn api_server:app --port 8001
+#   python bench_stream_ttft.py --runs 5
+import argparse
+import statistics
+import time
+
+import httpx
+
+ENDPOINTS = {
+    "ollama": "/api/messages/stream",
+    "gemini": "/api/messages/gemini/stream",
+}
+
+
+def measure(client: httpx.Client, path: str, message: str):
+    started = time.perf_counter()
+    ttft = None
+    tokens = 0
+    with client.stream("POST", path, json={"message": message}) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line.startswith("event: token"):
+                tokens += 1
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+            elif line.startswith("event: error"):
+                raise RuntimeError(f"stream failed: {next(response.iter_lines(), '')}")
+    return ttft, time.perf_counter() - started, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time-to-first-token of the SSE chat endpoints")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--backend", choices=sorted(ENDPOINTS), nargs="+", default=sorted(ENDPOINTS))
+    parser.add_argument("--message", default="ストーリーとは")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with httpx.Client(base_url=args.base_url, timeout=300) as client:
+        for backend in args.backend:
+            ttfts, totals = [], []
+            for _ in range(args.runs):
+                ttft, total, tokens = measure(client, ENDPOINTS[backend], args.message)
+                ttfts.append(ttft or total)
+                totals.append(total)
+            print(f"{backend:7s} ttft median={statistics.median(ttfts):.3f}s  "
+                  f"total median={statistics.median(totals):.3f}s  tokens={tokens}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# bench_vector_store.py
+# vector_store.py の NumPy memmap バックエンドと chromadb.PersistentClient を、コレクションの件数を変えながら比べる
+#
+# 件数ごとに同じ合成データ（クラスタ状に散らした正規化済みベクトル、metadata の kind は qa / answer が半々）を
+# 一時ディレクトリの両方のストアに登録し、次を測る:
+#   - 登録時間
+#   - 起動: 新しいプロセスで import からクライアント・コレクションを開いて最初の query が返るまでの時間と、その時点の最大RSS
+#   - query のレイテンシ（p50/p95、where なし / where={"kind": "qa"}）
+#   - Chroma（HNSW の近似検索）の recall@k（NumPy の厳密な top-k を正解とする）
+#   - ディスク上のサイズ
+#   python bench_vector_store.py
+#   python bench_vector_store.py --sizes 1000 10000 100000 --dim 384 --dtype float16 --json bench_results/vs.json
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from ollama_client import percentile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+COLLECTION = "bench_vectors"
+WRITE_BATCH = 5000
+CLUSTERS = 50
+
+# 子プロセスで実行する起動時間の計測（import も含める）
+_STARTUP_CODE = """
+import json, resource, sys, time
+started = time.perf_counter()
+backend, path, dim = sys.argv[1], sys.argv[2], int(sys.argv[3])
+if backend == "numpy":
+    from vector_store import NumpyVectorClient
+    collection = NumpyVectorClient(path).get_collection("%s")
+else:
+    import chromadb
+    collection = chromadb.PersistentClient(path=path).get_collection("%s")
+opened = time.perf_counter()
+collection.query(query_embeddings=[[1.0] * dim], n_results=3)
+done = time.perf_counter()
+print(json.dumps({"open_ms": (opened - started) * 1000, "first_query_ms": (done - opened) * 1000,
+                  "startup_ms": (done - started) * 1000,
+                  "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+""" % (COLLECTION, COLLECTION)
+
+
+def make_data(n: int, dim: int, seed: int):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(CLUSTERS, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, CLUSTERS, n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"doc_{i}" for i in range(n)]
+    documents = [f"document {i}" for i in range(n)]
+    metadatas = [{"kind": "qa" if i % 2 else "answer", "i": i} for i in range(n)]
+    queries = centers[rng.integers(0, CLUSTERS, 200)] + 0.5 * rng.normal(size=(200, dim)).astype(np.float32)
+    return vectors, ids, documents, metadatas, queries
+
+
+def dir_size_mb(path: str) -> float:
+    total = sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+    return round(total / 2 ** 20, 2)
+
+
+def fill(collection, vectors, ids, documents, metadatas) -> float:
+    started = time.perf_counter()
+    if hasattr(collection, "_write"):
+        # NumPy バックエンドは書き込みのたびに世代を作り直すので、まとめて1回で登録する
+        collection.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+    else:
+        for start in range(0, len(ids), WRITE_BATCH):
+            end = start + WRITE_BATCH
+            collection.upsert(ids=ids[start:end], embeddings=vectors[start:end].tolist(),
+                              documents=documents[start:end], metadatas=metadatas[start:end])
+    return time.perf_counter() - started
+
+
+def measure_queries(collection, queries, k: int, where=None):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, where=where)
+        latencies.append(time.perf_counter() - started)
+        results.append(result["ids"][0])
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {"p50_ms": ms(percentile(latencies, 50)), "p95_ms": ms(percentile(latencies, 95))}, results
+
+
+def startup(backend: str, path: str, dim: int):
+    env = {**os.environ, "PYTHONPATH": REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    out = subprocess.run([sys.executable, "-c", _STARTUP_CODE, backend, path, str(dim)], env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return {key: round(value, 1) for key, value in json.loads(out.strip().splitlines()[-1]).items()}
+
+
+def recall(found, truth, k: int) -> float:
+    return round(sum(len(set(a) & set(b)) for a, b in zip(found, truth)) / (k * len(truth)), 4)
+
+
+def bench_size(n: int, args, workdir: str):
+    import chromadb
+    from vector_store import NumpyVectorClient
+
+    vectors, ids, documents, metadatas, queries = make_data(n, args.dim, args.seed)
+    chroma_path = os.path.join(workdir, f"chroma_{n}")
+    numpy_path = os.path.join(workdir, f"numpy_{n}")
+    chroma = chromadb.PersistentClient(path=chroma_path).get_or_create_collection(COLLECTION, metadata={"hnsw:space": "cosine"})
+    store = NumpyVectorClient(numpy_path, args.dtype).get_or_create_collection(COLLECTION)
+
+    rows = []
+    truth = {}
+    for backend, collection, path in (("numpy", store, numpy_path), ("chroma", chroma, chroma_path)):
+        row = {"backend": backend, "size": n, "write_s": round(fill(collection, vectors, ids, documents, metadatas), 3)}
+        plain, found = measure_queries(collection, queries, args.k)
+        filtered, found_filtered = measure_queries(collection, queries, args.k, where={"kind": "qa"})
+        row.update({"query_p50_ms": plain["p50_ms"], "query_p95_ms": plain["p95_ms"],
+                    "where_p50_ms": filtered["p50_ms"], "where_p95_ms": filtered["p95_ms"]})
+        if backend == "numpy":
+            truth = {"plain": found, "where": found_filtered}
+        row["recall"] = recall(found, truth["plain"], args.k)
+        row["recall_where"] = recall(found_filtered, truth["where"], args.k)
+        row.update(startup(backend, path, args.dim))
+        row["disk_mb"] = dir_size_mb(path)
+        rows.append(row)
+    return rows
+
+
+def print_rows(rows):
+    header = (f"{'backend':7s} {'size':>7s} {'write s':>8s} {'startup':>8s} {'open':>7s} {'1st q':>7s} {'rss MB':>7s} "
+              f"{'q p50':>7s} {'q p95':>7s} {'w p50':>7s} {'w p95':>7s} {'recall':>7s} {'rec/w':>7s} {'disk MB':>8s}")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['backend']:7s} {r['size']:7d} {r['write_s']:8.2f} {r['startup_ms']:8.1f} {r['open_ms']:7.1f} "
+              f"{r['first_query_ms']:7.1f} {r['maxrss_mb']:7.1f} {r['query_p50_ms']:7.2f} {r['query_p95_ms']:7.2f} "
+              f"{r['where_p50_ms']:7.2f} {r['where_p95_ms']:7.2f} {r['recall']:7.3f} {r['recall_where']:7.3f} {r['disk_mb']:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the numpy memmap vector store with chromadb.PersistentClient")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dim", type=int, default=384, help="all-MiniLM-L6-v2 is 384")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the rows to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_vector_store_")
+    rows = []
+    try:
+        for n in args.sizes:
+            print(f"--- {n} vectors (dim {args.dim}, {args.dtype}) ---", flush=True)
+            rows += bench_size(n, args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print()
+    print("時間は ms（write は秒）。startup = import + 開く + 最初の query。recall は NumPy の厳密な top-k に対する割合")
+    print_rows(rows)
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# blocking_pool.py
+# 非同期ハンドラからブロッキング処理（埋め込み・Chroma検索・LLM呼び出し・ファイルI/O）を
+# 専用のスレッドプールに逃がし、イベントループを止めないようにする
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import ADMISSION_LIMITS
+
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))   # スレッドプールの上限
+# LLM呼び出し用のスレッド数。同時実行数はアドミッション制御が決めるので、その枠の合計だけ用意する
+LLM_WORKERS = sum(ADMISSION_LIMITS.values())
+
+_SENTINEL = object()
+
+
+class BlockingPool:
+    """
+    Bounded thread pool for blocking calls made from async handlers.
+
+    run() executes any blocking function off the event loop. run_llm() and
+    iterate_llm() do the same on a separate executor with one thread per
+    admission slot, so slow LLM calls cannot occupy the workers used for
+    embeddings and file I/O. They do not limit concurrency themselves;
+    callers must hold an admission slot (see admission.py).
+    Context variables are copied into the worker thread.
+    """
+
+    def __init__(self, max_workers: int = BLOCKING_WORKERS, llm_workers: int = LLM_WORKERS):
+        self.max_workers = max_workers
+        self.llm_workers = llm_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+        self._llm_executor = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="llm")
+
+    async def run(self, fn, *args, **kwargs):
+        return await self._run(self._executor, fn, *args, **kwargs)
+
+    async def run_llm(self, fn, *args, **kwargs):
+        return await self._run(self._llm_executor, fn, *args, **kwargs)
+
+    async def _run(self, executor, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+    async def iterate(self, make_iterator):
+        """Drive a blocking iterator (e.g. a streaming LLM response) without blocking the loop."""
+        async for item in self._iterate(self._executor, make_iterator):
+            yield item
+
+    async def iterate_llm(self, make_iterator):
+        async for item in self._iterate(self._llm_executor, make_iterator):
+            yield item
+
+    async def _iterate(self, executor, make_iterator):
+        iterator = await self._run(executor, lambda: iter(make_iterator()))
+        while True:
+            item = await self._run(executor, next, iterator, _SENTINEL)
+            if item is _SENTINEL:
+                return
+            yield item
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._llm_executor.shutdown(wait=False, cancel_futures=True)
+
+
+pool = BlockingPool()
@@ -0,0 +1,173 @@
+# bulk_ingest.py
+# 大きなコーパスを複数プロセスで並列に埋め込み、ChromaDBへ登録するCLI
+#
+# 読み込み（メインスレッド）→ 埋め込み（プロセスプール）→ 書き込み（ライタースレッド）をパイプラインで流し、
+# 各段の間は上限付きのキューでつなぐので、全ベクトルを一度にメモリへ載せない。
+# IDは内容のハッシュなので、中断後に同じコマンドを再実行すると登録済みのものはスキップされる（再開）。
+#   python bulk_ingest.py story.txt --collection book --workers 8
+#   python bulk_ingest.py validated_responses.txt --format validated --collection validated_responses_store
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from save_book_to_chroma import CHROMA_DB_PATH, EMBEDDING_MODEL, batched, content_id, existing_entries, read_chunks
+from semantic_cache import QA_KIND, parse_validated_line, validated_id
+from vector_store import open_client
+
+BULK_BATCH_SIZE = 128
+PROGRESS_INTERVAL_SECONDS = 5.0
+
+_worker_embedder = None
+
+
+# --- 埋め込みワーカー（子プロセス） ---
+def _init_worker(model_name: str, threads: int):
+    global _worker_embedder
+    import torch
+    from sentence_transformers import SentenceTransformer
+    # 各プロセスが全コアを奪い合わないよう、プロセスあたりのスレッド数を制限する
+    torch.set_num_threads(threads)
+    _worker_embedder = SentenceTransformer(model_name)
+
+
+def _encode_batch(batch: Dict) -> Dict:
+    vectors = _worker_embedder.encode(batch["embed_texts"], batch_size=len(batch["embed_texts"]))
+    batch["embeddings"] = vectors.astype("float32").tolist()
+    del batch["embed_texts"]
+    return batch
+
+
+# --- 読み込み ---
+def read_records(path: str, fmt: str) -> Iterator[Dict]:
+    """Yield {id, document, embed_text, metadata} for each record of the corpus."""
+    if fmt in ("chunks", "lines"):
+        for text, metadata in read_chunks(path, "lines" if fmt == "lines" else "sentences"):
+            yield {"id": content_id(text), "document": text, "embed_text": text, "metadata": metadata}
+    elif fmt == "validated":
+        with open(path, encoding="utf-8") as f:
+            for record in map(parse_validated_line, f):
+                if not record:
+                    continue
+                question, answer = record["question"], record["answer"]
+                metadata = {"kind": QA_KIND, "question": question} if question else {"kind": "answer"}
+                # ingestion_worker と同じ id なので、どちらで登録済みの組も重複しない
+                yield {"id": validated_id(question, answer), "document": answer,
+                       "embed_text": question or answer, "metadata": metadata}
+    else:
+        raise ValueError(f"unknown format: {fmt}")
+
+
+class Progress:
+    def __init__(self, interval: float = PROGRESS_INTERVAL_SECONDS):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.read = 0
+        self.skipped = 0
+        self.written = 0
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def maybe_report(self, force: bool = False):
+        now = time.perf_counter()
+        if force or now - self._last >= self.interval:
+            self._last = now
+            print(f"--- read {self.read} / skipped {self.skipped} / written {self.written} "
+                  f"({self.rate():.1f} docs/sec, {now - self.started:.1f}s) ---", flush=True)
+
+
+def _writer(collection, results: "queue.Queue[Optional[Dict]]", progress: Progress, errors: List[BaseException]):
+    while True:
+        batch = results.get()
+        if batch is None:
+            return
+        if errors:
+            continue  # 失敗後は読み捨てて、メインスレッドが止まるのを待つ
+        try:
+            collection.upsert(ids=batch["ids"], documents=batch["documents"],
+                              embeddings=batch["embeddings"], metadatas=batch["metadatas"])
+            progress.written += len(batch["ids"])
+            progress.maybe_report()
+        except BaseException as e:
+            errors.append(e)
+
+
+def bulk_ingest(path: str, collection, model_name: str = EMBEDDING_MODEL, fmt: str = "chunks",
+                workers: int = 0, batch_size: int = BULK_BATCH_SIZE, resume: bool = True) -> Progress:
+    workers = workers or max(1, (os.cpu_count() or 2) // 2)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    max_in_flight = workers * 2  # 埋め込み待ちのバッチ数の上限
+    # 再開: 既に登録済みのIDは埋め込まない
+    done_ids = set(existing_entries(collection, path)) if resume else set()
+
+    progress = Progress()
+    results: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=max_in_flight)
+    errors: List[BaseException] = []
+    writer = threading.Thread(target=_writer, args=(collection, results, progress, errors), name="chroma-writer")
+    writer.start()
+
+    in_flight = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_name, threads)) as executor:
+            for chunk in batched(read_records(path, fmt), batch_size):
+                progress.read += len(chunk)
+                todo = []
+                for record in chunk:
+                    if record["id"] not in done_ids:  # 登録済み、または同じ内容の重複行
+                        done_ids.add(record["id"])
+                        todo.append(record)
+                progress.skipped += len(chunk) - len(todo)
+                if not todo:
+                    continue
+                in_flight.append(executor.submit(_encode_batch, {
+                    "ids": [r["id"] for r in todo],
+                    "documents": [r["document"] for r in todo],
+                    "metadatas": [r["metadata"] for r in todo],
+                    "embed_texts": [r["embed_text"] for r in todo],
+                }))
+                # 上限に達したら最も古いバッチの完了を待ち、ライターへ渡す（読み込みが先走りしない）
+                while len(in_flight) >= max_in_flight:
+                    results.put(in_flight.pop(0).result())
+                if errors:
+                    raise errors[0]
+            for future in in_flight:
+                results.put(future.result())
+            in_flight = []
+    finally:
+        for future in in_flight:
+            future.cancel()
+        results.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+    progress.maybe_report(force=True)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed a large corpus with a process pool and write it to ChromaDB")
+    parser.add_argument("source")
+    parser.add_argument("--format", choices=["chunks", "lines", "validated"], default="chunks")
+    parser.add_argument("--db", default=CHROMA_DB_PATH)
+    parser.add_argument("--collection", default="book")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--workers", type=int, default=0, help="embedding processes (default: half the CPUs)")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--no-resume", action="store_true", help="re-embed records that are already stored")
+    args = parser.parse_args()
+
+    collection = open_client(args.db).get_or_create_collection(args.collection)
+    progress = bulk_ingest(args.source, collection, model_name=args.model, fmt=args.format,
+                           workers=args.workers, batch_size=args.batch_size, resume=not args.no_resume)
+    print(f"完了: {progress.written} 件を '{args.collection}' に登録しました（スキップ {progress.skipped} 件, "
+          f"{progress.rate():.1f} docs/sec）")
+
+
+if __name__ == "__main__":
+    main()
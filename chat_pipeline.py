@@ -0,0 +1,213 @@
+# chat_pipeline.py
+# api_server.py のチャット処理で共有する部品（RAG検索・プロンプト組み立て・応答の後処理）
+# 通常のエンドポイントとストリーミング版のエンドポイントの両方から使う
+import json
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prompt_budget import GEMINI_PROMPT_BUDGET, OLLAMA_PROMPT_BUDGET, PROMPT_MAX_TURNS, PromptBudget, prompt_usage
+from metrics import timed
+from logging_setup import log_sampled
+from resources import BOOK_COLLECTION
+
+log = logging.getLogger(__name__)
+
+RAG_N_RESULTS = 3
+OLLAMA_STRIP_PHRASES = ["書籍の抜粋から理解すると、", "【回答】"]
+TEST_VIDEO_ID = "iRJvKaCGPl0"
+
+# Updated system prompt to request JSON for tables
+GEMINI_ANSWER_INSTRUCTIONS = """
+- 回答は必ず3行以上にしてください。
+- できるだけ詳しく、具体例や理由も含めて説明してください。
+- 箇条書きや段落を使って、読みやすくしてください。
+- 回答には基本的に喜怒哀楽などの感情表現を含めてください。
+- 表データをJSON形式で、次の構造で出力してください: ```json
+{
+  "is_table": true,
+  "type": "table_data",
+  "data": {
+    "headers": ["ヘッダー1", "ヘッダー2"],
+    "rows": [
+      ["行1セル1", "行1セル2"],
+      ["行2セル1", "行2セル2"]
+    ]
+  }
+}
+``` このJSON構造を回答のメインコンテンツにしない。JSON構造は表で返答する時のみです。"""
+
+
+def retrieve_related(resources, message: str) -> Dict:
+    collection = resources.collection(BOOK_COLLECTION)
+    # ユーザー入力をベクトル化して検索（同じ質問はキャッシュから返す）
+    # 同時に届いた質問はEmbeddingServiceが1回のencodeにまとめる
+    return resources.retrieval.query(resources.embedding_service, BOOK_COLLECTION, collection, message, RAG_N_RESULTS)
+
+
+def has_related(results: Dict) -> bool:
+    return bool(results["documents"] and results["documents"][0])
+
+
+def user_message(text: str) -> Dict:
+    return {"role": "user", "content": [{"type": "text", "text": text}]}
+
+
+def log_prompt_usage(backend: str, usage: Optional[Dict]):
+    if usage is None:
+        return
+    prompt_usage.record(backend, usage)
+    sections = ", ".join(f"{name}={s['tokens']}" + (f"(-{s['dropped']})" if s["dropped"] else "") + ("*" if s["truncated"] else "")
+                         for name, s in usage["sections"].items())
+    log_sampled(log, logging.INFO, f"prompt_tokens_{backend}", "Prompt tokens (%s): %d/%d [%s]",
+                backend, usage["used"], usage["budget"], sections)
+
+
+# --- Ollama ---
+OLLAMA_PROMPT_HEAD = "以下は書籍からの抜粋です。ユーザーの質問に対し、できるだけこの抜粋を参考に日本語で答えてください。\n\n【書籍抜粋】\n"
+OLLAMA_QUESTION_LABEL = "\n\n【質問】"
+NO_RELATED_TEXT = "（該当する内容が見つかりませんでした）"
+
+
+@timed("prompt_build")
+def build_ollama_prompt(message: str, results: Dict, budget_tokens: int = OLLAMA_PROMPT_BUDGET) -> Tuple[Dict, Dict]:
+    """Prompt for Ollama and its token usage; documents are cut to fit num_ctx."""
+    budget = PromptBudget(budget_tokens)
+    budget.take("instructions", OLLAMA_PROMPT_HEAD + OLLAMA_QUESTION_LABEL)
+    question = budget.take("question", message)
+    if results["documents"]:
+        related = "\n".join(budget.take_items("documents", results["documents"][0]))
+    else:
+        related = budget.take("documents", NO_RELATED_TEXT)
+    system_prompt = OLLAMA_PROMPT_HEAD + related + OLLAMA_QUESTION_LABEL + question
+    return user_message(system_prompt), budget.report()
+
+
+def clean_ollama_text(text: str) -> str:
+    for phrase in OLLAMA_STRIP_PHRASES:
+        text = text.replace(phrase, "")
+    return text
+
+
+def ollama_call(resources, user_msg_for_llm: Dict) -> Callable[[threading.Event], str]:
+    """Blocking Ollama call for llm_router (returns the cleaned answer text, stops streaming once cancel is set)."""
+    return lambda cancel: clean_ollama_text(resources.llm([user_msg_for_llm], cancel=cancel).content)
+
+
+class PhraseStripper:
+    """
+    Streaming counterpart of clean_ollama_text.
+
+    Removes the phrases from a token stream, holding back only the trailing
+    characters that could still be the start of a phrase split across chunks.
+    """
+
+    def __init__(self, phrases: List[str] = OLLAMA_STRIP_PHRASES):
+        self.phrases = phrases
+        self.pending = ""
+
+    def _partial_suffix_len(self) -> int:
+        longest = 0
+        for phrase in self.phrases:
+            for size in range(min(len(phrase) - 1, len(self.pending)), longest, -1):
+                if self.pending.endswith(phrase[:size]):
+                    longest = size
+                    break
+        return longest
+
+    def feed(self, chunk: str) -> str:
+        self.pending = clean_ollama_text(self.pending + chunk)
+        keep = self._partial_suffix_len()
+        out = self.pending[:len(self.pending) - keep]
+        self.pending = self.pending[len(self.pending) - keep:]
+        return out
+
+    def flush(self) -> str:
+        out, self.pending = self.pending, ""
+        return out
+
+
+# --- Gemini ---
+def flatten_message(msg: Dict) -> str:
+    # contentは配列またはstr
+    if isinstance(msg["content"], list):
+        text = msg["content"][0]["text"] if msg["content"] and isinstance(msg["content"][0], dict) and "text" in msg["content"][0] else str(msg["content"])
+    else:
+        text = str(msg["content"])
+    if msg["role"] == "user":
+        return f"ユーザー: {text}"
+    elif msg["role"] == "assistant":
+        return f"アシスタント: {text}"
+    return ""
+
+
+GEMINI_RELATED_HEAD = (
+    "あなたは親切なAIアシスタントです。\n"
+    "ユーザーの質問に対して、以下の【提供情報】のみを根拠として、日本語で回答してください。\n"
+    "【提供情報】に記載されていない内容や、情報源（例：書籍、記事など）の構造や背景に関する憶測（例えば「書籍の冒頭には」や「著者の意図は」など）を回答に含めないでください。\n"
+    "あなたの役割は、提供された情報を正確にユーザーに伝えることです。\n"
+    "回答を生成する際には、「【提供情報】」、「提供された情報からは」、「書籍の記述からは、」といった定型的な前置きやラベルを回答に含めないでください。\n\n"
+    "【提供情報】\n"
+)
+GEMINI_GENERAL_HEAD = (
+    "あなたは親切なAIアシスタントです。\n"
+    "関連書籍のデータベースを検索しましたが、ユーザーの質問に直接合致する情報は見つかりませんでした。\n"
+    "あなたの一般的な知識に基づいて、ユーザーの質問に日本語で答えてください。\n"
+    "可能であれば、関連性の高い情報を提示してください。\n"
+    "「情報が見つかりませんでした」という旨の直接的な言及は避けてください。\n\n"
+)
+GEMINI_HISTORY_LABEL = "【直近の会話履歴】\n"
+GEMINI_QUESTION_LABEL = "\n\n【ユーザーの質問】\n"
+
+
+@timed("prompt_build")
+def build_gemini_prompt(message: str, messages: List[Dict], results: Dict,
+                        budget_tokens: int = GEMINI_PROMPT_BUDGET) -> Tuple[str, Dict]:
+    """
+    Prompt for Gemini and its token usage.
+
+    The budget is filled with the instructions, then the question, then the
+    retrieved documents in rank order, then the recent turns newest first
+    (shown in chronological order).
+    """
+    budget = PromptBudget(budget_tokens)
+    related_found = has_related(results)
+    # ★ RAGの結果に基づいてシステムプロンプトを分岐 ★
+    head = GEMINI_RELATED_HEAD if related_found else GEMINI_GENERAL_HEAD
+    budget.take("instructions", head + "\n\n" + GEMINI_HISTORY_LABEL + GEMINI_QUESTION_LABEL + GEMINI_ANSWER_INSTRUCTIONS)
+    question = budget.take("question", message)
+    related_texts = "\n".join(budget.take_items("documents", results["documents"][0])) if related_found else ""
+    # 直近の履歴（ユーザー/アシスタント両方で最大 PROMPT_MAX_TURNS 件）を新しい順に詰め、古い順に並べ直す
+    recent = [flatten_message(m) for m in messages[-PROMPT_MAX_TURNS:]]
+    history = "\n".join(reversed(budget.take_items("history", recent[::-1])))
+
+    if related_found:
+        system_prompt = head + f"{related_texts}\n\n" + GEMINI_HISTORY_LABEL + history + GEMINI_QUESTION_LABEL + question
+        log.debug("RAG: found related content")
+    else:
+        system_prompt = head + GEMINI_HISTORY_LABEL + history + GEMINI_QUESTION_LABEL + question
+        log.debug("RAG: no related content found, using general knowledge")
+    return system_prompt + GEMINI_ANSWER_INSTRUCTIONS, budget.report()
+
+
+def gemini_call(resources, system_prompt: str) -> Callable[[threading.Event], str]:
+    """Blocking Gemini call for llm_router (GenerativeModel is built once by the registry; a cancelled call just finishes)."""
+    return lambda cancel: resources.gemini_model().generate_content(system_prompt).text
+
+
+def gemini_reply(ai_text: str, results: Dict, cached: bool = False) -> Dict:
+    """Frontend payload for a Gemini answer (history only stores role/content)."""
+    # ★★★ 修正: RAGが成功しても字幕データは取得しない ★★★
+    return {
+        "role": "assistant",
+        "content": ai_text,
+        "cached": cached, # 意味キャッシュから返した回答なら True
+        "videoId": TEST_VIDEO_ID if has_related(results) else "",
+        "transcript": [], # 字幕データは取得せず空リスト
+        "videoTitle": "" # 動画タイトル取得は実装しない
+    }
+
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,266 @@
+# chat_store.py
+# チャット履歴の追記専用ストア（JSON Lines）
+# 1メッセージ = 1行を追記するだけなので、1ターンあたりのI/Oは履歴の長さに依存しない
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl  # 他プロセス（web_chat.py, voice_agent_chat.py）との書き込みを直列にする（Windows では同じプロセス内だけ）
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+CHAT_HISTORY_LOG = "chat_history.jsonl"
+LEGACY_CHAT_HISTORY_FILE = "chat_history.json"
+COMPACT_MIN_DEAD_RECORDS = 200   # これ未満の不要レコードではコンパクションしない
+COMPACT_DEAD_RATIO = 0.5         # 不要レコードが生存レコードのこの割合を超えたらコンパクション
+
+
+class ChatHistoryStore:
+    """
+    Append-only chat history backed by a JSON Lines log.
+
+    Each line is one operation: {"op": "add", "id": n, "message": {...}} or
+    {"op": "del", "id": n}. Appends write a single line (optionally fsync'd),
+    a torn trailing line left by a crash is ignored on load, and the log is
+    rewritten in the background once deleted records pile up. Other processes
+    appending to the same file are picked up by tailing the log on each read.
+    Every write (id assignment included) and the compaction swap run under an
+    flock on a .lock sidecar, so processes sharing the log never hand out the
+    same id or lose an append to a replaced file.
+    """
+
+    def __init__(self, path: str = CHAT_HISTORY_LOG, legacy_json_path: Optional[str] = LEGACY_CHAT_HISTORY_FILE,
+                 fsync: bool = True):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._entries: List[Tuple[int, Dict]] = []  # (id, message) の生存レコード（表示順）
+        self._next_id = 0
+        self._dead = 0
+        self._offset = 0        # ここまでのバイトを読み込み済み
+        self._inode = None
+        self._compacting = False
+        with self._lock, self._file_lock():
+            if not os.path.exists(self.path) and legacy_json_path and os.path.exists(legacy_json_path):
+                self.import_legacy_json(legacy_json_path)
+            self._refresh()
+
+    @contextmanager
+    def _file_lock(self):
+        # ログ本体はコンパクションで置き換わる（inode が変わる）ので、ロックは別ファイルに取る
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    # --- 読み込み ---
+    def _reset(self):
+        self._entries = []
+        self._next_id = 0
+        self._dead = 0
+        self._offset = 0
+
+    def _apply(self, record: Dict):
+        op = record.get("op")
+        if op == "add":
+            self._entries.append((record["id"], record["message"]))
+            self._next_id = max(self._next_id, record["id"] + 1)
+        elif op == "del":
+            target = record["id"]
+            for pos, (entry_id, _) in enumerate(self._entries):
+                if entry_id == target:
+                    del self._entries[pos]
+                    self._dead += 2  # add と del の2レコードが不要になる
+                    break
+
+    def _refresh(self):
+        """Read whatever has been appended since the last call (by any process)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            self._inode = None
+            return
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            # コンパクションなどでファイルが置き換えられた場合は最初から読み直す
+            self._reset()
+            self._inode = st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        consumed = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # 書き込み途中でクラッシュした末尾行は無視する
+            consumed += len(line)
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (json.JSONDecodeError, KeyError) as e:
+                log.warning("Skipping corrupt record in %s: %s", self.path, e)
+                self._dead += 1
+        self._offset += consumed
+
+    # --- 書き込み ---
+    def _write_records(self, records: List[Dict]):
+        # 呼び出し側がファイルロックを持ち、直前に _refresh() している
+        payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        with open(self.path, "ab") as f:
+            if f.tell() > self._offset:
+                # ロック中なので他プロセスの書きかけではなく、クラッシュで途中まで書かれた末尾行。そこまで切り詰める
+                f.truncate(self._offset)
+            f.write(payload)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._refresh()
+
+    def append(self, message: Dict) -> int:
+        return self.append_many([message])[0]
+
+    def append_many(self, messages: List[Dict]) -> List[int]:
+        """Append messages in one write. Returns their ids."""
+        with self._lock, self._file_lock():
+            self._refresh()  # 他プロセスが追記した分を読んでから id を決める
+            now = time.time()
+            ids = list(range(self._next_id, self._next_id + len(messages)))
+            self._write_records([
+                {"op": "add", "id": msg_id, "ts": now, "message": msg}
+                for msg_id, msg in zip(ids, messages)
+            ])
+            return ids
+
+    def delete(self, ids: List[int]):
+        with self._lock, self._file_lock():
+            self._refresh()
+            now = time.time()
+            self._write_records([{"op": "del", "id": msg_id, "ts": now} for msg_id in ids])
+            self._maybe_compact()
+
+    # --- 参照 ---
+    def entries(self) -> List[Tuple[int, Dict]]:
+        with self._lock:
+            self._refresh()
+            return list(self._entries)
+
+    def messages(self) -> List[Dict]:
+        return [msg for _, msg in self.entries()]
+
+    def page(self, cursor: Optional[int] = None, limit: int = 50) -> Dict:
+        """
+        Return the newest `limit` messages older than `cursor` (a message id).
+
+        start_index is the absolute position of the first returned message,
+        which is what DELETE /api/messages/{index} expects. next_cursor is
+        None once the oldest message has been returned.
+        """
+        with self._lock:
+            self._refresh()
+            end = len(self._entries)
+            if cursor is not None:
+                end = bisect.bisect_left(self._entries, cursor, key=lambda entry: entry[0])
+            start = max(0, end - limit)
+            page = self._entries[start:end]
+            return {
+                "messages": [msg for _, msg in page],
+                "ids": [msg_id for msg_id, _ in page],
+                "start_index": start,
+                "total": len(self._entries),
+                "next_cursor": page[0][0] if start > 0 else None,
+            }
+
+    def stat_signature(self) -> Tuple[str, float]:
+        """
+        Cheap change detector for HTTP caching: (etag_base, mtime).
+
+        Uses only os.stat, so an unchanged log can be answered with 304
+        without reading or parsing anything.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return "empty", 0.0
+        return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}", st.st_mtime
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._entries)
+
+    # --- コンパクション ---
+    def _maybe_compact(self):
+        if self._compacting:
+            return
+        if self._dead < max(COMPACT_MIN_DEAD_RECORDS, COMPACT_DEAD_RATIO * len(self._entries)):
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name="chat-store-compact", daemon=True).start()
+
+    def compact(self):
+        """Rewrite the log with only live records, then atomically swap it in."""
+        tmp_path = f"{self.path}.compact.{os.getpid()}.tmp"
+        try:
+            with self._lock:
+                self._refresh()
+                snapshot = list(self._entries)
+                snapshot_offset = self._offset
+                snapshot_inode = self._inode
+            # 生存レコードの書き出しはロックの外で行い、その間の追記を止めない
+            with open(tmp_path, "wb") as f:
+                for msg_id, msg in snapshot:
+                    f.write((json.dumps({"op": "add", "id": msg_id, "message": msg}, ensure_ascii=False) + "\n").encode("utf-8"))
+                # 残りの追記の引き継ぎから置き換えまでは他プロセスの追記も止める（古いファイルへの追記は失われるため）
+                with self._lock, self._file_lock():
+                    self._refresh()
+                    if self._inode != snapshot_inode:
+                        return  # 別プロセスが先にコンパクションした
+                    if self._offset > snapshot_offset:
+                        # スナップショット以降に追記されたレコードをそのまま引き継ぐ
+                        with open(self.path, "rb") as src:
+                            src.seek(snapshot_offset)
+                            f.write(src.read(self._offset - snapshot_offset))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    os.replace(tmp_path, self.path)
+                    self._refresh()
+            log.info("Compacted %s: %d live messages", self.path, len(self._entries))
+        except Exception as e:
+            log.exception("EXCEPTION in ChatHistoryStore.compact: %s", e)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self._compacting = False
+
+    # --- 旧形式からの移行 ---
+    def import_legacy_json(self, json_path: str) -> int:
+        """Import a chat_history.json list into an empty log. Returns the number of messages imported."""
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                messages = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning("Could not import %s: %s", json_path, e)
+            return 0
+        if not isinstance(messages, list):
+            return 0
+        tmp_path = self.path + ".import.tmp"
+        now = time.time()
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for msg_id, msg in enumerate(messages):
+                f.write(json.dumps({"op": "add", "id": msg_id, "ts": now, "message": msg}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        log.info("Imported %d messages from %s into %s", len(messages), json_path, self.path)
+        return len(messages)
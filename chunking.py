@@ -0,0 +1,142 @@
+# chunking.py
+# 書籍テキストを文単位に分割し、目標トークン数まで詰めたチャンク（前後に重なりあり）にまとめる
+# 1行=1文書だと短いベクトルばかりになり、n_results=3 でも断片しか返らないため
+import re
+import zlib
+from typing import Callable, Iterable, Iterator, List, NamedTuple, TextIO
+
+CHUNK_TOKENS = 200    # all-MiniLM-L6-v2 の最大長(256)に収まる目標サイズ
+OVERLAP_TOKENS = 40   # 前のチャンクの末尾を次のチャンクの先頭に重ねる量
+ANCHOR_EVERY = 4      # 平均して何文に1つをチャンクの区切り候補にするか
+
+# 文末: 日本語の句点・感嘆符・疑問符（全角/半角）と、それに続く閉じ括弧
+_SENTENCE_END = re.compile(r"[。．！？!?]+[」』）)】〉》\"']*|\.(?=\s)")
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff66-\uff9f]")
+_WORD = re.compile(r"[A-Za-z0-9]+")
+
+
+class Sentence(NamedTuple):
+    text: str
+    start: int  # 元テキスト先頭からの文字オフセット
+    end: int
+
+
+class Chunk(NamedTuple):
+    text: str
+    start: int
+    end: int
+    index: int
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Model-independent token estimate for a BERT-style tokenizer.
+
+    CJK characters are about one token each and ASCII words about 1.3. The
+    estimate is deterministic, so chunk boundaries (and the content-hash ids
+    built from them) do not depend on which embedder is loaded.
+    """
+    cjk = len(_CJK.findall(text))
+    words = _WORD.findall(text)
+    return cjk + sum(1 + len(w) // 6 for w in words) + sum(1 for ch in text if not ch.isspace() and not ch.isalnum())
+
+
+def iter_sentences(lines: Iterable[str]) -> Iterator[Sentence]:
+    """
+    Split a stream of lines into sentences, tracking character offsets.
+
+    A sentence ends at a sentence-final mark or at a paragraph break (blank
+    line). A line break inside a paragraph also ends the sentence, since the
+    book text is mostly one sentence or utterance per line.
+    """
+    offset = 0
+    for line in lines:
+        body = line.rstrip("\r\n")
+        pos = 0
+        for match in _SENTENCE_END.finditer(body):
+            yield from _sentence(body, pos, match.end(), offset)
+            pos = match.end()
+        yield from _sentence(body, pos, len(body), offset)
+        offset += len(line)
+
+
+def _sentence(body: str, start: int, end: int, offset: int) -> Iterator[Sentence]:
+    raw = body[start:end]
+    text = raw.strip()
+    if text:
+        lead = len(raw) - len(raw.lstrip())
+        yield Sentence(text, offset + start + lead, offset + start + lead + len(text))
+
+
+def _split_long(sentence: Sentence, max_tokens: int, count_tokens: Callable[[str], int]) -> Iterator[Sentence]:
+    # 目標サイズを超える1文は文字数で切る
+    if count_tokens(sentence.text) <= max_tokens:
+        yield sentence
+        return
+    step = max(1, int(len(sentence.text) * max_tokens / count_tokens(sentence.text)))
+    for i in range(0, len(sentence.text), step):
+        part = sentence.text[i:i + step]
+        yield Sentence(part, sentence.start + i, sentence.start + i + len(part))
+
+
+def _is_anchor(sentence: Sentence) -> bool:
+    return zlib.crc32(sentence.text.encode("utf-8")) % ANCHOR_EVERY == 0
+
+
+def pack_sentences(sentences: Iterable[Sentence], max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS,
+                   count_tokens: Callable[[str], int] = approximate_tokens) -> Iterator[Chunk]:
+    """
+    Pack sentences into chunks of at most max_tokens, repeating up to
+    overlap_tokens of trailing context at the start of the next chunk.
+
+    Once a chunk holds max_tokens // 2 it is closed after an "anchor"
+    sentence, chosen by a hash of the sentence text. Boundaries therefore
+    depend on local content rather than on the position in the book, so an
+    edit only changes the chunks around it and incremental re-ingestion
+    re-embeds little.
+    """
+    min_tokens = max_tokens // 2
+    window: List[Sentence] = []
+    sizes: List[int] = []
+    fresh = 0  # window のうち、まだどのチャンクにも出していない文の数
+    index = 0
+
+    def carry(next_size: int):
+        # 末尾から overlap_tokens 以内の文だけを次のチャンクへ持ち越す
+        nonlocal window, sizes, fresh
+        keep, kept = 0, 0
+        while keep < len(window) and kept + sizes[-1 - keep] <= overlap_tokens:
+            kept += sizes[-1 - keep]
+            keep += 1
+        while keep and kept + next_size > max_tokens:
+            kept -= sizes[-keep]
+            keep -= 1
+        window, sizes = (window[-keep:], sizes[-keep:]) if keep else ([], [])
+        fresh = 0
+
+    for long_sentence in sentences:
+        for sentence in _split_long(long_sentence, max_tokens, count_tokens):
+            size = count_tokens(sentence.text)
+            if window and sum(sizes) + size > max_tokens:
+                if fresh:
+                    yield Chunk("\n".join(s.text for s in window), window[0].start, window[-1].end, index)
+                    index += 1
+                carry(size)
+            window.append(sentence)
+            sizes.append(size)
+            fresh += 1
+            if sum(sizes) >= min_tokens and _is_anchor(sentence):
+                yield Chunk("\n".join(s.text for s in window), window[0].start, window[-1].end, index)
+                index += 1
+                carry(0)
+    if window and fresh:
+        yield Chunk("\n".join(s.text for s in window), window[0].start, window[-1].end, index)
+
+
+def chunk_stream(f: TextIO, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS) -> Iterator[Chunk]:
+    """Chunk an open text file without reading it into memory."""
+    return pack_sentences(iter_sentences(f), max_tokens, overlap_tokens)
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS) -> List[Chunk]:
+    return list(pack_sentences(iter_sentences(text.splitlines(keepends=True)), max_tokens, overlap_tokens))
@@ -0,0 +1,178 @@
+# conversation_memory.py
+# 音声エージェント用の会話メモリ: 直近N往復はそのまま、それより古い発言は要約にまとめて送る
+# 要約はターンの合間にバックグラウンドで少しずつ更新し、ディスクにキャッシュするので、
+# 履歴がどれだけ長くなってもプロンプトの大きさはほぼ一定になる
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prompt_budget import truncate_to_tokens
+
+MEMORY_KEEP_TURNS = int(os.getenv("MEMORY_KEEP_TURNS", "4"))       # そのまま送る直近の往復数
+MEMORY_FOLD_MESSAGES = int(os.getenv("MEMORY_FOLD_MESSAGES", "6"))  # これだけ溜まったら要約に畳み込む
+MEMORY_SUMMARY_TOKENS = 600                                         # 要約の長さの上限
+MEMORY_MAX_BACKLOG = 40   # 初回に要約する古い発言の上限（それより前は要約しない）
+SUMMARY_CACHE_FILE = "conversation_summary.json"
+
+SUMMARY_PROMPT = (
+    "あなたは会話の記録係です。以下の【これまでの要約】に【新しい会話】の内容を反映し、"
+    "ユーザーの関心・決まったこと・未解決の質問が分かるよう、日本語で簡潔な要約を作り直してください。"
+    f"要約は{MEMORY_SUMMARY_TOKENS}文字以内で、要約文だけを出力してください。\n\n"
+    "【これまでの要約】\n{summary}\n\n【新しい会話】\n{conversation}"
+)
+
+
+def message_text(msg: Dict) -> str:
+    content = msg.get("content")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def text_message(role: str, text: str) -> Dict:
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+def history_key(entries: List[Tuple[int, Dict]]) -> Optional[str]:
+    """Identify a chat history by its first entry, so a summary is never applied to a reset or replaced history."""
+    if not entries:
+        return None
+    first_id, first = entries[0]
+    digest = hashlib.sha1(json.dumps(first, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{first_id}:{digest[:16]}"
+
+
+class ConversationMemory:
+    """
+    Bounded conversation context: rolling summary + last keep_turns turns.
+
+    Messages are (entry id, message) pairs from ChatHistoryStore. Once more
+    than MEMORY_FOLD_MESSAGES messages have fallen out of the verbatim window,
+    a background thread folds them into the summary with summarize(prompt).
+    The summary and the id it covers are cached in SUMMARY_CACHE_FILE together
+    with history_key() of the history it summarizes, so a restart only folds
+    what is new; a cache from another (e.g. reset) history is discarded.
+    context() never sends more than keep_messages + fold_messages
+    unsummarized messages, and at most keep_messages + MEMORY_MAX_BACKLOG are
+    held, so memory and prompt stay bounded even while summarizing keeps failing.
+    """
+
+    def __init__(self, summarize: Callable[[str], str], entries: List[Tuple[int, Dict]],
+                 keep_turns: int = MEMORY_KEEP_TURNS, fold_messages: int = MEMORY_FOLD_MESSAGES,
+                 cache_path: str = SUMMARY_CACHE_FILE):
+        self.summarize = summarize
+        self.keep_messages = keep_turns * 2
+        self.fold_messages = fold_messages
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+        self._pending: Optional[Future] = None
+        self.summary = ""
+        self.summarized_upto = -1  # この id までの発言は要約に含まれている
+        self._history_key = history_key(entries)
+        self._load_cache(entries)
+        self._messages: List[Tuple[int, Dict]] = [(i, m) for i, m in entries if i > self.summarized_upto]
+        self._trim_backlog()
+        self.schedule_summary()
+
+    def _trim_backlog(self):
+        # 要約したことのない長い履歴や、要約が失敗し続けて溜まった発言は、直近 MEMORY_MAX_BACKLOG 件だけを
+        # 要約の対象にする（それより前は要約せずに捨てる）
+        limit = self.keep_messages + MEMORY_MAX_BACKLOG
+        if len(self._messages) > limit:
+            self._messages = self._messages[-limit:]
+            self.summarized_upto = self._messages[0][0] - 1
+
+    # --- ディスクキャッシュ ---
+    def _load_cache(self, entries: List[Tuple[int, Dict]]):
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            summarized_upto = int(cached.get("summarized_upto", -1))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"要約キャッシュの読み込みに失敗: {e}")
+            return
+        # 履歴が消されたり作り直されたりした後の要約は、今の履歴の要約ではない
+        # （id は 0 から振り直されるので、先頭の発言で同じ履歴かを見分ける）
+        if (cached.get("history") != self._history_key or not entries
+                or summarized_upto > entries[-1][0]):
+            print("要約キャッシュは別の会話履歴のものなので使わない")
+            return
+        self.summary = cached.get("summary", "")
+        self.summarized_upto = summarized_upto
+
+    def _save_cache(self):
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary, "summarized_upto": self.summarized_upto,
+                       "history": self._history_key, "updated": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    # --- 会話の追加と取り出し ---
+    def add(self, ids: List[int], messages: List[Dict]):
+        with self._lock:
+            if self._history_key is None:
+                self._history_key = history_key(list(zip(ids, messages)))
+            self._messages.extend(zip(ids, messages))
+            self._trim_backlog()
+        self.schedule_summary()
+
+    def context(self, new_messages: List[Dict]) -> List[Dict]:
+        """Messages to send: summary (as a system message), the latest unsummarized turns, then new_messages."""
+        with self._lock:
+            summary = self.summary
+            # 要約が失敗し続けても（Ollama が落ちているなど）プロンプトが伸び続けないよう、
+            # 送るのは直近の keep_messages 件と、畳み込み待ちの fold_messages 件までにする
+            start = max(len(self._messages) - (self.keep_messages + self.fold_messages), 0)
+            recent = [m for _, m in self._messages[start:]]
+        context = []
+        if summary:
+            context.append(text_message("system", f"これまでの会話の要約:\n{summary}"))
+        return context + recent + new_messages
+
+    # --- バックグラウンドでの要約 ---
+    def _overflow(self) -> List[Tuple[int, Dict]]:
+        with self._lock:
+            return self._messages[:max(len(self._messages) - self.keep_messages, 0)]
+
+    def schedule_summary(self) -> Optional[Future]:
+        if len(self._overflow()) < self.fold_messages:
+            return None
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return self._pending
+            self._pending = self._executor.submit(self._fold)
+            return self._pending
+
+    def _fold(self):
+        while True:
+            overflow = self._overflow()[:MEMORY_MAX_BACKLOG]
+            if len(overflow) < self.fold_messages:
+                return
+            conversation = "\n".join(
+                f"{'ユーザー' if m.get('role') == 'user' else 'アシスタント'}: {message_text(m)}" for _, m in overflow
+            )
+            started = time.perf_counter()
+            try:
+                summary = self.summarize(SUMMARY_PROMPT.format(summary=self.summary or "（なし）", conversation=conversation))
+            except Exception as e:
+                print(f"会話の要約に失敗: {e}")
+                traceback.print_exc()
+                return
+            summary = truncate_to_tokens(summary.strip(), MEMORY_SUMMARY_TOKENS)
+            with self._lock:
+                self.summary = summary
+                self.summarized_upto = overflow[-1][0]
+                self._messages = [(i, m) for i, m in self._messages if i > self.summarized_upto]
+            self._save_cache()
+            print(f"（会話の要約を更新: {len(overflow)} 件を {time.perf_counter() - started:.1f}秒で反映）")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
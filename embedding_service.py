@@ -0,0 +1,152 @@
+# embedding_service.py
+# 同時に届いた埋め込み要求を数ミリ秒だけ待ってまとめ、1回の embedder.encode でバッチ処理するサービス
+# MiniLM はCPUでもバッチの行列演算が速いため、1件ずつ encode するよりスループットが上がる
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List
+
+import numpy as np
+
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))       # 1回の encode にまとめる最大件数
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))  # 最初の要求からバッチを閉じるまでの最大待ち時間
+
+
+class _Request:
+    __slots__ = ("texts", "future", "enqueued")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class EmbeddingService:
+    """
+    Micro-batching front end for a SentenceTransformer-like embedder.
+
+    encode() has the same shape as embedder.encode(texts) (returns an ndarray)
+    but small concurrent requests are coalesced for up to max_wait_ms, or
+    until max_batch texts are queued, and encoded together on one worker
+    thread. Requests that are already max_batch or larger (bulk ingestion)
+    are encoded directly on the caller's thread.
+    """
+
+    def __init__(self, embedder, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Dict[int, int] = {}
+        self._batches = 0
+        self._texts = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._waited_requests = 0
+        self._encode_seconds = 0.0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    # --- 呼び出し側 ---
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        if len(texts) >= self.max_batch or kwargs:
+            return self._encode_now(texts, **kwargs)
+        return self.submit(texts).result()
+
+    def submit(self, texts: List[str]) -> Future:
+        if self._closed:
+            raise RuntimeError("EmbeddingService is closed")
+        request = _Request(list(texts))
+        self._queue.put(request)
+        return request.future
+
+    async def aencode(self, texts: List[str]) -> np.ndarray:
+        if len(texts) >= self.max_batch:
+            return await asyncio.get_running_loop().run_in_executor(None, self._encode_now, texts)
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _encode_now(self, texts: List[str], **kwargs) -> np.ndarray:
+        kwargs.setdefault("batch_size", self.max_batch)
+        started = time.perf_counter()
+        vectors = np.asarray(self.embedder.encode(texts, **kwargs))
+        self._record(len(texts), [], time.perf_counter() - started)
+        return vectors
+
+    # --- バッチ処理スレッド ---
+    def _collect(self) -> List[_Request]:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        count = len(first.texts)
+        deadline = first.enqueued + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                # 期限切れでも、既に積まれている要求は待たずにまとめる
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # close() の合図は次のループで処理する
+                break
+            batch.append(request)
+            count += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+            texts = [text for request in batch for text in request.texts]
+            started = time.perf_counter()
+            try:
+                vectors = np.asarray(self.embedder.encode(texts, batch_size=max(len(texts), 1)))
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            self._record(len(texts), [started - r.enqueued for r in batch], time.perf_counter() - started)
+            offset = 0
+            for request in batch:
+                request.future.set_result(vectors[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    # --- 計測 ---
+    def _record(self, size: int, waits: List[float], encode_seconds: float):
+        with self._stats_lock:
+            self._batches += 1
+            self._texts += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._encode_seconds += encode_seconds
+            for wait in waits:
+                self._queue_wait_total += wait
+                self._queue_wait_max = max(self._queue_wait_max, wait)
+            self._waited_requests += len(waits)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            waited = self._waited_requests
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "texts": self._texts,
+                "mean_batch_size": round(self._texts / self._batches, 2) if self._batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+                "queue_wait_ms_mean": round(self._queue_wait_total / waited * 1000, 3) if waited else 0.0,
+                "queue_wait_ms_max": round(self._queue_wait_max * 1000, 3),
+                "encode_seconds_total": round(self._encode_seconds, 3),
+                "queued": self._queue.qsize(),
+            }
@@ -0,0 +1,287 @@
+# fake_llm_server.py
+# OllamaとGemini(REST)のAPIを真似るローカル用のスタブサーバー
+# 実際のモデルなしで、ストリーミングのTTFT(最初のトークンまでの時間)や負荷試験を確認するために使う
+#
+# 使い方:
+#   python fake_llm_server.py --port 11434 --first-token-delay 0.5 --tokens-per-second 20
+#   python fake_llm_server.py --load-delay 3     # モデルが読み込まれていない時の読み込み時間を再現する
+#   python fake_llm_server.py --gemini-first-token-delay 1 --fail-rate 0.1 --rate-limit-rate 0.2   # llm_router の確認用
+#   OLLAMA_API_BASE=http://127.0.0.1:11434 GEMINI_API_ENDPOINT=http://127.0.0.1:11434 GEMINI_API_KEY=dummy \
+#       uvicorn api_server:app --port 8001
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "これはテスト用のスタブ応答です。ストーリーは登場人物の行動と反応の積み重ねで進みます。"
+DEFAULT_KEEP_ALIVE = 300.0  # Ollama の既定値（5分）
+
+
+def keep_alive_seconds(value) -> float:
+    """Ollama keep_alive ("30m", "1h", "300", 300, -1) in seconds; negative means forever."""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)([smh]?)", str(value).strip())
+    if not match:
+        return DEFAULT_KEEP_ALIVE
+    return float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+class FakeLLMConfig:
+    def __init__(self, first_token_delay=0.2, tokens_per_second=50.0, reply=DEFAULT_REPLY, load_delay=0.0,
+                 gemini_first_token_delay=None, fail_rate=0.0, rate_limit_rate=0.0, retry_after=1):
+        self.first_token_delay = first_token_delay
+        self.gemini_first_token_delay = first_token_delay if gemini_first_token_delay is None else gemini_first_token_delay
+        self.fail_rate = fail_rate              # この割合で 500 を返す
+        self.rate_limit_rate = rate_limit_rate  # この割合で 429（Retry-After 付き）を返す
+        self.retry_after = retry_after
+        self.failures = Counter()
+        self.tokens_per_second = tokens_per_second
+        self.reply = reply
+        self.load_delay = load_delay
+        self.requests = 0
+        self.loads = 0
+        self.loaded_until = {}  # model -> 常駐が切れる時刻（monotonic）
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def ensure_loaded(self, model, keep_alive) -> float:
+        """Simulate loading the model if it is not resident; returns the load time in seconds."""
+        seconds = keep_alive_seconds(keep_alive)
+        with self.load_lock:
+            now = time.monotonic()
+            load = 0.0
+            if self.loaded_until.get(model, 0.0) <= now:
+                time.sleep(self.load_delay)
+                load = self.load_delay
+                self.loads += 1
+            # keep_alive=0 は応答後すぐに解放、負の値は無期限に常駐
+            self.loaded_until[model] = float("inf") if seconds < 0 else time.monotonic() + seconds
+            return load
+
+    def tokens(self):
+        # 日本語は1文字≒1トークンとして扱い、2文字ずつ返す
+        return [self.reply[i:i + 2] for i in range(0, len(self.reply), 2)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = FakeLLMConfig()
+
+    def log_message(self, format, *args):
+        pass  # アクセスログは負荷試験の邪魔になるので出さない
+
+    # --- 共通 ---
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _begin_generation(self, delay=None):
+        """Count the request and wait out the simulated time to first token."""
+        cfg = self.config
+        with cfg.lock:
+            cfg.requests += 1
+        time.sleep(cfg.first_token_delay if delay is None else delay)
+
+    def _inject_failure(self, gemini) -> bool:
+        """Answer with a simulated 429 or 500 (at the configured rates) instead of generating."""
+        cfg = self.config
+        roll = random.random()
+        if roll < cfg.rate_limit_rate:
+            status, reason = 429, "rate_limited"
+        elif roll < cfg.rate_limit_rate + cfg.fail_rate:
+            status, reason = 500, "failed"
+        else:
+            return False
+        with cfg.lock:
+            cfg.failures[reason] += 1
+        if gemini:
+            payload = {"error": {"code": status, "message": reason,
+                                 "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}}
+        else:
+            payload = {"error": reason}
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", str(cfg.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def _token_interval(self):
+        return 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._send_json(200, {"models": [{"name": "qwen2:7b", "model": "qwen2:7b"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+        if self.path.startswith("/api/chat") or self.path.startswith("/api/generate"):
+            self._ollama(payload, chat=self.path.startswith("/api/chat"))
+        elif re.match(r"^/v1beta/models/[^:]+:streamGenerateContent", self.path):
+            self._gemini(stream=True)
+        elif re.match(r"^/v1beta/models/[^:]+:generateContent", self.path):
+            self._gemini(stream=False)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    # --- Ollama ---
+    def _ollama(self, payload, chat):
+        model = payload.get("model", "qwen2:7b")
+        started = time.perf_counter()
+        load = self.config.ensure_loaded(model, payload.get("keep_alive"))
+        if not chat and not payload.get("prompt"):
+            # プロンプトなしの /api/generate はモデルを読み込むだけ（プリロード）
+            self._send_json(200, {"model": model, "created_at": _now(), "response": "", "done": True,
+                                  "done_reason": "load"})
+            return
+        if self._inject_failure(gemini=False):
+            return
+        self._begin_generation()
+        tokens = self.config.tokens()
+
+        def frame(text, done):
+            item = {"model": model, "created_at": _now(), "done": done}
+            if chat:
+                item["message"] = {"role": "assistant", "content": text}
+            else:
+                item["response"] = text
+            if done:
+                item.update({
+                    "done_reason": "stop",
+                    "total_duration": int((time.perf_counter() - started) * 1e9),
+                    "load_duration": int(load * 1e9),
+                    "prompt_eval_count": 10,
+                    "eval_count": len(tokens),
+                })
+            return item
+
+        if not payload.get("stream", True):
+            time.sleep(self._token_interval() * len(tokens))
+            self._send_json(200, frame(self.config.reply, True))
+            return
+        self._start_chunked("application/x-ndjson")
+        interval = self._token_interval()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(interval)
+            self._write_chunk((json.dumps(frame(token, False), ensure_ascii=False) + "\n").encode("utf-8"))
+        self._write_chunk((json.dumps(frame("", True), ensure_ascii=False) + "\n").encode("utf-8"))
+        self._end_chunked()
+
+    # --- Gemini (REST) ---
+    def _gemini(self, stream):
+        if self._inject_failure(gemini=True):
+            return
+        self._begin_generation(self.config.gemini_first_token_delay)
+        tokens = self.config.tokens()
+
+        def candidate(text, finished):
+            item = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+            if finished:
+                item["candidates"][0]["finishReason"] = "STOP"
+                item["usageMetadata"] = {"promptTokenCount": 10, "candidatesTokenCount": len(tokens),
+                                         "totalTokenCount": 10 + len(tokens)}
+            return item
+
+        if not stream:
+            time.sleep(self._token_interval() * len(tokens))
+            self._send_json(200, candidate(self.config.reply, True))
+            return
+        # alt=sse の場合はSSE、それ以外（google-generativeai のRESTトランスポート）はJSON配列を少しずつ返す
+        sse = "alt=sse" in self.path
+        self._start_chunked("text/event-stream" if sse else "application/json")
+        interval = self._token_interval()
+        if not sse:
+            self._write_chunk(b"[")
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(interval)
+            frame = json.dumps(candidate(token, i == len(tokens) - 1), ensure_ascii=False)
+            if sse:
+                self._write_chunk(f"data: {frame}\r\n\r\n".encode("utf-8"))
+            else:
+                self._write_chunk(((",\n" if i else "") + frame).encode("utf-8"))
+        if not sse:
+            self._write_chunk(b"]")
+        self._end_chunked()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def make_server(host="127.0.0.1", port=11434, config=None) -> ThreadingHTTPServer:
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {"config": config or FakeLLMConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama / Gemini server for local testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--load-delay", type=float, default=0.0,
+                        help="seconds to 'load' a model that is not resident (honours keep_alive)")
+    parser.add_argument("--gemini-first-token-delay", type=float, help="defaults to --first-token-delay")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction answered with 429 + Retry-After")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+    config = FakeLLMConfig(args.first_token_delay, args.tokens_per_second, args.reply, args.load_delay,
+                           args.gemini_first_token_delay, args.fail_rate, args.rate_limit_rate, args.retry_after)
+    server = make_server(args.host, args.port, config)
+    print(f"Fake LLM server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
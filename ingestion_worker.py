@@ -0,0 +1,235 @@
+# ingestion_worker.py
+# 検証済みの質問/回答を api_server のプロセス内で validated_responses_store に取り込むバックグラウンドワーカー
+# save_responses_to_chroma.py を別プロセスで起動する代わりに、asyncio のキューで受け取り
+# バッチが埋まるかタイマーが切れたら、読み込み済みの埋め込みモデルでまとめて Chroma に保存する
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+from semantic_cache import VALIDATED_RESPONSES_COLLECTION, QA_KIND, parse_validated_line, validated_id
+
+log = logging.getLogger(__name__)
+
+INGEST_JOURNAL = os.getenv("INGEST_JOURNAL", "ingest_journal.jsonl")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "16"))          # この件数たまったら即保存
+INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "5"))   # 最初の1件からこの秒数で保存
+INGEST_RETRY_SECONDS = 10.0
+LEGACY_VALIDATED_FILE = "validated_responses.txt"
+
+
+class IngestionJournal:
+    """
+    Small JSONL journal of records that are queued but not yet in Chroma.
+
+    "add" lines are written (and fsynced) before a record is queued; a "done"
+    line lists the ids of each flushed batch. Whatever has no "done" line is
+    pending and is replayed on the next start. The file is truncated whenever
+    nothing is pending.
+    """
+
+    def __init__(self, path: str = INGEST_JOURNAL):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _append(self, record: Dict):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, record: Dict):
+        self._append({"op": "add", **record})
+
+    def done(self, ids: List[str]):
+        self._append({"op": "done", "ids": ids})
+
+    def pending(self) -> List[Dict]:
+        added: Dict[str, Dict] = {}
+        if not os.path.exists(self.path):
+            return []
+        with self._lock, open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # 書き込み途中で止まった末尾行
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("op") == "add":
+                    added[record["id"]] = {k: v for k, v in record.items() if k != "op"}
+                elif record.get("op") == "done":
+                    for record_id in record.get("ids", []):
+                        added.pop(record_id, None)
+        return list(added.values())
+
+    def truncate(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                open(self.path, "w").close()
+
+
+class IngestionWorker:
+    """
+    Background task that batches validated answers into Chroma.
+
+    submit() journals the record and puts it on an asyncio.Queue. The worker
+    flushes when INGEST_BATCH_SIZE records are waiting or INGEST_FLUSH_SECONDS
+    after the first one, using the registry's embedder, and invalidates the
+    retrieval cache of the collection. stop() drains the queue.
+    """
+
+    def __init__(self, journal_path: str = INGEST_JOURNAL, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_seconds: float = INGEST_FLUSH_SECONDS, collection_name: str = VALIDATED_RESPONSES_COLLECTION):
+        self.journal = IngestionJournal(journal_path)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.collection_name = collection_name
+        self._queue = None
+        self._task = None
+        self._batch: List[Dict] = []  # キューから取り出し済みでまだ保存していないレコード
+        self._outstanding = 0         # ジャーナルに書いたがまだ保存していないレコード数
+        self._outstanding_lock = threading.Lock()
+        self._resources = None
+        self._blocking = None
+        self.submitted = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_flush_seconds = 0.0
+
+    async def start(self, resources, blocking_pool):
+        """Replay the journal (and any legacy validated_responses.txt) and start the worker task."""
+        self._resources = resources
+        self._blocking = blocking_pool
+        self._queue = asyncio.Queue()
+        recovered = await blocking_pool.run(self.journal.pending)
+        recovered += await blocking_pool.run(self._import_legacy_file)
+        self._outstanding += len(recovered)
+        for record in recovered:
+            self._queue.put_nowait(record)
+        if self._queue.qsize():
+            log.info("Ingestion: %d pending records recovered", self._queue.qsize())
+        self._task = asyncio.create_task(self._run())
+
+    def _import_legacy_file(self) -> List[Dict]:
+        # 旧バージョンが validated_responses.txt に残した回答もジャーナル経由で取り込む
+        if not os.path.exists(LEGACY_VALIDATED_FILE):
+            return []
+        with open(LEGACY_VALIDATED_FILE, encoding="utf-8") as f:
+            parsed = [record for record in map(parse_validated_line, f) if record]
+        records = []
+        for item in parsed:
+            record = self._new_record(item["question"], item["answer"])
+            self.journal.add(record)
+            records.append(record)
+        open(LEGACY_VALIDATED_FILE, "w").close()
+        return records
+
+    def _new_record(self, question: str, answer: str) -> Dict:
+        # id は内容のハッシュ（bulk_ingest.py と同じ）。同じ組を何度受け取っても1件になる
+        return {"id": validated_id(question, answer), "question": question.strip(), "answer": answer.strip()}
+
+    async def submit(self, question: str, answer: str):
+        record = self._new_record(question, answer)
+        with self._outstanding_lock:
+            self._outstanding += 1
+        await self._blocking.run(self.journal.add, record)
+        self.submitted += 1
+        await self._queue.put(record)
+
+    async def _collect(self) -> List[Dict]:
+        batch = self._batch
+        batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            while True:
+                try:
+                    await self._flush(batch)
+                    self._batch = []
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # 失敗したバッチはジャーナルに残っているので、少し待って再試行する
+                    self.failures += 1
+                    log.exception("Ingestion flush failed (%d records): %s", len(batch), e)
+                    await asyncio.sleep(INGEST_RETRY_SECONDS)
+
+    async def _flush(self, batch: List[Dict]):
+        while not self._resources.ready:
+            await asyncio.sleep(1)  # モデルの読み込みが終わるまで待つ
+        started = time.perf_counter()
+        await self._blocking.run(self._write_batch, batch)
+        self.last_flush_seconds = time.perf_counter() - started
+        self.flushed += len(batch)
+        self.batches += 1
+        log.info("Ingestion: saved %d records to '%s' in %.3fs", len(batch), self.collection_name, self.last_flush_seconds)
+
+    def _write_batch(self, batch: List[Dict]):
+        resources = self._resources
+        unique = list({r["id"]: r for r in batch}.values())  # 同じ組が同じバッチに2回来ることもある
+        # 質問がある回答は質問文を埋め込む（意味キャッシュが質問同士の近さで検索するため）
+        embeddings = resources.embedding_service.encode([r["question"] or r["answer"] for r in unique]).tolist()
+        metadatas = [{"kind": QA_KIND, "question": r["question"]} if r["question"] else {"kind": "answer"} for r in unique]
+        collection = resources.collection(self.collection_name)
+        # ジャーナルの再生や登録済みの組で同じidが来ても重複しないよう upsert にする
+        collection.upsert(
+            ids=[r["id"] for r in unique],
+            documents=[r["answer"] for r in unique],
+            embeddings=embeddings,
+            metadatas=metadatas,
+        )
+        resources.retrieval.invalidate(self.collection_name)
+        with self._outstanding_lock:
+            self.journal.done([r["id"] for r in batch])
+            self._outstanding -= len(batch)
+            if self._outstanding <= 0:
+                self.journal.truncate()
+
+    async def stop(self):
+        """Flush everything still queued, then stop the worker task."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        remaining, self._batch = self._batch, []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        if remaining and self._resources.ready:
+            try:
+                await self._flush(remaining)
+            except Exception as e:
+                log.error("Ingestion drain failed, %d records stay in %s: %s", len(remaining), self.journal.path, e)
+
+    def stats(self) -> Dict:
+        return {
+            "submitted": self.submitted,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "last_flush_seconds": round(self.last_flush_seconds, 3),
+        }
+
+
+ingestion = IngestionWorker()
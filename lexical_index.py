@@ -0,0 +1,164 @@
+# lexical_index.py
+# 文字n-gram（既定はバイグラム）のBM25転置インデックス
+# 「シーンについて」のような短い日本語キーワードは all-MiniLM-L6-v2 ではうまく埋め込めないため、
+# ベクトル検索と並べて使い、Reciprocal Rank Fusion で順位を統合する
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+LEXICAL_NGRAM = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60                 # Reciprocal Rank Fusion の定数
+SYNC_PAGE_SIZE = 5000
+
+# 質問の末尾に付く定型句（キーワードだけの質問かどうかの判定で取り除く）
+_QUESTION_SUFFIX = re.compile(r"(について|に関して|とは|って何|ってなに|とは何|は何|の意味|を教えて(ください)?|について教えて(ください)?)?"
+                              r"(です|ですか)?[?？。！!\s]*$")
+_SEPARATOR = re.compile(r"[\s\W_]+")
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: str, n: int = LEXICAL_NGRAM) -> List[str]:
+    """Character n-grams within each run of word characters (runs shorter than n are kept whole)."""
+    terms = []
+    for run in _SEPARATOR.split(normalize(text)):
+        if not run:
+            continue
+        if len(run) <= n:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return terms
+
+
+def keyword_of(query: str) -> Optional[str]:
+    """
+    Return the keyword if the query is just a keyword plus a question phrase
+    ("シーンについて" -> "シーン"), otherwise None.
+    """
+    stripped = _QUESTION_SUFFIX.sub("", normalize(query).strip())
+    if not stripped or _SEPARATOR.search(stripped) or len(stripped) > 12:
+        return None
+    return stripped
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over character n-grams.
+
+    Documents are keyed by the same ids as the Chroma collection. sync()
+    brings the index in line with a collection by adding and removing ids,
+    so it follows whatever the ingestion scripts wrote.
+    """
+
+    def __init__(self, n: int = LEXICAL_NGRAM):
+        self.n = n
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._texts: Dict[str, str] = {}
+        self._metadatas: Dict[str, Dict] = {}
+        self._total_len = 0
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __contains__(self, doc_id: str):
+        return doc_id in self._texts
+
+    def add(self, ids: List[str], documents: List[str], metadatas: Optional[List[Dict]] = None):
+        with self._lock:
+            for i, (doc_id, text) in enumerate(zip(ids, documents)):
+                if doc_id in self._texts:
+                    self._remove_one(doc_id)
+                terms = Counter(tokenize(text, self.n))
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+                self._doc_terms[doc_id] = terms
+                self._texts[doc_id] = text
+                self._metadatas[doc_id] = (metadatas[i] if metadatas else None) or {}
+                self._doc_len[doc_id] = sum(terms.values())
+                self._total_len += self._doc_len[doc_id]
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._texts:
+                    self._remove_one(doc_id)
+
+    def _remove_one(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+        del self._texts[doc_id]
+        del self._metadatas[doc_id]
+
+    def sync(self, collection) -> Tuple[int, int]:
+        """Add ids that are in the collection but not indexed, drop the ones that are gone."""
+        ids = []
+        offset = 0
+        while True:
+            page = collection.get(include=[], limit=SYNC_PAGE_SIZE, offset=offset)
+            ids.extend(page["ids"])
+            if len(page["ids"]) < SYNC_PAGE_SIZE:
+                break
+            offset += SYNC_PAGE_SIZE
+        current = set(ids)
+        with self._lock:
+            removed = [doc_id for doc_id in self._texts if doc_id not in current]
+        added = [doc_id for doc_id in ids if doc_id not in self._texts]
+        self.remove(removed)
+        for start in range(0, len(added), SYNC_PAGE_SIZE):
+            page = collection.get(ids=added[start:start + SYNC_PAGE_SIZE], include=["documents", "metadatas"])
+            self.add(page["ids"], [doc or "" for doc in page["documents"]], page["metadatas"])
+        return len(added), len(removed)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        terms = set(tokenize(query, self.n))
+        with self._lock:
+            n_docs = len(self._texts)
+            if not n_docs or not terms:
+                return []
+            avg_len = self._total_len / n_docs
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def containing(self, keyword: str, k: int) -> List[str]:
+        """Ids of documents that contain the keyword verbatim, best BM25 first."""
+        keyword = normalize(keyword)
+        with self._lock:
+            return [doc_id for doc_id, _ in self.search(keyword, max(k * 4, 20))
+                    if keyword in normalize(self._texts[doc_id])][:k]
+
+    def documents(self, ids: List[str]) -> Tuple[List[str], List[Dict]]:
+        with self._lock:
+            return [self._texts[i] for i in ids], [self._metadatas[i] for i in ids]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
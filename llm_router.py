@@ -0,0 +1,317 @@
+# llm_router.py
+# Ollama と Gemini のどちらで回答するかをリクエストごとに選ぶルーター
+# バックエンドごとに直近のレイテンシとエラー率を記録し、ポリシー（速い方 / 固定）で順番を決める。
+# ヘッジを有効にすると、最初のリクエストが p95 を過ぎても終わらない場合に別のバックエンドへもう一つ送り、
+# 先に終わった方を使う（負けた方には止めるよう伝え、結果は捨てる）。
+# レート制限（429/503）は Retry-After か指数バックオフで待って再試行し、他のバックエンドがあればそちらへ逃がす
+# どの呼び出しも、送り先のバックエンドのアドミッション枠（admission.py）を取ってから行い、バックオフ中は枠を返しておく
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import record_stage
+from ollama_client import percentile
+
+log = logging.getLogger(__name__)
+
+LLM_ROUTER_POLICY = os.getenv("LLM_ROUTER_POLICY", "fastest")   # fastest / ollama / gemini
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_SAMPLES = 20       # p95 を信用するのに必要な成功数（それまではヘッジしない）
+LLM_EXPLORE_SAMPLES = 3          # fastest で、成功がこれ未満のバックエンドは先に試して計測する
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
+LLM_BACKOFF_BASE = 0.5           # 秒。attempt ごとに2倍（ジッター付き）
+LLM_BACKOFF_MAX = 8.0
+LLM_MAX_ERROR_RATE = 0.5         # これを超えるエラー率のバックエンドは後回しにする
+ROUTER_WINDOW = 100              # 統計に使う直近の呼び出し数
+OVERLOADED_STATUS = (429, 503)
+POLICIES = ("fastest",)          # これに加えてバックエンド名（そのバックエンドを優先）を指定できる
+
+# calls の各値: cancel（threading.Event）を受け取るブロッキング関数。cancel が立ったら途中で止めてよい
+LLMCall = Callable[[threading.Event], str]
+# acquire(backend, wait): 枠を取って release 関数を返す。wait=False で空きが無ければ待たずに None
+Acquire = Callable[[str, bool], Awaitable[Optional[Callable[[], None]]]]
+
+
+def _release_nothing():
+    pass
+
+
+async def _no_admission(name: str, wait: bool = True) -> Callable[[], None]:
+    return _release_nothing
+
+
+def overload_delay(exc: Exception) -> Optional[float]:
+    """
+    If exc is a rate-limit / overload response (HTTP 429 or 503 from httpx or
+    google.api_core), return the Retry-After seconds (0.0 if absent), else None.
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    code = getattr(exc, "code", None)
+    if status is None and code is not None and not callable(code):
+        status = code
+    try:
+        if int(status) not in OVERLOADED_STATUS:
+            return None
+    except (TypeError, ValueError):
+        return None
+    retry_after = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class BackendStats:
+    """Rolling latency / error window and rate-limit cooldown of one backend."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)   # 成功した呼び出しの所要時間
+        self._outcomes = deque(maxlen=window)    # True=成功 / False=失敗
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    def record(self, ok: bool, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(seconds)
+            else:
+                self.errors += 1
+
+    def cool_down(self, seconds: float):
+        with self._lock:
+            self.rate_limited += 1
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+
+    @property
+    def cooling_down(self) -> bool:
+        return self.cooldown_until > time.monotonic()
+
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def latency(self, q: float) -> Optional[float]:
+        with self._lock:
+            return percentile(list(self._latencies), q)
+
+    def stats(self) -> Dict:
+        p50, p95 = self.latency(50), self.latency(95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 3),
+            "rate_limited": self.rate_limited,
+            "cooling_down": self.cooling_down,
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class LLMRouter:
+    """
+    Picks a backend per request and runs the call with hedging, retries and fallback.
+
+    complete() is a coroutine that takes one blocking callable per backend
+    (each builds its own prompt, returns the answer text and may stop early
+    once its cancel event is set) and returns (backend, text). Each call runs
+    through run (e.g. BlockingPool.run_llm) while holding a slot taken with
+    acquire(backend, wait), so first choices, fallbacks, retries and hedges
+    all count against the admission limit of the backend they go to.
+    Policy "fastest" orders backends by p50 latency, trying backends without
+    enough samples first and putting cooling-down or mostly failing ones last; a
+    backend name pins that backend first. With hedging on, a second request
+    goes to the next backend, if it has a free slot right now, when the first
+    has not finished by the backend's p95; the first to succeed wins and the
+    other is cancelled. On 429/503 the router moves on to the next backend, or
+    releases the slot, waits (Retry-After or exponential backoff) and retries
+    when there is none.
+    """
+
+    def __init__(self, policy: str = LLM_ROUTER_POLICY, hedge: bool = LLM_HEDGE,
+                 rate_limit_retries: int = LLM_RATE_LIMIT_RETRIES):
+        self.policy = policy
+        self.hedge = hedge
+        self.rate_limit_retries = rate_limit_retries
+        self._backends: Dict[str, BackendStats] = {}
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._losers: Dict[asyncio.Future, threading.Event] = {}  # 止めるよう伝えた、まだ終わっていない呼び出し
+
+    def backend(self, name: str) -> BackendStats:
+        with self._lock:
+            stats = self._backends.get(name)
+            if stats is None:
+                stats = self._backends[name] = BackendStats()
+            return stats
+
+    def _count(self, key: str):
+        with self._lock:
+            self._counters[key] += 1
+
+    def order(self, names: List[str], policy: Optional[str] = None) -> List[str]:
+        policy = policy or self.policy
+        if policy not in POLICIES and policy not in names:
+            raise ValueError(f"Unknown routing policy '{policy}' (choose from {list(POLICIES) + names})")
+
+        def score(name):
+            stats = self.backend(name)
+            explored = stats.samples >= LLM_EXPLORE_SAMPLES
+            return (stats.cooling_down, stats.error_rate() > LLM_MAX_ERROR_RATE, explored, stats.latency(50) if explored else 0.0)
+
+        ranked = sorted(names, key=score)
+        if policy in names:
+            ranked.remove(policy)
+            ranked.insert(0, policy)
+        return ranked
+
+    # --- 呼び出し ---
+    def _call(self, name: str, fn: LLMCall, cancel: threading.Event) -> Tuple[str, str]:
+        """Runs in a worker thread; a call that was cancelled is left out of the backend's statistics."""
+        started = time.perf_counter()
+        try:
+            text = fn(cancel)
+        except Exception:
+            if not cancel.is_set():
+                self.backend(name).record(False, time.perf_counter() - started)
+            raise
+        finally:
+            record_stage(f"llm_{name}", time.perf_counter() - started)
+        if not cancel.is_set():
+            self.backend(name).record(True, time.perf_counter() - started)
+        return name, text
+
+    async def _attempt(self, name: str, fn: LLMCall, release: Callable[[], None], run,
+                       cancel: threading.Event) -> Tuple[str, str]:
+        try:
+            return await run(self._call, name, fn, cancel)
+        except asyncio.CancelledError:
+            cancel.set()  # クライアントが切断した。スレッド側の生成も止める
+            raise
+        finally:
+            release()
+
+    def _discard(self, task: asyncio.Future, cancel: threading.Event):
+        # 負けた呼び出しに止めるよう伝える。スレッドが抜けた時点で枠が返るので、タスク自体は最後まで走らせる
+        cancel.set()
+        self._losers[task] = cancel
+        task.add_done_callback(self._forget)
+
+    def _forget(self, task: asyncio.Future):
+        self._losers.pop(task, None)
+        if not task.cancelled():
+            task.exception()  # 捨てた呼び出しの失敗は「取り出されなかった例外」として警告させない
+
+    async def _call_hedged(self, name: str, calls: Dict[str, LLMCall], order: List[str],
+                           release: Callable[[], None], run, acquire: Acquire) -> Tuple[str, str]:
+        stats = self.backend(name)
+        deadline = stats.latency(95) if self.hedge and stats.samples >= LLM_HEDGE_MIN_SAMPLES else None
+        others = [other for other in order if other != name and not self.backend(other).cooling_down]
+        cancel = threading.Event()
+        if deadline is None or not others:
+            # 同じバックエンドへの二重送信はしない（遅いときに負荷を倍にするだけ）
+            return await self._attempt(name, calls[name], release, run, cancel)
+        primary = asyncio.ensure_future(self._attempt(name, calls[name], release, run, cancel))
+        racers = {primary: cancel}
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=deadline)
+            if done:
+                return primary.result()
+            second = others[0]
+            second_release = await acquire(second, False)
+            if second_release is None:
+                # ヘッジ先に空きが無ければ、キューに並ばせずに最初の呼び出しを待つ
+                self._count("hedges_skipped")
+                pending = set()
+                return await primary
+            self._count("hedges")
+            log.info("Hedging: %s missed its p95 (%.2fs), also asking %s", name, deadline, second)
+            hedge_cancel = threading.Event()
+            hedge = asyncio.ensure_future(self._attempt(second, calls[second], second_release, run, hedge_cancel))
+            racers[hedge] = hedge_cancel
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                self._discard(task, racers[task])
+
+    async def complete(self, calls: Dict[str, LLMCall], policy: Optional[str] = None, fallback: bool = True,
+                       run=None, acquire: Optional[Acquire] = None) -> Tuple[str, str]:
+        run = run or asyncio.to_thread
+        acquire = acquire or _no_admission
+        order = self.order(list(calls), policy)
+        candidates = order if fallback else order[:1]
+        error = None
+        for position, name in enumerate(candidates):
+            if position:
+                self._count("fallbacks")
+                log.warning("Falling back to %s after: %s", name, error)
+            for attempt in range(self.rate_limit_retries + 1):
+                try:
+                    release = await acquire(name, True)
+                except Exception as e:
+                    if error is None:
+                        raise  # 最初のバックエンドの枠が取れない（429/503）はそのまま返す
+                    error = e
+                    break
+                try:
+                    winner, text = await self._call_hedged(name, calls, order, release, run, acquire)
+                    self._count(f"routed_{winner}")
+                    return winner, text
+                except Exception as e:
+                    error = e
+                    delay = overload_delay(e)
+                    if delay is None:
+                        break  # レート制限以外の失敗はすぐ次のバックエンドへ
+                    backoff = max(delay, min(LLM_BACKOFF_BASE * 2 ** attempt, LLM_BACKOFF_MAX) * random.uniform(0.5, 1.0))
+                    self.backend(name).cool_down(backoff)
+                    if position + 1 < len(candidates) or attempt == self.rate_limit_retries:
+                        break  # 他のバックエンドがあれば待たずにそちらへ
+                    self._count("retries")
+                    log.warning("%s is rate limited, retrying in %.2fs", name, backoff)
+                    # 枠は _attempt で返してあるので、待っている間は他のリクエストが使える
+                    await asyncio.sleep(backoff)
+        raise error
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+            names = list(self._backends)
+        return {
+            "policy": self.policy,
+            "hedge": self.hedge,
+            "counters": counters,
+            "cancelled_in_flight": len(self._losers),
+            "backends": {name: self.backend(name).stats() for name in names},
+        }
+
+    def shutdown(self):
+        for cancel in list(self._losers.values()):
+            cancel.set()
+
+
+router = LLMRouter()
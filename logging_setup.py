@@ -0,0 +1,188 @@
+# logging_setup.py
+# api_server とその周辺モジュールのログ設定
+# これまでは print で、削除のたびに履歴全体を、リクエストのたびにペイロード全体を標準出力へ同期的に書いていたため、
+# 履歴が伸びるほど処理そのものよりログの方が重くなっていた。ここでは
+#   - レベル付きの logging に置き換え、ペイロードは先頭だけのプレビューにする
+#   - 大量に出るイベントは N 件に 1 件だけ出す（サンプリング）
+#   - 出力は上限付きのキュー経由で別スレッドが書き込み、リクエストを処理するスレッドは待たない（あふれた分は捨てて数える）
+#   - リクエストID と処理段階（metrics.stage）を各行に付け、Server-Timing や /metrics と突き合わせられるようにする
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import uuid
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")                       # text / json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))         # これを超えた分は捨てる
+LOG_PREVIEW_CHARS = int(os.getenv("LOG_PREVIEW_CHARS", "200"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "20"))        # サンプリング対象のイベントは N 件に 1 件だけ出す
+NOISY_LOGGERS = ("httpx", "httpcore", "urllib3")                 # LLM 呼び出しごとに1行出すライブラリは WARNING 以上だけ
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s [%(request_id)s %(stage)s] %(message)s"
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+stage_var: contextvars.ContextVar[str] = contextvars.ContextVar("stage", default="-")
+
+
+def preview(value, limit: int = LOG_PREVIEW_CHARS) -> str:
+    """Short, single-line rendering of a payload for logs ('…(+N chars)' when cut)."""
+    if isinstance(value, (list, tuple)):
+        text = f"[{len(value)} items] {value[:3]!r}" if len(value) > 3 else repr(value)
+    else:
+        text = value if isinstance(value, str) else repr(value)
+    text = text.replace("\n", "\\n")
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(+{len(text) - limit} chars)"
+
+
+class _Sampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def take(self, key: str, every: int) -> Optional[int]:
+        """Count one event; return how many were seen if this one should be logged, else None."""
+        with self._lock:
+            count = self._counts.get(key, 0) + 1
+            self._counts[key] = count
+        return count if every <= 1 or count % every == 1 else None
+
+
+_sampler = _Sampler()
+
+
+def log_sampled(logger: logging.Logger, level: int, key: str, msg: str, *args, every: int = LOG_SAMPLE_EVERY):
+    """Log the 1st, (every+1)th, ... occurrence of a high-volume event, noting the sampling rate."""
+    if not logger.isEnabledFor(level):
+        return
+    count = _sampler.take(key, every)
+    if count is not None:
+        logger.log(level, msg + (f" (sampled 1/{every}, #{count})" if every > 1 else ""), *args)
+
+
+class ContextFilter(logging.Filter):
+    """Stamp request_id and stage from the context variables (runs in the caller's thread, before queueing)."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.stage = stage_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "stage": getattr(record, "stage", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc_info"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 例外のトレースバックだけは呼び出し元で文字列にしておく（別スレッドでは exc_info が使えない）
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> DroppingQueueHandler:
+    """Route the root logger through a bounded queue to a background writer. Safe to call more than once."""
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is not None:
+            return _handler
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+        _handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        _handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(level)
+        for name in NOISY_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        _listener = logging.handlers.QueueListener(_handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _handler
+
+
+def shutdown_logging():
+    """Flush what is queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict:
+    return {
+        "level": logging.getLevelName(logging.getLogger().level),
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+    }
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware that gives every HTTP request an id (the client's
+    X-Request-ID if sent, otherwise a new one), exposes it to log records and
+    echoes it back in the X-Request-ID response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope.get("headers") or []).get(REQUEST_ID_HEADER.encode())
+        request_id = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex[:12]
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
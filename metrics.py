@@ -0,0 +1,221 @@
+# metrics.py
+# チャット処理の各段階（履歴の読み込み・埋め込み・Chroma検索・プロンプト組み立て・LLM呼び出し・履歴の保存）の時間を計測し、
+# Prometheus のテキスト形式で /metrics に出す。リクエストごとの内訳は Server-Timing ヘッダーでも返す
+# 計測は perf_counter とロック1回分の加算だけなので、本番でも有効にしたままにできる
+# （prometheus_client には依存せず、必要な Counter / Histogram だけを実装している）
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from logging_setup import stage_var
+
+log = logging.getLogger(__name__)
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1").lower() in ("1", "true", "yes")
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 処理中のリクエストの段階ごとの所要時間 [(stage, 秒)]。BlockingPool はコンテキストをワーカーへコピーするので、
+# スレッドプールで実行した段階も同じリストに記録される
+_request_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_stages", default=None)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}" for key, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (Prometheus semantics)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[tuple, list] = {}  # key -> [バケットごとの件数..., +Inf の件数, 合計]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the metrics and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = STAGE_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """collector() returns ready-made exposition lines (HELP/TYPE included), e.g. gauges read at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                log.warning("Metrics collector failed: %s", e)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram("chat_stage_seconds", "Time spent in each chat pipeline stage.", ("stage",))
+http_requests = metrics.counter("http_requests_total", "HTTP requests by route, method and status.",
+                                ("method", "route", "status"))
+http_seconds = metrics.histogram("http_request_duration_seconds", "Time to the end of the response body.",
+                                 ("method", "route"))
+
+
+def record_stage(name: str, seconds: float):
+    stage_seconds.observe(seconds, stage=name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one pipeline stage (histogram + this request's Server-Timing + log records' stage)."""
+    started = time.perf_counter()
+    token = stage_var.set(name)
+    try:
+        yield
+    finally:
+        stage_var.reset(token)
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed(name: str):
+    """Decorator form of stage()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    durations: Dict[str, float] = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: counts requests, times them per route template, and
+    adds a Server-Timing header listing the stages recorded before the
+    response started (for SSE, the stages before the first event).
+    """
+
+    def __init__(self, app, server_timing_header: bool = SERVER_TIMING):
+        self.app = app
+        self.server_timing_header = server_timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        stages: List[Tuple[str, float]] = []
+        token = _request_stages.set(stages)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if self.server_timing_header:
+                    value = server_timing(stages, time.perf_counter() - started).encode("latin-1")
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", value)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stages.reset(token)
+            route = scope.get("route")
+            # パスではなくルートのテンプレートで集計する（/api/messages/{message_index} など）
+            template = getattr(route, "path", None) or "unmatched"
+            http_requests.inc(method=scope["method"], route=template, status=status["code"])
+            http_seconds.observe(time.perf_counter() - started, method=scope["method"], route=template)
@@ -0,0 +1,26 @@
+# ollama_chat.py
+# ollama_client.get_client を対話的に試すスクリプト（旧 test_smolagents.py, test_ollama_client.py。smolagents の LiteLLMModel は使わなくなった）
+#   python ollama_chat.py
+from ollama_client import get_client
+
+
+def main():
+    model = get_client("ollama_chat/qwen2:7b", "http://127.0.0.1:11434", num_ctx=8192)
+    model.start_keep_warm()
+
+    while True:
+        user_input = input("質問を入力してください（終了するには 'exit' と入力）：")
+        if user_input.lower() == "exit":
+            break
+
+        messages = [
+            {"role": "user", "content": [{"type": "text", "text": user_input}]}
+        ]
+
+        response = model(messages)
+        print("AI:", response.content)
+        print(f"（読み込み {response.timings['load_seconds']:.2f}秒 / 最初のトークンまで {response.timings['ttft_seconds'] or 0:.2f}秒）")
+
+
+if __name__ == "__main__":
+    main()
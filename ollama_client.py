@@ -0,0 +1,228 @@
+# ollama_client.py
+# Ollama の /api/chat を直接呼ぶ共有クライアント
+# LiteLLMModel はインスタンスごとに接続を張り直し、モデルの常駐も指定しないため、アイドル後の最初の質問で
+# qwen2:7b の読み込み待ちが発生していた。ここでは接続をプールして使い回し、keep_alive を指定し、
+# 起動時のプリロードと定期的なキープウォームでモデルを常駐させる。
+# モデルの読み込み時間と最初のトークンまでの時間(TTFT)は分けて記録し、「モデルが冷えていた」のか
+# 「生成が遅い」のかを区別できるようにする
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import httpx
+
+log = logging.getLogger(__name__)
+
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")                        # モデルを常駐させる時間（-1で無期限）
+OLLAMA_KEEP_WARM_SECONDS = float(os.getenv("OLLAMA_KEEP_WARM_SECONDS", "240"))  # アイドル時のキープウォーム間隔（0で無効）
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+COLD_LOAD_SECONDS = 0.5   # load_duration がこれを超えたらモデルの読み込みが発生した（コールド）とみなす
+STATS_WINDOW = 256        # 統計に使う直近のリクエスト数
+
+
+def ollama_model_name(model_id: str) -> str:
+    """'ollama_chat/qwen2:7b' (LiteLLM style) -> 'qwen2:7b'."""
+    return model_id.split("/", 1)[1] if model_id.startswith(("ollama_chat/", "ollama/")) else model_id
+
+
+def message_content(message: Dict) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class OllamaMessage(NamedTuple):
+    """Reply (or stream delta) with the same .content attribute as smolagents' ChatMessage."""
+    content: str
+    timings: Optional[Dict] = None
+
+
+class OllamaClient:
+    """
+    Pooled, keep-alive client for one Ollama model.
+
+    Calling the client with a list of chat messages returns an OllamaMessage,
+    generate_stream() yields deltas, so it can stand in for LiteLLMModel.
+    Every request is streamed internally so that time to first token can be
+    measured; the final frame's load_duration tells a cold model load apart
+    from slow generation. preload() asks Ollama to load the model without
+    generating, and start_keep_warm() repeats it whenever the client has been
+    idle for keep_warm_seconds so the model is never evicted.
+    """
+
+    def __init__(self, model_id: str, api_base: str, num_ctx: int = 8192, keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 keep_warm_seconds: float = OLLAMA_KEEP_WARM_SECONDS, max_connections: int = OLLAMA_MAX_CONNECTIONS,
+                 timeout: float = OLLAMA_TIMEOUT):
+        self.model = ollama_model_name(model_id)
+        self.api_base = api_base.rstrip("/")
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
+        self.keep_warm_seconds = keep_warm_seconds
+        self._http = httpx.Client(
+            base_url=self.api_base,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._keep_warm_thread = None
+        self._last_used = 0.0
+        self._load = deque(maxlen=STATS_WINDOW)
+        self._ttft = deque(maxlen=STATS_WINDOW)
+        self._total = deque(maxlen=STATS_WINDOW)
+        self.requests = 0
+        self.cold_requests = 0
+        self.errors = 0
+        self.preloads = 0
+        self.last_preload_seconds = None
+
+    # --- 生成 ---
+    def _payload(self, messages: List[Dict]) -> Dict:
+        return {
+            "model": self.model,
+            "messages": [{"role": m.get("role", "user"), "content": message_content(m)} for m in messages],
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx},
+        }
+
+    def generate_stream(self, messages: List[Dict], cancel: Optional[threading.Event] = None) -> Iterator[OllamaMessage]:
+        """Yield the reply as deltas; once cancel is set the stream is closed, which stops Ollama generating."""
+        started = time.perf_counter()
+        self._last_used = time.monotonic()
+        ttft = None
+        try:
+            with self._http.stream("POST", "/api/chat", json=self._payload(messages)) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if cancel is not None and cancel.is_set():
+                        return
+                    if not line.strip():
+                        continue
+                    frame = json.loads(line)
+                    if frame.get("error"):
+                        raise RuntimeError(f"Ollama error: {frame['error']}")
+                    text = (frame.get("message") or {}).get("content", "")
+                    if text:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        yield OllamaMessage(text)
+                    if frame.get("done"):
+                        timings = self._record(frame, ttft, time.perf_counter() - started)
+                        yield OllamaMessage("", timings)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            self._last_used = time.monotonic()
+
+    def __call__(self, messages: List[Dict], cancel: Optional[threading.Event] = None, **kwargs) -> OllamaMessage:
+        parts, timings = [], None
+        for delta in self.generate_stream(messages, cancel):
+            parts.append(delta.content)
+            timings = delta.timings or timings
+        return OllamaMessage("".join(parts), timings)
+
+    def _record(self, frame: Dict, ttft: Optional[float], total: float) -> Dict:
+        load = frame.get("load_duration", 0) / 1e9
+        cold = load > COLD_LOAD_SECONDS
+        with self._lock:
+            self.requests += 1
+            self.cold_requests += cold
+            self._load.append(load)
+            self._total.append(total)
+            if ttft is not None:
+                self._ttft.append(ttft)
+        if cold:
+            log.info("Ollama model '%s' was cold: load %.2fs, ttft %.2fs", self.model, load, ttft or total)
+        return {"load_seconds": load, "ttft_seconds": ttft, "total_seconds": total, "cold": cold}
+
+    # --- プリロードとキープウォーム ---
+    def preload(self) -> float:
+        """Load the model into memory (no generation) and refresh its keep_alive. Returns seconds taken."""
+        started = time.perf_counter()
+        response = self._http.post("/api/generate", json={"model": self.model, "keep_alive": self.keep_alive})
+        response.raise_for_status()
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.preloads += 1
+            self.last_preload_seconds = seconds
+        self._last_used = time.monotonic()
+        return seconds
+
+    def start_keep_warm(self) -> threading.Thread:
+        """Preload now, then ping the model whenever the client has been idle for keep_warm_seconds."""
+        with self._lock:
+            if self._keep_warm_thread is not None:
+                return self._keep_warm_thread
+            self._keep_warm_thread = threading.Thread(target=self._keep_warm, name="ollama-keep-warm", daemon=True)
+        self._keep_warm_thread.start()
+        return self._keep_warm_thread
+
+    def _keep_warm(self):
+        try:
+            log.info("Preloaded Ollama model '%s' in %.2fs", self.model, self.preload())
+        except Exception as e:
+            log.warning("Ollama preload failed: %s", e)
+        if self.keep_warm_seconds <= 0:
+            return
+        while not self._stop.wait(self.keep_warm_seconds / 4):
+            if time.monotonic() - self._last_used < self.keep_warm_seconds:
+                continue
+            try:
+                self.preload()
+            except Exception as e:
+                log.warning("Ollama keep-warm ping failed: %s", e)
+                self._last_used = time.monotonic()  # 失敗しても次の間隔までは再試行しない
+
+    def close(self):
+        """Stop keep-warm and close the pool; get_client() then builds a fresh client for this model."""
+        self._stop.set()
+        with _clients_lock:
+            for key in [key for key, client in _clients.items() if client is self]:
+                del _clients[key]
+        self._http.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            load, ttft, total = list(self._load), list(self._ttft), list(self._total)
+            return {
+                "model": self.model,
+                "keep_alive": self.keep_alive,
+                "requests": self.requests,
+                "cold_requests": self.cold_requests,
+                "errors": self.errors,
+                "preloads": self.preloads,
+                "last_preload_seconds": self.last_preload_seconds,
+                "load_seconds": {"p50": percentile(load, 50), "max": max(load, default=None)},
+                "ttft_seconds": {"p50": percentile(ttft, 50), "p95": percentile(ttft, 95)},
+                "total_seconds": {"p50": percentile(total, 50), "p95": percentile(total, 95)},
+            }
+
+
+_clients: Dict[tuple, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(model_id: str, api_base: str, num_ctx: int = 8192) -> OllamaClient:
+    """Process-wide client per (model, server), so every caller shares one connection pool."""
+    key = (ollama_model_name(model_id), api_base.rstrip("/"), num_ctx)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = OllamaClient(model_id, api_base, num_ctx)
+        return client
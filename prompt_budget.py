@@ -0,0 +1,119 @@
+# prompt_budget.py
+# プロンプトのトークン数を数え、決められた予算の中に 指示文 → 質問 → 検索文書(上位から) → 直近の会話(新しい順)
+# の優先順で詰め込む。入りきらない部分は決まった規則で切り詰めるので、同じ入力からは常に同じプロンプトになる
+import os
+import threading
+from typing import Callable, Dict, List
+
+from chunking import approximate_tokens
+from resources import OLLAMA_NUM_CTX
+
+PROMPT_RESERVE_TOKENS = int(os.getenv("PROMPT_RESERVE_TOKENS", "1024"))   # 回答の生成用に残す分
+OLLAMA_PROMPT_BUDGET = int(os.getenv("OLLAMA_PROMPT_BUDGET", str(OLLAMA_NUM_CTX - PROMPT_RESERVE_TOKENS)))
+GEMINI_PROMPT_BUDGET = int(os.getenv("GEMINI_PROMPT_BUDGET", str(8192 - PROMPT_RESERVE_TOKENS)))
+PROMPT_MAX_TURNS = 10      # 会話履歴は最大でこの件数（1往復=2件）
+MIN_PARTIAL_TOKENS = 32    # 残りがこれ未満なら、入りきらない文書を切り詰めて入れずに捨てる
+TRUNCATION_MARK = "…"
+
+
+def truncate_to_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int] = approximate_tokens) -> str:
+    """Longest prefix of text (plus a mark) that fits in max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    mark = count_tokens(TRUNCATION_MARK)
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) + mark <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + TRUNCATION_MARK if lo else ""
+
+
+class PromptBudget:
+    """
+    Token budget for one prompt, filled section by section in priority order.
+
+    take() adds a single text (cut to what is left if needed), take_items()
+    adds whole items in order until the budget runs out, cutting the last one
+    only if at least MIN_PARTIAL_TOKENS are left. report() returns per-section
+    usage for logging.
+    """
+
+    def __init__(self, max_tokens: int, count_tokens: Callable[[str], int] = approximate_tokens):
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.used = 0
+        self.sections: Dict[str, Dict] = {}
+
+    @property
+    def remaining(self) -> int:
+        return max(self.max_tokens - self.used, 0)
+
+    def _record(self, name: str, tokens: int, items: int = 1, dropped: int = 0, truncated: bool = False):
+        self.used += tokens
+        section = self.sections.setdefault(name, {"tokens": 0, "items": 0, "dropped": 0, "truncated": False})
+        section["tokens"] += tokens
+        section["items"] += items
+        section["dropped"] += dropped
+        section["truncated"] = section["truncated"] or truncated
+
+    def take(self, name: str, text: str) -> str:
+        tokens = self.count_tokens(text)
+        if tokens > self.remaining:
+            text = truncate_to_tokens(text, self.remaining, self.count_tokens)
+            self._record(name, self.count_tokens(text), truncated=True)
+            return text
+        self._record(name, tokens)
+        return text
+
+    def take_items(self, name: str, items: List[str], separator_tokens: int = 1) -> List[str]:
+        taken: List[str] = []
+        tokens = 0
+        truncated = False
+        for item in items:
+            cost = self.count_tokens(item) + separator_tokens
+            left = self.remaining - tokens
+            if cost <= left:
+                taken.append(item)
+                tokens += cost
+                continue
+            if left - separator_tokens >= MIN_PARTIAL_TOKENS:
+                part = truncate_to_tokens(item, left - separator_tokens, self.count_tokens)
+                taken.append(part)
+                tokens += self.count_tokens(part) + separator_tokens
+                truncated = True
+            break
+        self._record(name, tokens, items=len(taken), dropped=len(items) - len(taken), truncated=truncated)
+        return taken
+
+    def report(self) -> Dict:
+        return {"budget": self.max_tokens, "used": self.used, "sections": self.sections}
+
+
+class PromptUsageStats:
+    """Per-backend aggregate of PromptBudget reports for GET /api/stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+
+    def record(self, backend: str, report: Dict):
+        truncated = any(s["truncated"] or s["dropped"] for s in report["sections"].values())
+        with self._lock:
+            stats = self._stats.setdefault(backend, {"requests": 0, "tokens_total": 0, "tokens_max": 0, "truncated_requests": 0})
+            stats["requests"] += 1
+            stats["tokens_total"] += report["used"]
+            stats["tokens_max"] = max(stats["tokens_max"], report["used"])
+            stats["truncated_requests"] += truncated
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                backend: {**stats, "tokens_mean": round(stats["tokens_total"] / stats["requests"], 1)}
+                for backend, stats in self._stats.items()
+            }
+
+
+prompt_usage = PromptUsageStats()
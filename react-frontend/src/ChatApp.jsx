@@ -72,7 +72,7 @@ function JsonTable({ data }) {
   );
 }
 
-const ChatHistory = React.memo(function ChatHistory({ messages = [], onDeleteMessage, isThinking, thinkingDots }) {
+const ChatHistory = React.memo(function ChatHistory({ messages = [], onDeleteMessage, isThinking, thinkingDots, hasOlderMessages, onLoadOlder }) {
   const bottomRef = useRef(null);
   useEffect(() => {
     bottomRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -88,6 +88,12 @@ const ChatHistory = React.memo(function ChatHistory({ messages = [], onDeleteMes
   })();
   return (
     <div className="chat-history">
+      {/* ★ 追加: 古い履歴はページ単位で遡って読み込む */}
+      {hasOlderMessages && (
+        <button onClick={onLoadOlder} className="load-older-button">
+          以前のメッセージを読み込む
+        </button>
+      )}
       {messages.map((msg, idx) => { // ★ messages を直接使用
         const showRating = msg.role === "assistant" && idx === lastAssistantIdx;
         let contentToRender;
@@ -304,6 +310,7 @@ const TranscriptPanel = React.memo(function TranscriptPanel({ text, currentTime,
 
 // テスト動画の初期値
 const TEST_VIDEO_ID = "iRJvKaCGPl0";
+const MESSAGES_PAGE_SIZE = 50; // ★ 追加: 履歴は新しい順にこの件数ずつ読み込む
 const TEST_TRANSCRIPT = [];
 
 // ★ MODIFIED: テスト用のYouTube動画データを再生可能で字幕があるものに変更
@@ -315,6 +322,8 @@ const mockYouTubeVideos = [
 
 export default function ChatApp() {
   const [messages, setMessages] = useState([]);
+  const [historyStartIndex, setHistoryStartIndex] = useState(0); // ★ 追加: messages[0] のサーバー側インデックス
+  const [olderCursor, setOlderCursor] = useState(null); // ★ 追加: さらに古い履歴を取得するためのカーソル
   const [input, setInput] = useState("");
   const [videoId, setVideoId] = useState(TEST_VIDEO_ID);
   const [transcript, setTranscript] = useState(TEST_TRANSCRIPT);
@@ -598,10 +607,10 @@ export default function ChatApp() {
     );
   }, [videoSearchTerm]);
 
-  // 初回チャット履歴取得
+  // 初回チャット履歴取得（最新ページのみ）
   useEffect(() => {
     setIsThinking(true);
-    fetch("/api/messages")
+    fetch(`/api/messages?limit=${MESSAGES_PAGE_SIZE}`)
       .then(res => {
         if (!res.ok) {
           // レスポンスがOKでない場合、エラーをスローして .catch で処理
@@ -614,8 +623,10 @@ export default function ChatApp() {
         return res.json();
       })
       .then(data => {
-        if (Array.isArray(data)) {
-          setMessages(data);
+        if (data && Array.isArray(data.messages)) {
+          setMessages(data.messages);
+          setHistoryStartIndex(data.start_index || 0);
+          setOlderCursor(data.next_cursor ?? null);
         } else {
           console.error("Fetched initial messages is not an array:", data);
           setMessages([]); // データが配列でない場合は空配列にフォールバック
@@ -628,6 +639,21 @@ export default function ChatApp() {
       .finally(() => setIsThinking(false));
   }, []);
 
+  // ★ 追加: さらに古い履歴を1ページ分読み込んで先頭に追加
+  const handleLoadOlder = useCallback(async () => {
+    if (olderCursor === null) return;
+    try {
+      const res = await fetch(`/api/messages?cursor=${olderCursor}&limit=${MESSAGES_PAGE_SIZE}`);
+      if (!res.ok) throw new Error(res.statusText);
+      const data = await res.json();
+      setMessages(msgs => [...data.messages, ...msgs]);
+      setHistoryStartIndex(data.start_index || 0);
+      setOlderCursor(data.next_cursor ?? null);
+    } catch (error) {
+      console.error("Failed to fetch older messages:", error.message);
+    }
+  }, [olderCursor]);
+
   // メッセージ送信
   const handleSend = useCallback(async () => { // ★ MODIFIED: Wrapped with useCallback
     if (!input) return;
@@ -643,14 +669,58 @@ export default function ChatApp() {
         picture: userProfile.picture,
       };
     }
-    const res = await fetch("/api/messages/gemini", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message: input, user }), // ★ user情報を追加
-    });
-    const data = await res.json();
-    setMessages(msgs => [...msgs, data]);
-    setIsThinking(false);
+    // ★ 変更: SSEで受け取ったトークンを順次吹き出しに反映する
+    try {
+      const res = await fetch("/api/messages/gemini/stream", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ message: input, user }), // ★ user情報を追加
+      });
+      if (!res.ok || !res.body) {
+        const err = await res.json().catch(() => ({}));
+        throw new Error(err.detail || res.statusText);
+      }
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let started = false;
+      const updateLast = (update) => setMessages(msgs => [...msgs.slice(0, -1), update(msgs[msgs.length - 1])]);
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop();
+        for (const frame of frames) {
+          const event = (frame.match(/^event: (.*)$/m) || [])[1];
+          const dataLine = (frame.match(/^data: (.*)$/m) || [])[1];
+          if (!event || dataLine === undefined) continue;
+          const data = JSON.parse(dataLine);
+          if (event === "token") {
+            if (!started) {
+              started = true;
+              setIsThinking(false);
+              setMessages(msgs => [...msgs, { role: "assistant", content: data.text }]);
+            } else {
+              updateLast(last => ({ ...last, content: last.content + data.text }));
+            }
+          } else if (event === "done") {
+            if (started) {
+              updateLast(() => data);
+            } else {
+              setMessages(msgs => [...msgs, data]);
+            }
+          } else if (event === "error") {
+            throw new Error(data.detail);
+          }
+        }
+      }
+    } catch (error) {
+      console.error("Failed to send message:", error.message);
+      setMessages(msgs => [...msgs, { role: "system", content: `Error: ${error.message}` }]);
+    } finally {
+      setIsThinking(false);
+    }
     // ★ 送信時は動画・トランスクリプトを変更しない（初期表示のまま）
     // if (data.videoId) {
     //   setVideoId(data.videoId);
@@ -678,7 +748,8 @@ export default function ChatApp() {
 
     try {
       // ★ 修正: userMessageToDelete.id ではなく userMessageIndex を使用する
-      const response = await fetch(`/api/messages/${userMessageIndex}`, {
+      // ★ 変更: 画面上の位置ではなくサーバー側の履歴全体でのインデックスを送る
+      const response = await fetch(`/api/messages/${historyStartIndex + userMessageIndex}`, {
         method: 'DELETE',
       });
 
@@ -700,7 +771,7 @@ export default function ChatApp() {
       setMessages(originalMessages); // Rollback on network error or other exceptions
       setMessages(prevMessages => [...prevMessages, {role: 'system', content: `Error: Could not delete message. ${error.message}`}]);
     }
-  }, [messages, setMessages]); // ★ MODIFIED: Added dependencies
+  }, [messages, setMessages, historyStartIndex]); // ★ MODIFIED: Added dependencies
 
   return (
     <> {/* ★ Fragment を使用してヘッダーとメインコンテンツをラップ */}
@@ -846,7 +917,7 @@ export default function ChatApp() {
       )}
         <div className="container" style={{ display: 'flex', width: '100%', height: 'calc(100vh - 48px)' }}>
           <div className="left" style={{ flexGrow: 1, flexBasis: 0, minWidth: 0, maxWidth: `${100 - rightColumnWidth}%`, overflow: 'hidden', display: 'flex', flexDirection: 'column' }}>
-            <ChatHistory messages={messages} onDeleteMessage={handleDeleteMessage} isThinking={isThinking} thinkingDots={thinkingDots} />
+            <ChatHistory messages={messages} onDeleteMessage={handleDeleteMessage} isThinking={isThinking} thinkingDots={thinkingDots} hasOlderMessages={olderCursor !== null} onLoadOlder={handleLoadOlder} />
             <ChatInput value={input} onChange={setInput} onSend={handleSend} />
           </div>
           {/* ★ ドラッグ用ディバイダー */}
@@ -0,0 +1,145 @@
+# resources.py
+# 埋め込みモデル・ChromaDBクライアント・LLMクライアントをプロセスごとに一度だけ構築して共有するレジストリ
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+from embedding_service import EmbeddingService
+from ollama_client import get_client
+from retrieval import RetrievalCache
+from vector_store import open_client
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "chroma_db")
+BOOK_COLLECTION = "book"
+OLLAMA_MODEL_ID = os.getenv("OLLAMA_MODEL_ID", "ollama_chat/qwen2:7b")
+OLLAMA_API_BASE = os.getenv("OLLAMA_API_BASE", "http://localhost:11434")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")  # 例: fake_llm_server.py を使う場合 http://127.0.0.1:11434
+WARMUP_TEXT = "ウォームアップ"
+
+
+class ResourceRegistry:
+    """
+    Process-wide holder for the heavy objects every chat turn needs.
+
+    load() builds the embedder, the Chroma client and the Ollama model once,
+    runs a warm-up encode and query, and then marks the registry as ready.
+    Handlers read the shared instances instead of constructing their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._collections = {}
+        self._gemini_model = None
+        self.embedder = None
+        self.embedding_service = None
+        self.retrieval = RetrievalCache()  # 質問の埋め込みと検索結果のキャッシュ
+        self.chroma_client = None
+        self.llm = None
+        self.error = None
+        self.load_seconds = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None) -> bool:
+        return self._ready.wait(timeout)
+
+    def load(self):
+        """Build every resource and warm it up. Safe to call more than once."""
+        with self._lock:
+            if self._ready.is_set():
+                return self
+            self.error = None
+            try:
+                started = time.perf_counter()
+                from sentence_transformers import SentenceTransformer
+                self.embedder = SentenceTransformer(EMBEDDING_MODEL)
+                # 同時リクエストの埋め込みはマイクロバッチでまとめて計算する
+                self.embedding_service = EmbeddingService(self.embedder)
+                self.load_seconds["embedder"] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                # VECTOR_STORE=numpy なら Chroma の代わりに memmap のストアを開く（同じ API のサブセット）
+                self.chroma_client = open_client(CHROMA_DB_PATH)
+                self.load_seconds["chroma"] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                # 接続をプールする共有クライアント。モデルのプリロードとキープウォームは別スレッドで行う
+                self.llm = get_client(OLLAMA_MODEL_ID, OLLAMA_API_BASE, OLLAMA_NUM_CTX)
+                self.llm.start_keep_warm()
+                self.load_seconds["llm"] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                self._warm_up()
+                self.load_seconds["warmup"] = time.perf_counter() - started
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                log.exception("Failed to load shared resources: %s", self.error)
+                raise
+            self._ready.set()
+            log.info("Shared resources ready: %s", self.load_seconds)
+        return self
+
+    def _warm_up(self):
+        # 初回リクエストで発生するトークナイザ初期化やHNSWインデックスの読み込みを先に済ませる
+        query_vec = self.embedding_service.encode([WARMUP_TEXT])[0].tolist()
+        collection = self.collection(BOOK_COLLECTION)
+        if collection.count() > 0:
+            collection.query(query_embeddings=[query_vec], n_results=1)
+        if self.retrieval.hybrid:
+            self.retrieval.lexical_index(BOOK_COLLECTION, collection)  # BM25インデックスを先に構築する
+
+    def start_background_load(self) -> threading.Thread:
+        """Load resources on a daemon thread so the server can start accepting requests."""
+        def _run():
+            try:
+                self.load()
+            except Exception:
+                pass  # error is kept in self.error and reported by status()
+        thread = threading.Thread(target=_run, name="resource-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def collection(self, name: str):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self.chroma_client.get_or_create_collection(name)
+            self._collections[name] = collection
+        return collection
+
+    def gemini_model(self):
+        if self._gemini_model is None:
+            import google.generativeai as genai
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY not found in environment variables. Please set it in your .env file or environment.")
+            if GEMINI_API_ENDPOINT:
+                # スタブサーバーなど別のエンドポイントへはRESTで接続する
+                genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+            else:
+                genai.configure(api_key=api_key)
+            self._gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+        return self._gemini_model
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "embedding_model": EMBEDDING_MODEL,
+            "llm_model": OLLAMA_MODEL_ID,
+            "load_seconds": {k: round(v, 3) for k, v in self.load_seconds.items()},
+        }
+
+
+registry = ResourceRegistry()
@@ -0,0 +1,215 @@
+# retrieval.py
+# RAG検索（質問の埋め込み・collection.query）の結果をLRU/TTLキャッシュする
+# 「ストーリーとは」など同じ質問が繰り返し届くため、埋め込みとChroma検索を毎回やり直さない
+# 検索はベクトル検索と文字n-gramのBM25（lexical_index.py）をRRFで統合したハイブリッド検索
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, Hashable, List
+
+from lexical_index import LexicalIndex, keyword_of, reciprocal_rank_fusion
+from metrics import stage
+
+log = logging.getLogger(__name__)
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))       # 埋め込み・検索結果それぞれの最大件数
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))        # 秒。0以下で無期限
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1").lower() in ("1", "true", "yes")
+HYBRID_CANDIDATES = 10  # RRFで統合する前に各検索から取る件数の下限（n_results の3倍と大きい方）
+
+_MISSING = object()
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a question: NFKC, lower-case, collapsed whitespace."""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional per-entry TTL and hit/miss counters."""
+
+    def __init__(self, maxsize: int = RETRIEVAL_CACHE_SIZE, ttl: float = RETRIEVAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value):
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard_where(self, predicate) -> int:
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                del self._data[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class RetrievalCache:
+    """
+    Caches query embeddings by normalized text and collection.query results
+    by (collection, collection version, k, normalized text).
+
+    The collection version is a local generation counter, bumped by
+    invalidate(), combined with the collection's write_version() (see
+    vector_store.open_client), which changes after every write by any
+    process, so edits that keep the count the same also retire old results.
+
+    With hybrid retrieval on, each collection also has a LexicalIndex that is
+    re-synced with the collection whenever its version changes. A keyword
+    question whose keyword appears verbatim in the book is answered from the
+    lexical index alone, without embedding. Other questions fuse vector and
+    BM25 rankings with reciprocal rank fusion.
+    """
+
+    def __init__(self, maxsize: int = RETRIEVAL_CACHE_SIZE, ttl: float = RETRIEVAL_CACHE_TTL,
+                 hybrid: bool = HYBRID_RETRIEVAL):
+        self.embeddings = LRUCache(maxsize, ttl)
+        self.results = LRUCache(maxsize, ttl)
+        self.hybrid = hybrid
+        self._generations: Dict[str, int] = {}
+        self._lexical: Dict[str, tuple] = {}  # name -> (version, LexicalIndex)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._paths = Counter()
+
+    def embed(self, embedding_service, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.embeddings.get(key)
+        if vector is None:
+            with stage("embed"):
+                vector = embedding_service.encode([text])[0].tolist()
+            self.embeddings.put(key, vector)
+        return vector
+
+    def version(self, name: str, collection) -> tuple:
+        # 件数ではなく書き込みの印で判定する（同じ件数の書き換え・upsert・他プロセスの書き込みも拾える）
+        return (self._generations.get(name, 0), collection.write_version())
+
+    def query(self, embedding_service, name: str, collection, text: str, n_results: int) -> Dict:
+        version = self.version(name, collection)
+        key = (name, version, n_results, normalize_query(text))
+        results = self.results.get(key)
+        if results is None:
+            results = self._search(embedding_service, name, collection, version, text, n_results)
+            self.results.put(key, results)
+        return results
+
+    def _count_path(self, path: str):
+        with self._lock:
+            self._paths[path] += 1
+
+    def _search(self, embedding_service, name: str, collection, version: tuple, text: str, n_results: int) -> Dict:
+        if not self.hybrid:
+            self._count_path("vector")
+            query_vec = self.embed(embedding_service, text)
+            with stage("chroma_query"):
+                return collection.query(query_embeddings=[query_vec], n_results=n_results)
+
+        index = self.lexical_index(name, collection, version)
+        keyword = keyword_of(text)
+        if keyword:
+            with stage("lexical_search"):
+                ids = index.containing(keyword, n_results)
+            if ids:
+                # キーワードがそのまま本文にあるなら埋め込みもHNSW検索も行わない
+                self._count_path("lexical")
+                documents, metadatas = index.documents(ids)
+                return {"ids": [ids], "documents": [documents], "metadatas": [metadatas], "distances": None}
+
+        candidates = max(n_results * 3, HYBRID_CANDIDATES)
+        query_vec = self.embed(embedding_service, text)
+        with stage("chroma_query"):
+            vector = collection.query(query_embeddings=[query_vec], n_results=candidates)
+        with stage("lexical_search"):
+            lexical = [doc_id for doc_id, _ in index.search(text, candidates)]
+        fused = reciprocal_rank_fusion([vector["ids"][0], lexical])[:n_results]
+        found = {doc_id: (doc, meta) for doc_id, doc, meta in
+                 zip(vector["ids"][0], vector["documents"][0], vector["metadatas"][0] or [None] * len(vector["ids"][0]))}
+        missing = [doc_id for doc_id in fused if doc_id not in found]
+        for doc_id, doc, meta in zip(missing, *index.documents(missing)):
+            found[doc_id] = (doc, meta)
+        self._count_path("hybrid")
+        return {"ids": [fused], "documents": [[found[i][0] for i in fused]],
+                "metadatas": [[found[i][1] for i in fused]], "distances": None}
+
+    def lexical_index(self, name: str, collection, version: tuple = None) -> LexicalIndex:
+        """The collection's lexical index, re-synced if the collection changed since the last call."""
+        version = version or self.version(name, collection)
+        entry = self._lexical.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        with self._sync_lock:
+            entry = self._lexical.get(name)
+            if entry is None or entry[0] != version:
+                index = entry[1] if entry is not None else LexicalIndex()
+                started = time.perf_counter()
+                added, removed = index.sync(collection)
+                log.info("Lexical index '%s': +%d -%d -> %d docs (%.3fs)",
+                         name, added, removed, len(index), time.perf_counter() - started)
+                self._lexical[name] = entry = (version, index)
+            return entry[1]
+
+    def invalidate(self, name: str) -> int:
+        """Drop every cached result of one collection (call after ingesting into it)."""
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+        return self.results.discard_where(lambda key: key[0] == name)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            paths = dict(self._paths)
+        return {
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+            "hybrid": self.hybrid,
+            "search_paths": paths,  # vector / lexical（埋め込みなし）/ hybrid の件数
+            "lexical_docs": {name: len(entry[1]) for name, entry in self._lexical.items()},
+        }
@@ -1,25 +1,165 @@
 # save_book_to_chroma.py
-import chromadb
-from sentence_transformers import SentenceTransformer
+# story.txt を ChromaDB の book コレクションに差分登録する
+#
+# 書籍は文単位に分割し、約 --chunk-tokens トークンのチャンク（前後に重なりあり）にまとめて登録する
+# （--chunking lines で従来の1行=1文書）。各チャンクのIDは内容のハッシュ（sha1）なので、再実行時は
+#   - 変わっていないチャンク: 埋め込みをスキップ（位置が変わったものはメタデータだけ更新）
+#   - 新しい・書き換えたチャンク: 埋め込んで upsert
+#   - 消えたチャンク: 削除
+# となる。書籍はストリームで読み、埋め込みと登録は --batch-size 件ずつ行う。
+#   python save_book_to_chroma.py                # 登録
+#   python save_book_to_chroma.py --dry-run      # 何が変わるかだけ表示
+import argparse
+import hashlib
+import time
+from typing import Dict, Iterator, List, Tuple
 
-# 書籍データの読み込み
-with open("story.txt", encoding="utf-8") as f:
-    book_lines = [line.strip() for line in f if line.strip()]
+from chunking import CHUNK_TOKENS, OVERLAP_TOKENS, chunk_stream
+from vector_store import open_client
 
-# 埋め込みモデル
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+BOOK_FILE = "story.txt"
+CHROMA_DB_PATH = "chroma_db"
+COLLECTION_NAME = "book"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+BATCH_SIZE = 256
+GET_PAGE_SIZE = 5000  # 既存IDを読み出すときの1回あたりの件数
 
-# ChromaDBセットアップ（永続化ディレクトリを指定）
-chroma_client = chromadb.PersistentClient(path="chroma_db")
-# TODO: フロントからインプットしたデータをChromaDBに登録する
-collection = chroma_client.get_or_create_collection("book")
 
-# 既存データをクリア（必要に応じて）
-collection.delete(where={"id": {"$ne": ""}})
+def content_id(text: str) -> str:
+    return "sha1_" + hashlib.sha1(text.encode("utf-8")).hexdigest()
 
-# TODO: 登録前にデータの最適化を再設計
-embeddings = embedder.encode(book_lines).tolist()
-ids = [f"line_{i}" for i in range(len(book_lines))]
-collection.add(documents=book_lines, embeddings=embeddings, ids=ids)
 
-print("データをChromaDBに登録しました。")
\ No newline at end of file
+def read_lines(path: str) -> Iterator[Tuple[int, str]]:
+    """Yield (line number, text) for every non-empty line without loading the whole file."""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            text = line.strip()
+            if text:
+                yield line_no, text
+
+
+def read_chunks(path: str, mode: str = "sentences", max_tokens: int = CHUNK_TOKENS,
+                overlap_tokens: int = OVERLAP_TOKENS) -> Iterator[Tuple[str, Dict]]:
+    """Yield (document, metadata) for each chunk of the book; metadata records where it came from."""
+    if mode == "lines":
+        for line_no, text in read_lines(path):
+            yield text, {"source": path, "line": line_no}
+        return
+    with open(path, encoding="utf-8") as f:
+        for chunk in chunk_stream(f, max_tokens, overlap_tokens):
+            yield chunk.text, {"source": path, "chunk": chunk.index, "start": chunk.start, "end": chunk.end}
+
+
+def batched(items: Iterator, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def existing_entries(collection, source: str) -> Dict[str, Dict]:
+    """
+    Map id -> metadata for the entries owned by this source.
+
+    Entries without a source (the old positional line_{i} ids) are treated as
+    owned too, so the first incremental run replaces them.
+    """
+    entries = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=GET_PAGE_SIZE, offset=offset)
+        for entry_id, metadata in zip(page["ids"], page["metadatas"]):
+            metadata = metadata or {}
+            if metadata.get("source", source) == source:
+                entries[entry_id] = metadata
+        if len(page["ids"]) < GET_PAGE_SIZE:
+            return entries
+        offset += GET_PAGE_SIZE
+
+
+def sync_book(collection, source: str, embedder, batch_size: int = BATCH_SIZE, dry_run: bool = False,
+              chunking: str = "sentences", max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS) -> Dict:
+    existing = existing_entries(collection, source)
+    seen = set()
+    counts = {"added": 0, "moved": 0, "unchanged": 0, "duplicates": 0, "removed": 0}
+
+    for batch in batched(read_chunks(source, chunking, max_tokens, overlap_tokens), batch_size):
+        new_ids, new_docs, new_meta = [], [], []
+        moved_ids, moved_meta = [], []
+        for text, metadata in batch:
+            entry_id = content_id(text)
+            if entry_id in seen:
+                counts["duplicates"] += 1  # 同じ内容は1件だけ登録する
+                continue
+            seen.add(entry_id)
+            if entry_id not in existing:
+                new_ids.append(entry_id)
+                new_docs.append(text)
+                new_meta.append(metadata)
+            elif existing[entry_id] != metadata:
+                moved_ids.append(entry_id)
+                moved_meta.append(metadata)
+            else:
+                counts["unchanged"] += 1
+        counts["added"] += len(new_ids)
+        counts["moved"] += len(moved_ids)
+        if dry_run:
+            continue
+        if new_ids:
+            embeddings = embedder.encode(new_docs).tolist()
+            collection.upsert(ids=new_ids, documents=new_docs, embeddings=embeddings, metadatas=new_meta)
+        if moved_ids:
+            collection.update(ids=moved_ids, metadatas=moved_meta)
+
+    removed = [entry_id for entry_id in existing if entry_id not in seen]
+    counts["removed"] = len(removed)
+    if not dry_run:
+        for batch in batched(iter(removed), batch_size):
+            collection.delete(ids=batch)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally sync a book text file into a ChromaDB collection")
+    parser.add_argument("--source", default=BOOK_FILE)
+    parser.add_argument("--db", default=CHROMA_DB_PATH)
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--chunking", choices=["sentences", "lines"], default="sentences",
+                        help="pack sentences into overlapping chunks, or store one document per line")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=OVERLAP_TOKENS)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    # ChromaDBセットアップ（永続化ディレクトリを指定）。VECTOR_STORE=numpy ならサーバーと同じ memmap のストアに書く
+    chroma_client = open_client(args.db)
+    # TODO: フロントからインプットしたデータをChromaDBに登録する
+    collection = chroma_client.get_or_create_collection(args.collection)
+
+    embedder = None
+    if not args.dry_run:
+        # 埋め込みモデル（dry-run では読み込まない）
+        from sentence_transformers import SentenceTransformer
+        from embedding_service import EmbeddingService
+        embedder = EmbeddingService(SentenceTransformer(args.model))
+
+    counts = sync_book(collection, args.source, embedder, batch_size=args.batch_size, dry_run=args.dry_run,
+                       chunking=args.chunking, max_tokens=args.chunk_tokens, overlap_tokens=args.overlap_tokens)
+    elapsed = time.perf_counter() - started
+
+    label = "変更予定 (dry-run)" if args.dry_run else "データをChromaDBに登録しました"
+    print(f"{label}: 追加 {counts['added']} / 位置のみ更新 {counts['moved']} / 削除 {counts['removed']} / "
+          f"変更なし {counts['unchanged']} / 重複行 {counts['duplicates']} ({elapsed:.2f}s)")
+    if embedder is not None:
+        print(f"埋め込み統計: {embedder.stats()}")
+
+
+if __name__ == "__main__":
+    main()
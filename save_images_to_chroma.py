@@ -1,43 +1,184 @@
-# save_images_to_chroma.py (仮の構成)
+# save_images_to_chroma.py
+# 画像フォルダを ChromaDB の image_vectors コレクションに差分登録する
+#
+# 読み込み・デコード・縮小（PIL）はスレッドプールで並列に行い、次のバッチのデコードを進めながら
+# 今のバッチを埋め込む。埋め込みは CLIP 系のモデル（既定: sentence-transformers の clip-ViT-B-32）で
+# --batch-size 枚ずつまとめて行う。各画像の ID はパスから、指紋は (パス, mtime, サイズ) から作るので、再実行時は
+#   - 変わっていない画像: デコードも埋め込みもスキップ
+#   - 新しい・更新された画像: 埋め込んで upsert
+#   - 消えた画像: 削除
+# となる。埋め込み器は encode(画像のリスト) -> (n, d) の配列を返すオブジェクトなら差し替えられる（--embedder module:factory）。
+#   python save_images_to_chroma.py images/
+#   python save_images_to_chroma.py images/ --dry-run      # 何が変わるかだけ表示
+import argparse
+import hashlib
+import importlib
 import os
-import chromadb
-from sentence_transformers import SentenceTransformer
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
 from PIL import Image
-import glob
-
-def save_images_to_chroma(image_folder_path, chroma_db_path="chroma_db", collection_name="image_vectors"):
-    # 1. モデルのロード
-    # model = SentenceTransformer('clip-ViT-B-32') # 画像用モデル
-
-    # 2. ChromaDBクライアントの初期化
-    # client = chromadb.PersistentClient(path=chroma_db_path)
-    # collection = client.get_or_create_collection(name=collection_name)
-
-    # 3. 画像ファイルのリストアップ (例: jpg, png)
-    # image_paths = glob.glob(os.path.join(image_folder_path, "*.jpg")) + \
-    #               glob.glob(os.path.join(image_folder_path, "*.png"))
-
-    # image_embeddings = []
-    # image_metadata = []
-    # image_ids = []
-
-    # for idx, img_path in enumerate(image_paths):
-        # try:
-            # img = Image.open(img_path)
-            # embedding = model.encode(img).tolist() # PIL Imageオブジェクトをエンコード
-
-            # image_embeddings.append(embedding)
-            # image_metadata.append({"source": img_path})
-            # image_ids.append(f"img_{idx}")
-        # except Exception as e:
-            # print(f"Error processing {img_path}: {e}")
-
-    # if image_ids:
-        # collection.add(
-            # embeddings=image_embeddings,
-            # metadatas=image_metadata,
-            # ids=image_ids
-        # )
-        # print(f"Added {len(image_ids)} images to ChromaDB collection '{collection_name}'.")
-    # else:
-        # print("No images found or processed.")
\ No newline at end of file
+
+from bulk_ingest import Progress
+from save_book_to_chroma import CHROMA_DB_PATH, batched, existing_entries
+from vector_store import open_client
+
+IMAGE_FOLDER = "images"
+COLLECTION_NAME = "image_vectors"
+IMAGE_MODEL = "clip-ViT-B-32"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+IMAGE_SIZE = 224      # CLIP の入力解像度。これより大きい画像は長辺をこのサイズまで縮小してから渡す
+BATCH_SIZE = 32
+
+
+def list_images(folder: str, recursive: bool = True) -> Iterator[str]:
+    """Yield image paths under folder in a stable (sorted) order."""
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        if not recursive:
+            dirs.clear()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def image_id(path: str) -> str:
+    return "img_" + hashlib.sha1(os.path.normpath(path).encode("utf-8")).hexdigest()
+
+
+def fingerprint(path: str, stat: os.stat_result) -> str:
+    return f"{os.path.normpath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+
+
+def load_image(path: str, size: int = IMAGE_SIZE) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Decode an image as RGB, shrunk so that its longer side is at most size; returns (image, original size)."""
+    with Image.open(path) as img:
+        original = img.size
+        # JPEG は縮小しながらデコードできる（フル解像度を展開しない）
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+    img.thumbnail((size, size))
+    return img, original
+
+
+def load_embedder(spec: str):
+    """'module:factory' imports and calls factory(); anything else is a sentence-transformers model name."""
+    if ":" in spec:
+        module_name, attr = spec.split(":", 1)
+        return getattr(importlib.import_module(module_name), attr)()
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(spec)
+
+
+def sync_images(collection, folder: str, embedder, batch_size: int = BATCH_SIZE, workers: int = 0,
+                image_size: int = IMAGE_SIZE, recursive: bool = True, dry_run: bool = False,
+                progress: Optional[Progress] = None) -> Dict:
+    source = os.path.normpath(folder)
+    existing = existing_entries(collection, source)
+    progress = progress or Progress()
+    counts = {"added": 0, "updated": 0, "unchanged": 0, "failed": 0, "removed": 0}
+    timings = {"decode_wait": 0.0, "encode": 0.0, "write": 0.0}  # デコードは並列なので、待たされた時間だけを数える
+    seen = set()
+
+    todo: List[Tuple[str, str, str, int]] = []  # (id, path, fingerprint, bytes)
+    for path in list_images(folder, recursive):
+        progress.read += 1
+        entry_id = image_id(path)
+        seen.add(entry_id)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            counts["failed"] += 1
+            continue
+        mark = fingerprint(path, stat)
+        previous = existing.get(entry_id)
+        if previous is not None and previous.get("fingerprint") == mark:
+            counts["unchanged"] += 1
+            progress.skipped += 1
+            continue
+        counts["updated" if previous is not None else "added"] += 1
+        todo.append((entry_id, path, mark, stat.st_size))
+
+    removed = [entry_id for entry_id in existing if entry_id not in seen]
+    counts["removed"] = len(removed)
+    if dry_run:
+        return {**counts, "seconds": timings}
+
+    workers = workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-decode") as executor:
+        def decode(batch):
+            return [(entry, executor.submit(load_image, entry[1], image_size)) for entry in batch]
+
+        batches = batched(iter(todo), batch_size)
+        pending = decode(next(batches, []))
+        while pending:
+            started = time.perf_counter()
+            images, ids, metadatas = [], [], []
+            for (entry_id, path, mark, size), future in pending:
+                try:
+                    image, (width, height) = future.result()
+                except Exception as e:
+                    print(f"!!! Could not read {path}: {e}")
+                    counts["failed"] += 1
+                    counts["updated" if entry_id in existing else "added"] -= 1
+                    continue
+                images.append(image)
+                ids.append(entry_id)
+                metadatas.append({"source": source, "path": path, "fingerprint": mark, "bytes": size,
+                                  "width": width, "height": height})
+            # 次のバッチのデコードを先に始めておき、その間に今のバッチを埋め込む
+            pending = decode(next(batches, []))
+            timings["decode_wait"] += time.perf_counter() - started
+            if not ids:
+                continue
+
+            started = time.perf_counter()
+            embeddings = embedder.encode(images)
+            timings["encode"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            # パスを documents に入れておくと、検索結果からそのまま画像を開ける
+            collection.upsert(ids=ids, documents=[m["path"] for m in metadatas],
+                              embeddings=[list(map(float, vector)) for vector in embeddings], metadatas=metadatas)
+            timings["write"] += time.perf_counter() - started
+            progress.written += len(ids)
+            progress.maybe_report()
+
+    for batch in batched(iter(removed), batch_size):
+        collection.delete(ids=batch)
+    return {**counts, "seconds": {name: round(seconds, 3) for name, seconds in timings.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally embed a folder of images into a ChromaDB collection")
+    parser.add_argument("folder", nargs="?", default=IMAGE_FOLDER)
+    parser.add_argument("--db", default=CHROMA_DB_PATH)
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--embedder", default=IMAGE_MODEL,
+                        help="sentence-transformers model name, or module:factory returning an object with encode(images)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=0, help="decode threads (default: min(8, CPUs))")
+    parser.add_argument("--image-size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--no-recursive", action="store_true", help="only the top-level folder")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    collection = open_client(args.db).get_or_create_collection(args.collection)
+    # dry-run では埋め込みモデルを読み込まない
+    embedder = None if args.dry_run else load_embedder(args.embedder)
+    progress = Progress()
+    counts = sync_images(collection, args.folder, embedder, batch_size=args.batch_size, workers=args.workers,
+                         image_size=args.image_size, recursive=not args.no_recursive, dry_run=args.dry_run,
+                         progress=progress)
+    progress.maybe_report(force=True)
+
+    label = "変更予定 (dry-run)" if args.dry_run else f"画像を '{args.collection}' に登録しました"
+    print(f"{label}: 追加 {counts['added']} / 更新 {counts['updated']} / 削除 {counts['removed']} / "
+          f"変更なし {counts['unchanged']} / 失敗 {counts['failed']} ({progress.rate():.1f} images/sec)")
+    if not args.dry_run:
+        print(f"段階ごとの時間: {counts['seconds']}")
+
+
+if __name__ == "__main__":
+    main()
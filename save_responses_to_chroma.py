@@ -1,12 +1,13 @@
-import chromadb
 from sentence_transformers import SentenceTransformer
+from semantic_cache import VALIDATED_RESPONSES_COLLECTION, QA_KIND, parse_validated_line, validated_id
+from vector_store import open_client
 import os
-import time # ユニークID生成のために追加
+import time
 import threading # Added for threading
 
 # --- 設定 ---
 VALIDATED_RESPONSES_FILE = "validated_responses.txt"  # 回答データを読み書きするテキストファイル
-COLLECTION_NAME = "validated_responses_store"      # ChromaDBのコレクション名
+COLLECTION_NAME = VALIDATED_RESPONSES_COLLECTION   # ChromaDBのコレクション名
 CHROMA_DB_PATH = "chroma_db"                       # ChromaDBの永続化パス
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 PROCESSING_INTERVAL_SECONDS = 600 # Process every 60 seconds
@@ -14,6 +15,19 @@ PROCESSING_INTERVAL_SECONDS = 600 # Process every 60 seconds
 # Global flag to signal the thread to stop
 stop_event = threading.Event()
 
+_embedder = None
+
+def get_embedder():
+    """
+    Load the embedding model on the first pass and reuse it afterwards.
+    Each pass makes one bulk encode call, so the model is called directly
+    (no EmbeddingService batching thread to start, or leak, per pass).
+    """
+    global _embedder
+    if _embedder is None:
+        _embedder = SentenceTransformer(EMBEDDING_MODEL)
+    return _embedder
+
 def process_responses():
     """
     Reads validated responses from the text file, saves them to ChromaDB,
@@ -31,7 +45,9 @@ def process_responses():
         # Open file in r+ mode (read and write)
         # This allows reading and then truncating if successful, within one operation.
         with open(VALIDATED_RESPONSES_FILE, "r+", encoding="utf-8") as f:
-            texts_to_process = [line.strip() for line in f if line.strip()]
+            # 新形式は {"question", "answer"} のJSON行、旧形式は回答テキストのみの行
+            records = [record for record in map(parse_validated_line, f) if record]
+            texts_to_process = [record["answer"] for record in records]
             
             if not texts_to_process:
                 print(f"'{VALIDATED_RESPONSES_FILE}' は空です。処理するデータがありません。")
@@ -40,11 +56,10 @@ def process_responses():
             print(f"'{VALIDATED_RESPONSES_FILE}' から {len(texts_to_process)} 件のデータを読み込みました。")
 
             # --- ChromaDBクライアントと埋め込みモデルの初期化 ---
-            # Initializing these here for each run is safer for resource management in a long-running thread,
-            # though less performant if the interval is very short.
+            # モデルは初回だけ読み込んで使い回す（クライアントは毎回開き直す）
             try:
-                embedder = SentenceTransformer(EMBEDDING_MODEL)
-                chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+                embedder = get_embedder()
+                chroma_client = open_client(CHROMA_DB_PATH)  # VECTOR_STORE=numpy ならサーバーと同じストアに書く
                 collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
                 print(f"ChromaDBコレクション '{COLLECTION_NAME}' を使用します。")
             except Exception as e:
@@ -55,12 +70,17 @@ def process_responses():
             # --- 2. ChromaDBのコレクションにデータを保存 ---
             try:
                 print(f"{len(texts_to_process)} 件のデータを埋め込み中...")
-                embeddings = embedder.encode(texts_to_process).tolist()
-                
-                timestamp_ns = time.time_ns() # ナノ秒単位のタイムスタンプ
-                ids = [f"validated_item_{timestamp_ns}_{i}" for i in range(len(texts_to_process))]
+                # id は内容のハッシュ（api_server の取り込みワーカー・bulk_ingest.py と同じ）なので、登録済みの組は上書きになる
+                unique = {validated_id(record["question"], record["answer"]): record for record in records}
+                # 質問がある回答は質問文を埋め込む（意味キャッシュが質問同士の近さで検索するため）
+                embeddings = embedder.encode([record["question"] or record["answer"] for record in unique.values()]).tolist()
+                metadatas = [
+                    {"kind": QA_KIND, "question": record["question"]} if record["question"] else {"kind": "answer"}
+                    for record in unique.values()
+                ]
 
-                collection.add(documents=texts_to_process, embeddings=embeddings, ids=ids)
+                collection.upsert(documents=[record["answer"] for record in unique.values()], embeddings=embeddings,
+                                  metadatas=metadatas, ids=list(unique))
                 print(f"{len(texts_to_process)} 件のデータをChromaDBコレクション '{COLLECTION_NAME}' に正常に保存しました。")
 
                 # --- 3. 成功した場合、テキストファイルの内容をクリア ---
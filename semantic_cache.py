@@ -0,0 +1,131 @@
+# semantic_cache.py
+# 検証済みの質問/回答ペア（validated_responses_store）を意味検索し、十分に近い質問が過去にあれば
+# LLMを呼ばずに保存済みの回答を返す
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from metrics import record_stage
+from logging_setup import preview
+
+log = logging.getLogger(__name__)
+
+VALIDATED_RESPONSES_COLLECTION = "validated_responses_store"
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # コサイン類似度
+QA_KIND = "qa"
+LLM_LATENCY_SMOOTHING = 0.2  # LLM所要時間の指数移動平均の係数
+
+
+# --- validated_responses.txt の1行の形式 ---
+# 新形式: {"question": "...", "answer": "..."} のJSON行
+# 旧形式: 回答テキストのみの行（質問が無いのでキャッシュの対象外）
+def parse_validated_line(line: str) -> Optional[Dict]:
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            record = None
+        if isinstance(record, dict) and record.get("answer"):
+            return {"question": record.get("question") or "", "answer": record["answer"]}
+    return {"question": "", "answer": line}
+
+
+def validated_id(question: str, answer: str) -> str:
+    """
+    Content id of a validated Q/A pair. The ingestion worker, bulk_ingest and
+    save_responses_to_chroma all use it, so the same pair is stored once.
+    """
+    body = json.dumps([question.strip(), answer.strip()], ensure_ascii=False)
+    return "sha1_" + hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def distance_to_similarity(distance: float, space: str) -> float:
+    if space in ("cosine", "ip"):
+        return 1.0 - distance
+    # Chroma の既定 "l2" は二乗距離。正規化済みベクトル (MiniLM) なら cos = 1 - d/2
+    return 1.0 - distance / 2.0
+
+
+class SemanticAnswerCache:
+    """
+    Optional fast path in front of the LLM.
+
+    lookup() embeds the question, finds the nearest stored question (documents
+    with metadata kind == "qa" in the validated responses collection) and
+    returns its answer when the similarity reaches the threshold. Hits and the
+    LLM time they avoided (estimated from observe_llm()) are counted.
+    """
+
+    def __init__(self, enabled: bool = SEMANTIC_CACHE_ENABLED, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 collection_name: str = VALIDATED_RESPONSES_COLLECTION):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.collection_name = collection_name
+        self._lock = threading.Lock()
+        self._llm_seconds: Dict[str, float] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def lookup(self, resources, question: str, backend: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        hit = None
+        collection = resources.collection(self.collection_name)
+        if collection.count() > 0:
+            query_vec = resources.retrieval.embed(resources.embedding_service, question)
+            results = collection.query(query_embeddings=[query_vec], n_results=1, where={"kind": QA_KIND})
+            if results["ids"] and results["ids"][0]:
+                space = (collection.metadata or {}).get("hnsw:space", "l2")
+                similarity = distance_to_similarity(results["distances"][0][0], space)
+                if similarity >= self.threshold:
+                    hit = {
+                        "id": results["ids"][0][0],
+                        "answer": results["documents"][0][0],
+                        "question": (results["metadatas"][0][0] or {}).get("question", ""),
+                        "similarity": round(similarity, 4),
+                    }
+        elapsed = time.perf_counter() - started
+        record_stage("semantic_cache", elapsed)
+        with self._lock:
+            self.lookups += 1
+            self.lookup_seconds += elapsed
+            if hit is not None:
+                self.hits += 1
+                self.saved_seconds += max(self._llm_seconds.get(backend, 0.0) - elapsed, 0.0)
+        if hit is not None:
+            log.info("Semantic cache hit (%s): %s", hit["similarity"], preview(hit["question"], 40))
+        return hit
+
+    def observe_llm(self, backend: str, seconds: float):
+        """Record how long an uncached LLM call took (used to estimate the time a hit saves)."""
+        with self._lock:
+            previous = self._llm_seconds.get(backend)
+            self._llm_seconds[backend] = seconds if previous is None else \
+                previous + LLM_LATENCY_SMOOTHING * (seconds - previous)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                "lookup_ms_mean": round(self.lookup_seconds / self.lookups * 1000, 3) if self.lookups else 0.0,
+                "latency_saved_seconds": round(self.saved_seconds, 3),
+                "llm_seconds_mean": {k: round(v, 3) for k, v in self._llm_seconds.items()},
+            }
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,98 @@
+# test_admitted_stream.py
+# SSE エンドポイントが確保したアドミッション枠を、ストリームが始まらなかった・途中で切れたときにも返すことを確かめる
+#   python -m pytest test_admitted_stream.py
+import asyncio
+
+import pytest
+
+from admission import AdmissionController
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)   # api_server の import が作る実行時ファイルをリポジトリに置かない
+    import api_server
+
+    controller = AdmissionController({"ollama": 1})
+    monkeypatch.setattr(api_server, "admission", controller)
+    return api_server, controller
+
+
+def in_flight(controller: AdmissionController) -> int:
+    return controller.stats().get("ollama", {}).get("in_flight", 0)
+
+
+def make_stream(events):
+    state = {"started": False, "closed": False}
+
+    async def event_stream():
+        state["started"] = True
+        try:
+            for event in events:
+                yield event
+        finally:
+            state["closed"] = True
+    return event_stream(), state
+
+
+def run_response(api_server, controller, scope, receive, send, events=("event: token\n\n",)):
+    async def main():
+        granted = await controller.acquire("ollama")
+        body, state = make_stream(events)
+        response = api_server.AdmittedStream(body, "ollama", granted)
+        try:
+            await response(scope, receive, send)
+        except Exception:
+            pass   # 切断は ClientDisconnect などとして上がってくる
+        return state
+    return asyncio.run(main())
+
+
+def test_slot_is_released_when_client_leaves_before_the_body(server):
+    api_server, controller = server
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.sleep(1)   # 遅いクライアント。先に切断が届く
+
+    state = run_response(api_server, controller, {"type": "http", "asgi": {"spec_version": "2.0"}}, receive, send)
+    assert not state["started"]
+    assert in_flight(controller) == 0
+
+
+def test_slot_is_released_when_sending_fails_mid_stream(server):
+    api_server, controller = server
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and sent:
+            raise OSError("connection reset")
+        sent.append(message)
+
+    events = ("event: token\n\n", "event: token\n\n", "event: done\n\n")
+    state = run_response(api_server, controller, {"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send, events)
+    assert state == {"started": True, "closed": True}
+    assert in_flight(controller) == 0
+
+
+def test_slot_is_released_after_a_complete_stream(server):
+    api_server, controller = server
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    state = run_response(api_server, controller, {"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    assert state == {"started": True, "closed": True}
+    assert sent[0]["status"] == 200 and (b"content-type", b"text/event-stream; charset=utf-8") in sent[0]["headers"]
+    assert in_flight(controller) == 0
@@ -0,0 +1,72 @@
+# test_blocking_pool.py
+# LLM呼び出しの同時実行数を決めるのはアドミッション制御だけで、BlockingPool が別の上限をかけないことを確かめる
+#   python -m pytest test_blocking_pool.py
+import asyncio
+import threading
+import time
+
+from admission import ADMISSION_LIMITS, AdmissionController
+from blocking_pool import BlockingPool
+from llm_router import LLMRouter
+
+CALL_SECONDS = 0.3
+
+
+def test_admitted_gemini_calls_run_concurrently():
+    calls = ADMISSION_LIMITS["gemini"]
+    pool = BlockingPool()
+    controller = AdmissionController()
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def gemini(cancel):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(CALL_SECONDS)
+        with lock:
+            running["now"] -= 1
+        return "answer"
+
+    async def main():
+        router = LLMRouter()
+        acquire = controller.router_acquire()
+        return await asyncio.gather(*(router.complete({"gemini": gemini}, "gemini", False, run=pool.run_llm,
+                                                      acquire=acquire) for _ in range(calls)))
+
+    started = time.monotonic()
+    try:
+        results = asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert results == [("gemini", "answer")] * calls
+    assert running["max"] == calls
+    assert time.monotonic() - started < CALL_SECONDS * 2
+
+
+def test_admission_limit_still_bounds_llm_calls():
+    pool = BlockingPool()
+    controller = AdmissionController({"ollama": 2})
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def ollama(cancel):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.05)
+        with lock:
+            running["now"] -= 1
+        return "answer"
+
+    async def main():
+        router = LLMRouter()
+        acquire = controller.router_acquire()
+        await asyncio.gather(*(router.complete({"ollama": ollama}, "ollama", False, run=pool.run_llm,
+                                               acquire=acquire) for _ in range(6)))
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert running["max"] == 2
@@ -0,0 +1,52 @@
+# test_chat_store.py
+# 同じ chat_history.jsonl を複数のプロセス（api_server, web_chat.py, voice_agent_chat.py）が書いても
+# id が重複せず、コンパクション中の追記も失われないことを確かめる
+#   python -m pytest test_chat_store.py
+import os
+import subprocess
+import sys
+
+from chat_store import ChatHistoryStore
+
+WRITER = """
+import sys
+from chat_store import ChatHistoryStore
+store = ChatHistoryStore(sys.argv[1], legacy_json_path=None, fsync=False)
+for n in range(int(sys.argv[3])):
+    store.append({"role": "user", "content": f"{sys.argv[2]}-{n}"})
+"""
+
+
+def start_writer(path, name, count):
+    return subprocess.Popen([sys.executable, "-c", WRITER, str(path), name, str(count)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_concurrent_processes_get_unique_ids(tmp_path):
+    path = tmp_path / "chat_history.jsonl"
+    writers = [start_writer(path, f"w{i}", 100) for i in range(4)]
+    assert [writer.wait(timeout=60) for writer in writers] == [0] * 4
+
+    entries = ChatHistoryStore(str(path), legacy_json_path=None).entries()
+    ids = [entry_id for entry_id, _ in entries]
+    assert len(ids) == len(set(ids)) == 400
+    assert ids == sorted(ids)
+    assert {msg["content"] for _, msg in entries} == {f"w{i}-{n}" for i in range(4) for n in range(100)}
+
+
+def test_compaction_keeps_appends_from_other_processes(tmp_path):
+    path = tmp_path / "chat_history.jsonl"
+    store = ChatHistoryStore(str(path), legacy_json_path=None, fsync=False)
+    ids = store.append_many([{"role": "user", "content": f"old-{n}"} for n in range(300)])
+    store.delete(ids[:200])
+
+    writer = start_writer(path, "w", 300)
+    while writer.poll() is None:
+        store.compact()
+    assert writer.returncode == 0
+    store.compact()
+
+    contents = [msg["content"] for msg in ChatHistoryStore(str(path), legacy_json_path=None).messages()]
+    assert contents[:100] == [f"old-{n}" for n in range(200, 300)]
+    assert sorted(contents[100:]) == sorted(f"w-{n}" for n in range(300))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
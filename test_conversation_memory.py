@@ -0,0 +1,105 @@
+# test_conversation_memory.py
+# ConversationMemory が送る文脈と溜める発言の量が、要約の成否にかかわらず一定以下に収まること、
+# 別の会話履歴の要約キャッシュを使わないことを確かめる
+#   python -m pytest test_conversation_memory.py
+from conversation_memory import MEMORY_MAX_BACKLOG, ConversationMemory, message_text, text_message
+
+
+def turns(start: int, count: int):
+    ids, messages = [], []
+    for i in range(start, start + count):
+        ids += [2 * i, 2 * i + 1]
+        messages += [text_message("user", f"質問{i}"), text_message("assistant", f"回答{i}")]
+    return ids, messages
+
+
+def make_memory(tmp_path, summarize, entries=()):
+    return ConversationMemory(summarize, list(entries), keep_turns=2, fold_messages=4,
+                              cache_path=str(tmp_path / "summary.json"))
+
+
+def test_context_stays_bounded_when_summarize_fails(tmp_path):
+    calls = []
+
+    def summarize(prompt):
+        calls.append(prompt)
+        raise TimeoutError("ollama is down")
+
+    memory = make_memory(tmp_path, summarize)
+    try:
+        for turn in range(30):
+            memory.add(*turns(turn, 1))
+            if memory._pending is not None:
+                memory._pending.result()
+            context = memory.context([text_message("user", "新しい質問")])
+            # 要約なし: 直近 keep_messages(4) + 畳み込み待ち fold_messages(4) + 新しい質問
+            assert len(context) <= 4 + 4 + 1
+        assert calls, "summarize should have been attempted"
+        texts = [message_text(m) for m in context]
+        assert texts[-1] == "新しい質問"
+        assert texts[-2] == "回答29"
+        assert "質問0" not in texts
+    finally:
+        memory.close()
+
+
+def test_context_folds_old_turns_into_summary(tmp_path):
+    memory = make_memory(tmp_path, lambda prompt: "要約です", entries=zip(*turns(0, 2)))
+    try:
+        for turn in range(2, 10):
+            memory.add(*turns(turn, 1))
+            if memory._pending is not None:
+                memory._pending.result()
+        context = memory.context([])
+        assert message_text(context[0]).endswith("要約です")
+        assert [message_text(m) for m in context[-2:]] == ["質問9", "回答9"]
+        assert len(context) <= 1 + 4 + 4
+    finally:
+        memory.close()
+
+
+def test_memory_holds_a_bounded_backlog_while_summarize_fails(tmp_path):
+    def summarize(prompt):
+        raise TimeoutError("ollama is down")
+
+    memory = make_memory(tmp_path, summarize)
+    try:
+        for turn in range(200):
+            memory.add(*turns(turn, 1))
+        memory._pending.result()
+        assert len(memory._messages) <= 4 + MEMORY_MAX_BACKLOG
+        assert memory._messages[-1][0] == 399
+        assert memory.summarized_upto == memory._messages[0][0] - 1
+    finally:
+        memory.close()
+
+
+def test_cached_summary_is_reused_only_for_the_same_history(tmp_path):
+    history = list(zip(*turns(0, 10)))
+    memory = make_memory(tmp_path, lambda prompt: "昔の要約", entries=history)
+    memory._pending.result()
+    memory.close()
+    summarized_upto = memory.summarized_upto
+    assert summarized_upto >= 0
+
+    # 同じ履歴で再起動: 要約を使い、要約済みの発言は送らない
+    restarted = make_memory(tmp_path, lambda prompt: "昔の要約", entries=history)
+    restarted.close()
+    assert restarted.summary == "昔の要約"
+    assert restarted.summarized_upto == summarized_upto
+
+    def unavailable(prompt):
+        raise TimeoutError("ollama is down")
+
+    # 履歴を消して最初からやり直した: id は 0 から振り直されるので、要約済みの id を超えていても使わない
+    for count in (2, 10):
+        reset = [(i, text_message("user", f"新しい会話{i}")) for i in range(2 * count)]
+        fresh = make_memory(tmp_path, unavailable, entries=reset)
+        fresh.close()
+        assert fresh.summary == "" and fresh.summarized_upto == -1
+        assert [message_text(m) for m in fresh.context([])][-1] == f"新しい会話{2 * count - 1}"
+
+    # 履歴が空になった後に最初の発言が来ても、古い要約は使わない
+    empty = make_memory(tmp_path, lambda prompt: "新しい要約")
+    empty.close()
+    assert empty.summary == "" and empty.summarized_upto == -1
@@ -0,0 +1,82 @@
+# test_ingestion_worker.py
+# 検証済みの質問/回答をどの経路（api_server の取り込みワーカー、bulk_ingest.py、save_responses_to_chroma.py）で
+# 登録しても、同じ組は validated_responses_store に1件だけになることを確かめる
+#   python -m pytest test_ingestion_worker.py
+import json
+
+import numpy as np
+
+import save_responses_to_chroma
+from bulk_ingest import read_records
+from ingestion_worker import IngestionWorker
+from semantic_cache import VALIDATED_RESPONSES_COLLECTION, validated_id
+from vector_store import open_client
+
+PAIRS = [("魔法使いの弟子は何をした？", "箒に水を運ばせた。"), ("王様はどこで花を育てた？", "城の庭で育てた。")]
+
+
+class StubEmbedder:
+    def encode(self, texts):
+        return np.array([[float(len(text)), 1.0, 0.5] for text in texts])
+
+
+class StubResources:
+    """Just enough of the ResourceRegistry for IngestionWorker._write_batch."""
+
+    def __init__(self, collection):
+        self.embedding_service = StubEmbedder()
+        self.retrieval = type("Retrieval", (), {"invalidate": lambda self, name: None})()
+        self._collection = collection
+
+    def collection(self, name):
+        return self._collection
+
+
+def write_validated(path, pairs):
+    with open(path, "w", encoding="utf-8") as f:
+        for question, answer in pairs:
+            f.write(json.dumps({"question": question, "answer": answer}, ensure_ascii=False) + "\n")
+
+
+def test_every_writer_uses_the_same_id(tmp_path):
+    source = tmp_path / "validated_responses.txt"
+    write_validated(source, PAIRS)
+    worker = IngestionWorker(journal_path=str(tmp_path / "journal.jsonl"))
+
+    bulk_ids = [record["id"] for record in read_records(str(source), "validated")]
+    worker_ids = [worker._new_record(f" {question}\n", answer)["id"] for question, answer in PAIRS]
+    assert bulk_ids == worker_ids == [validated_id(question, answer) for question, answer in PAIRS]
+
+
+def test_pairs_loaded_through_every_path_are_stored_once(tmp_path, monkeypatch):
+    db = str(tmp_path / "db")
+    collection = open_client(db, backend="numpy", numpy_path=db).get_or_create_collection(VALIDATED_RESPONSES_COLLECTION)
+
+    # api_server の取り込みワーカー（同じ組が同じバッチに2回来ても1件）
+    worker = IngestionWorker(journal_path=str(tmp_path / "journal.jsonl"))
+    worker._resources = StubResources(collection)
+    worker._write_batch([worker._new_record(*PAIRS[0]), worker._new_record(*PAIRS[0]), worker._new_record(*PAIRS[1])])
+    assert collection.count() == 2
+
+    # bulk_ingest.py で同じファイルを読み込む（ライタースレッドと同じ upsert）
+    source = tmp_path / "validated_responses.txt"
+    write_validated(source, PAIRS)
+    records = list(read_records(str(source), "validated"))
+    collection.upsert(ids=[r["id"] for r in records], documents=[r["document"] for r in records],
+                      embeddings=StubEmbedder().encode([r["embed_text"] for r in records]).tolist(),
+                      metadatas=[r["metadata"] for r in records])
+    assert collection.count() == 2
+
+    # save_responses_to_chroma.py の定期処理
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(save_responses_to_chroma, "_embedder", StubEmbedder())
+    monkeypatch.setattr(save_responses_to_chroma, "CHROMA_DB_PATH", db)
+    monkeypatch.setattr("vector_store.VECTOR_STORE", "numpy")
+    monkeypatch.setattr(save_responses_to_chroma, "open_client",
+                        lambda path: open_client(path, backend="numpy", numpy_path=path))
+    write_validated(tmp_path / save_responses_to_chroma.VALIDATED_RESPONSES_FILE, PAIRS + PAIRS[:1])
+    save_responses_to_chroma.process_responses()
+
+    stored = collection.get()
+    assert collection.count() == 2
+    assert sorted(stored["documents"]) == sorted(answer for _, answer in PAIRS)
@@ -0,0 +1,137 @@
+# test_llm_router.py
+# LLMRouter のヘッジ・フォールバック・再試行が、送り先のバックエンドのアドミッション枠の中で行われることを確かめる
+#   python -m pytest test_llm_router.py
+import asyncio
+import time
+
+import llm_router
+from admission import AdmissionController
+from llm_router import LLM_HEDGE_MIN_SAMPLES, LLMRouter
+
+
+class RateLimited(Exception):
+    def __init__(self):
+        super().__init__("429 Too Many Requests")
+        self.response = type("Response", (), {"status_code": 429, "headers": {}})()
+
+
+def warm(router: LLMRouter, name: str, seconds: float):
+    # p95 を信用できるだけの成功を記録しておく（ヘッジの期限になる）
+    for _ in range(LLM_HEDGE_MIN_SAMPLES):
+        router.backend(name).record(True, seconds)
+
+
+def in_flight(controller: AdmissionController, backend: str) -> int:
+    return controller.stats().get(backend, {}).get("in_flight", 0)
+
+
+def test_hedge_is_not_sent_to_the_same_backend():
+    router = LLMRouter(hedge=True)
+    warm(router, "ollama", 0.01)
+    controller = AdmissionController({"ollama": 2})
+    calls = []
+
+    def slow(cancel):
+        calls.append(time.monotonic())
+        time.sleep(0.2)
+        return "answer"
+
+    result = asyncio.run(router.complete({"ollama": slow}, "ollama", False, acquire=controller.router_acquire()))
+    assert result == ("ollama", "answer")
+    assert len(calls) == 1
+    assert "hedges" not in router.stats()["counters"]
+
+
+def test_hedge_takes_a_slot_of_the_other_backend_and_cancels_the_loser():
+    router = LLMRouter(hedge=True)
+    warm(router, "ollama", 0.05)
+    controller = AdmissionController({"ollama": 1, "gemini": 1})
+    seen = {}
+
+    def slow(cancel):
+        seen["ollama_cancelled"] = cancel.wait(5.0)
+        return "slow"
+
+    def fast(cancel):
+        seen["gemini_in_flight"] = in_flight(controller, "gemini")
+        return "fast"
+
+    async def main():
+        result = await router.complete({"ollama": slow, "gemini": fast}, "ollama", acquire=controller.router_acquire())
+        await asyncio.sleep(0.2)  # 負けた呼び出しが止まって枠を返すのを待つ
+        return result
+
+    started = time.monotonic()
+    assert asyncio.run(main()) == ("gemini", "fast")
+    assert time.monotonic() - started < 2.0
+    assert seen == {"ollama_cancelled": True, "gemini_in_flight": 1}
+    assert in_flight(controller, "ollama") == 0 and in_flight(controller, "gemini") == 0
+    assert router.stats()["counters"]["hedge_wins"] == 1
+    assert router.backend("ollama").calls == LLM_HEDGE_MIN_SAMPLES  # 止めた呼び出しは統計に入れない
+
+
+def test_hedge_is_skipped_when_the_other_backend_is_full():
+    router = LLMRouter(hedge=True)
+    warm(router, "ollama", 0.01)
+    controller = AdmissionController({"ollama": 1, "gemini": 1})
+    calls = []
+
+    def slow(cancel):
+        time.sleep(0.2)
+        return "slow"
+
+    async def main():
+        held = controller.try_acquire("gemini")
+        try:
+            return await router.complete({"ollama": slow, "gemini": lambda cancel: calls.append(1) or "fast"}, "ollama",
+                                         acquire=controller.router_acquire())
+        finally:
+            controller.release("gemini", held)
+
+    assert asyncio.run(main()) == ("ollama", "slow")
+    assert calls == []
+    assert router.stats()["counters"]["hedges_skipped"] == 1
+
+
+def test_fallback_holds_a_slot_of_the_fallback_backend():
+    router = LLMRouter()
+    controller = AdmissionController({"ollama": 1, "gemini": 1})
+    seen = {}
+
+    def broken(cancel):
+        raise RuntimeError("connection refused")
+
+    def fallback(cancel):
+        seen["ollama"], seen["gemini"] = in_flight(controller, "ollama"), in_flight(controller, "gemini")
+        return "fallback answer"
+
+    result = asyncio.run(router.complete({"ollama": broken, "gemini": fallback}, "ollama",
+                                         acquire=controller.router_acquire()))
+    assert result == ("gemini", "fallback answer")
+    assert seen == {"ollama": 0, "gemini": 1}
+
+
+def test_backoff_releases_the_slot(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_BACKOFF_BASE", 0.6)  # 0.3〜0.6 秒待つ
+    router = LLMRouter(rate_limit_retries=1)
+    controller = AdmissionController({"ollama": 1})
+    attempts = []
+
+    def rate_limited_once(cancel):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited()
+        return "ok"
+
+    async def main():
+        task = asyncio.ensure_future(router.complete({"ollama": rate_limited_once}, "ollama", False,
+                                                     acquire=controller.router_acquire()))
+        await asyncio.sleep(0.15)
+        during_backoff = in_flight(controller, "ollama")
+        return await task, during_backoff
+
+    result, during_backoff = asyncio.run(main())
+    assert result == ("ollama", "ok")
+    assert len(attempts) == 2
+    assert during_backoff == 0
+    assert in_flight(controller, "ollama") == 0
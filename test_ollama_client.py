@@ -0,0 +1,84 @@
+# test_ollama_client.py
+# get_client がモデルごとに1つのクライアント（接続プール）を共有し、close() したクライアントを返し続けないこと、
+# keep_alive とプリロードのリクエストが Ollama にそのまま届くことを確かめる
+#   python -m pytest test_ollama_client.py
+import json
+import time
+
+import httpx
+import pytest
+
+import ollama_client
+from ollama_client import OllamaClient, get_client
+
+API_BASE = "http://ollama.test:11434"
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    """Route every OllamaClient through an in-memory Ollama and return the requests it received."""
+    received = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        received.append((request.url.path, body))
+        if request.url.path == "/api/generate":
+            return httpx.Response(200, json={"model": body["model"], "done": True})
+        frames = [{"message": {"content": "こんにちは"}, "done": False},
+                  {"message": {"content": ""}, "done": True, "load_duration": int(2e9)}]
+        return httpx.Response(200, content="".join(json.dumps(f) + "\n" for f in frames).encode())
+
+    real_client = httpx.Client
+    monkeypatch.setattr(ollama_client.httpx, "Client",
+                        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+    monkeypatch.setattr(ollama_client, "_clients", {})
+    return received
+
+
+def test_get_client_shares_one_client_per_model_and_server(requests):
+    client = get_client("ollama_chat/qwen2:7b", API_BASE + "/")
+    assert get_client("ollama/qwen2:7b", API_BASE) is client
+    assert get_client("qwen2:7b", API_BASE, num_ctx=4096) is not client
+    assert get_client("llama3:8b", API_BASE) is not client
+
+    http = client._http
+    for _ in range(3):
+        assert client([{"role": "user", "content": "やあ"}]).content == "こんにちは"
+    assert get_client("qwen2:7b", API_BASE)._http is http
+    assert client.stats()["requests"] == 3
+
+
+def test_close_evicts_the_cached_client(requests):
+    client = get_client("qwen2:7b", API_BASE)
+    client.close()
+
+    fresh = get_client("qwen2:7b", API_BASE)
+    assert fresh is not client and not fresh._http.is_closed
+    assert fresh([{"role": "user", "content": "やあ"}]).content == "こんにちは"
+    fresh.close()
+    OllamaClient("qwen2:7b", API_BASE).close()   # キャッシュにないクライアントを閉じても他に影響しない
+    assert get_client("qwen2:7b", API_BASE) is not fresh
+
+
+def test_keep_alive_and_preload_reach_ollama(requests):
+    client = OllamaClient("ollama_chat/qwen2:7b", API_BASE, num_ctx=2048, keep_alive="-1", keep_warm_seconds=0)
+    reply = client([{"role": "user", "content": [{"type": "text", "text": "やあ"}]}])
+    assert reply.timings["cold"] is True
+
+    client.preload()
+    client.start_keep_warm().join(timeout=5)   # keep_warm_seconds=0 ならプリロード1回で終わる
+    assert requests[0] == ("/api/chat", {"model": "qwen2:7b", "messages": [{"role": "user", "content": "やあ"}],
+                                         "stream": True, "keep_alive": "-1", "options": {"num_ctx": 2048}})
+    assert requests[1:] == [("/api/generate", {"model": "qwen2:7b", "keep_alive": "-1"})] * 2
+    assert client.stats()["preloads"] == 2
+
+
+def test_keep_warm_pings_an_idle_model(requests):
+    client = OllamaClient("qwen2:7b", API_BASE, keep_alive="30m", keep_warm_seconds=0.2)
+    client.start_keep_warm()
+    deadline = time.monotonic() + 5
+    while client.stats()["preloads"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    client.close()
+    assert client.stats()["preloads"] >= 2
+    assert {body["keep_alive"] for _, body in requests} == {"30m"}
@@ -0,0 +1,75 @@
+# test_retrieval.py
+# RetrievalCache が書き込みのたびに検索結果と BM25 インデックスを作り直すことを確かめる
+#   python -m pytest test_retrieval.py
+import hashlib
+
+import numpy as np
+import pytest
+
+from retrieval import RetrievalCache
+from save_book_to_chroma import sync_book
+from vector_store import open_client
+
+BEFORE = ["魔法使いの弟子は箒に水を運ばせた。", "王様は城の庭で花を育てていた。"]
+AFTER = ["竜の子どもは雲の上で昼寝をした。", "王様は城の庭で花を育てていた。"]
+
+
+class HashEmbedder:
+    """Deterministic stand-in for the sentence-transformers embedder."""
+
+    def encode(self, texts):
+        return np.array([[b / 255.0 for b in hashlib.sha256(text.encode("utf-8")).digest()[:16]] for text in texts])
+
+
+def write_book(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+@pytest.fixture(params=["chroma", "numpy"])
+def store(request, tmp_path):
+    db = str(tmp_path / "db")
+
+    def open_collection():
+        # 開くたびに別のクライアントを作り、別プロセスの登録スクリプトとサーバーの関係にする
+        return open_client(db, backend=request.param, numpy_path=db).get_or_create_collection("book")
+    return open_collection
+
+
+def test_same_count_edit_retires_deleted_chunks(store, tmp_path):
+    source = tmp_path / "story.txt"
+    embedder = HashEmbedder()
+    write_book(source, BEFORE)
+    sync_book(store(), str(source), embedder, chunking="lines")
+
+    reader = store()
+    cache = RetrievalCache()
+    before = cache.query(embedder, "book", reader, "魔法使いについて", 3)
+    assert any("魔法使い" in doc for doc in before["documents"][0])
+    stored = reader.get()
+    deleted = {entry for entry, doc in zip(stored["ids"], stored["documents"]) if "魔法使い" in doc}
+
+    # 件数は同じまま、魔法使いの行だけを書き換える（別のクライアントから）
+    write_book(source, AFTER)
+    counts = sync_book(store(), str(source), embedder, chunking="lines")
+    assert counts["added"] == 1 and counts["removed"] == 1
+    assert reader.count() == len(BEFORE)
+
+    for question in ("魔法使いについて", "城の庭で花を育てていたのは誰？"):
+        results = cache.query(embedder, "book", reader, question, 3)
+        assert not deleted & set(results["ids"][0])
+        assert not any("魔法使い" in doc for doc in results["documents"][0])
+        assert set(results["ids"][0]) <= set(reader.get()["ids"])
+    assert "竜の子ども" in " ".join(cache.query(embedder, "book", reader, "竜について", 3)["documents"][0])
+
+
+def test_unchanged_collection_is_served_from_cache(store, tmp_path):
+    source = tmp_path / "story.txt"
+    embedder = HashEmbedder()
+    write_book(source, BEFORE)
+    sync_book(store(), str(source), embedder, chunking="lines")
+
+    reader = store()
+    cache = RetrievalCache()
+    first = cache.query(embedder, "book", reader, "王様について", 3)
+    assert cache.query(embedder, "book", reader, "王様について", 3) is first
+    assert cache.results.stats()["hits"] == 1
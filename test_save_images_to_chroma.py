@@ -0,0 +1,88 @@
+# test_save_images_to_chroma.py
+# sync_images の差分登録（追加・変更なし・更新・削除・失敗の件数）を、生成した画像と偽の埋め込み器で確かめる
+#   python -m pytest test_save_images_to_chroma.py
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from save_images_to_chroma import image_id, sync_images
+from vector_store import open_client
+
+
+class ColorEmbedder:
+    """Stand-in for the CLIP embedder: the mean RGB colour of each image, plus a record of what it saw."""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, images):
+        self.batches.append(len(images))
+        return np.array([np.asarray(image, dtype=float).mean(axis=(0, 1)) / 255.0 for image in images])
+
+    @property
+    def encoded(self):
+        return sum(self.batches)
+
+
+def save_image(path, color, size=(32, 24)):
+    Image.new("RGB", size, color).save(path)
+
+
+@pytest.fixture(params=["chroma", "numpy"])
+def collection(request, tmp_path):
+    db = str(tmp_path / "db")
+    return open_client(db, backend=request.param, numpy_path=db).get_or_create_collection("image_vectors")
+
+
+def test_second_run_only_embeds_changes(collection, tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    save_image(folder / "a.png", (255, 0, 0))
+    save_image(folder / "b.png", (0, 255, 0))
+    save_image(folder / "c.jpg", (0, 0, 255))
+    (folder / "broken.png").write_bytes(b"this is not a png")
+    (folder / "notes.txt").write_text("not an image", encoding="utf-8")
+
+    embedder = ColorEmbedder()
+    counts = sync_images(collection, str(folder), embedder, batch_size=2, workers=2)
+    assert {key: counts[key] for key in ("added", "updated", "unchanged", "removed", "failed")} == \
+        {"added": 3, "updated": 0, "unchanged": 0, "removed": 0, "failed": 1}
+    assert embedder.encoded == 3
+    assert collection.count() == 3
+    assert image_id(str(folder / "broken.png")) not in collection.get()["ids"]
+
+    # b を描き直し、c を消し、d を足す
+    save_image(folder / "b.png", (255, 255, 0), size=(40, 30))
+    stat = os.stat(folder / "b.png")
+    os.utime(folder / "b.png", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    os.remove(folder / "c.jpg")
+    save_image(folder / "d.png", (255, 255, 255))
+
+    embedder = ColorEmbedder()
+    counts = sync_images(collection, str(folder), embedder, batch_size=2, workers=2)
+    assert {key: counts[key] for key in ("added", "updated", "unchanged", "removed", "failed")} == \
+        {"added": 1, "updated": 1, "unchanged": 1, "removed": 1, "failed": 1}
+    assert embedder.encoded == 2
+
+    stored = collection.get(ids=[image_id(str(folder / "b.png"))], include=["embeddings", "metadatas"])
+    assert (stored["metadatas"][0]["width"], stored["metadatas"][0]["height"]) == (40, 30)
+    vector = np.asarray(stored["embeddings"][0], dtype=float)
+    assert np.allclose(vector / np.linalg.norm(vector), [2 ** -0.5, 2 ** -0.5, 0.0])   # numpy ストアは正規化して保存する
+    assert sorted(collection.get()["documents"]) == sorted(str(folder / name) for name in ("a.png", "b.png", "d.png"))
+
+    # 何も変えなければ埋め込み器は呼ばれない
+    embedder = ColorEmbedder()
+    counts = sync_images(collection, str(folder), embedder)
+    assert (counts["unchanged"], counts["failed"], embedder.encoded) == (3, 1, 0)
+
+
+def test_dry_run_writes_nothing(collection, tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    save_image(folder / "a.png", (10, 20, 30))
+
+    counts = sync_images(collection, str(folder), None, dry_run=True)
+    assert counts["added"] == 1
+    assert collection.count() == 0
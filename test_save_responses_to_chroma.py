@@ -0,0 +1,47 @@
+# test_save_responses_to_chroma.py
+# 定期処理の各回が埋め込みモデルを作り直さず、スレッドも増やさないことを確かめる
+#   python -m pytest test_save_responses_to_chroma.py
+import json
+import threading
+
+import numpy as np
+
+import save_responses_to_chroma
+from vector_store import open_client
+
+
+class StubModel:
+    """Stand-in for SentenceTransformer that counts how often it is constructed."""
+
+    created = 0
+
+    def __init__(self, name):
+        StubModel.created += 1
+
+    def encode(self, texts):
+        return np.array([[float(len(text)), 1.0, 0.5] for text in texts])
+
+
+def write_responses(path, pairs):
+    with open(path, "a", encoding="utf-8") as f:
+        for question, answer in pairs:
+            f.write(json.dumps({"question": question, "answer": answer}, ensure_ascii=False) + "\n")
+
+
+def test_passes_reuse_one_model_and_start_no_threads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(save_responses_to_chroma, "SentenceTransformer", StubModel)
+    monkeypatch.setattr(save_responses_to_chroma, "_embedder", None)
+    monkeypatch.setattr(save_responses_to_chroma, "CHROMA_DB_PATH", str(tmp_path / "db"))
+    StubModel.created = 0
+    threads = threading.active_count()
+
+    for n in range(3):
+        write_responses(save_responses_to_chroma.VALIDATED_RESPONSES_FILE, [(f"質問{n}", f"回答{n}")])
+        save_responses_to_chroma.process_responses()
+        assert (tmp_path / save_responses_to_chroma.VALIDATED_RESPONSES_FILE).read_text(encoding="utf-8") == ""
+
+    assert StubModel.created == 1
+    assert threading.active_count() == threads
+    collection = open_client(str(tmp_path / "db")).get_collection(save_responses_to_chroma.COLLECTION_NAME)
+    assert sorted(collection.get()["documents"]) == ["回答0", "回答1", "回答2"]
@@ -0,0 +1,133 @@
+# test_transcript_cache.py
+# TranscriptCache の TTL・ネガティブキャッシュ・single-flight と、字幕エンドポイントの ETag/304 を確かめる
+# 字幕の取得元は偽物に差し替えるので、ネットワークには出ない
+#   python -m pytest test_transcript_cache.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import transcript_cache as transcript_cache_module
+from transcript_cache import STATUS_DISABLED, STATUS_OK, TranscriptCache, TranscriptUnavailable
+
+VIDEO_ID = "abcDEF_123-"
+LINES = [{"text": "こんにちは", "start": 0.0, "duration": 1.5}, {"text": "さようなら", "start": 1.5, "duration": 2.0}]
+
+
+class FakeProvider:
+    """Stand-in for youtube_fetch that counts calls and can be slowed down or made to fail."""
+
+    def __init__(self, result=LINES, delay: float = 0.0):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, video_id, languages):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return list(self.result)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(transcript_cache_module, "time", clock)
+    return clock
+
+
+def test_fresh_entry_is_served_until_ttl_expires(tmp_path, clock):
+    provider = FakeProvider()
+    cache = TranscriptCache(cache_dir=str(tmp_path), fetch=provider, ttl=60, negative_ttl=10)
+
+    first = cache.get(VIDEO_ID)
+    assert first["status"] == STATUS_OK and first["transcript"] == LINES
+    clock.now += 59
+    assert cache.get(VIDEO_ID) == first
+    # 別のインスタンス（再起動後のサーバー）もディスクから返す
+    assert TranscriptCache(cache_dir=str(tmp_path), fetch=provider, ttl=60).get(VIDEO_ID) == first
+    assert provider.calls == 1
+
+    clock.now += 2
+    refreshed = cache.get(VIDEO_ID)
+    assert provider.calls == 2
+    assert refreshed["fetched_at"] == clock.now and refreshed["etag"] == first["etag"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_missing_transcript_is_cached_negatively(tmp_path, clock):
+    provider = FakeProvider(TranscriptUnavailable(STATUS_DISABLED, "Subtitles are disabled"))
+    cache = TranscriptCache(cache_dir=str(tmp_path), fetch=provider, ttl=60, negative_ttl=10)
+
+    entry = cache.get(VIDEO_ID)
+    assert entry["status"] == STATUS_DISABLED and entry["transcript"] == []
+    clock.now += 9
+    assert cache.get(VIDEO_ID) == entry
+    assert provider.calls == 1
+    assert cache.stats()["negative_hits"] == 1
+
+    # ネガティブキャッシュは短い TTL で切れ、字幕が付いていれば拾い直す
+    provider.result = LINES
+    clock.now += 2
+    assert cache.get(VIDEO_ID)["status"] == STATUS_OK
+    assert provider.calls == 2
+
+
+def test_failed_fetch_is_not_cached(tmp_path, clock):
+    provider = FakeProvider(RuntimeError("network down"))
+    cache = TranscriptCache(cache_dir=str(tmp_path), fetch=provider, ttl=60, negative_ttl=10)
+
+    with pytest.raises(RuntimeError):
+        cache.get(VIDEO_ID)
+    provider.result = LINES
+    assert cache.get(VIDEO_ID)["transcript"] == LINES
+    assert provider.calls == 2
+
+
+def test_concurrent_gets_share_one_fetch(tmp_path):
+    provider = FakeProvider(delay=0.3)
+    cache = TranscriptCache(cache_dir=str(tmp_path), fetch=provider, ttl=60, negative_ttl=10)
+    requests = 8
+
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        entries = list(executor.map(lambda _: cache.get(VIDEO_ID), range(requests)))
+
+    assert provider.calls == 1
+    assert all(entry == entries[0] for entry in entries)
+    assert cache.stats()["coalesced"] == requests - 1
+
+
+def test_endpoint_answers_304_for_matching_etag(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)   # api_server の import が作る実行時ファイルをリポジトリに置かない
+    from fastapi.testclient import TestClient
+    import api_server
+
+    provider = FakeProvider()
+    monkeypatch.setattr(api_server, "transcript_cache",
+                        TranscriptCache(cache_dir=str(tmp_path / "transcripts"), fetch=provider, ttl=60))
+    client = TestClient(api_server.app)
+    url = f"/api/messages/transcript/{VIDEO_ID}"
+
+    first = client.get(url)
+    assert first.status_code == 200 and first.json()["transcript"] == LINES
+    etag = first.headers["etag"]
+
+    revalidated = client.get(url, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+    assert client.get(url, headers={"If-None-Match": '"something-else"'}).status_code == 200
+    assert provider.calls == 1
+    assert client.get("/api/messages/transcript/not a video id").status_code in (400, 404)
@@ -0,0 +1,142 @@
+# test_vector_store.py
+# NumPy バックエンドの書き込みが追記で済むこと、他のクライアントから変更が見えること、
+# 開かれている古い世代が消されないことを確かめる
+#   python -m pytest test_vector_store.py
+import json
+import os
+
+import numpy as np
+import pytest
+
+import vector_store
+from vector_store import NumpyVectorClient
+
+DIM = 8
+
+
+def vector(seed: int) -> list:
+    return list(np.random.default_rng(seed).normal(size=DIM))
+
+
+def manifest(collection) -> dict:
+    with open(os.path.join(collection.path, vector_store.MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def generations(collection) -> set:
+    return {int(name.partition(".")[0].rpartition("-")[2]) for name in os.listdir(collection.path)
+            if name.startswith(("vectors-", "records-"))}
+
+
+def brute_force(collection, query, k):
+    stored = collection.get(include=["embeddings"])
+    vectors = np.asarray(stored["embeddings"])
+    query = np.asarray(query) / np.linalg.norm(query)
+    order = np.argsort(-(vectors @ query), kind="stable")[:k]
+    return [stored["ids"][i] for i in order]
+
+
+@pytest.fixture
+def clients(tmp_path):
+    path = str(tmp_path / "store")
+    return NumpyVectorClient(path), NumpyVectorClient(path)
+
+
+def test_single_upserts_append_in_place(clients):
+    writer_client, reader_client = clients
+    writer = writer_client.get_or_create_collection("docs")
+    writer.upsert(ids=[f"doc{i}" for i in range(10)], embeddings=[vector(i) for i in range(10)],
+                  documents=[f"text {i}" for i in range(10)], metadatas=[{"n": i} for i in range(10)])
+    reader = reader_client.get_collection("docs")
+    first = manifest(writer)
+    vectors_inode = os.stat(os.path.join(writer.path, f"vectors-{first['generation']}.npy")).st_ino
+
+    for i in range(10, 200):
+        writer.upsert(ids=[f"doc{i}"], embeddings=[vector(i)], documents=[f"text {i}"], metadatas=[{"n": i}])
+        if i % 50 == 0:
+            assert reader.count() == i + 1
+
+    last = manifest(writer)
+    assert last["generation"] == first["generation"]   # 全件の書き直しは一度も起きていない
+    assert os.stat(os.path.join(writer.path, f"vectors-{last['generation']}.npy")).st_ino == vectors_inode
+    assert last["rows"] == reader.count() == 200
+    assert reader.get(ids=["doc150"])["documents"] == ["text 150"]
+    assert reader.get(where={"n": {"$gte": 198}})["ids"] == ["doc198", "doc199"]
+    query = vector(1234)
+    assert reader.query(query_embeddings=[query], n_results=5)["ids"][0] == brute_force(reader, query, 5)
+
+
+def test_other_clients_see_replacements_updates_and_deletes(clients):
+    writer_client, reader_client = clients
+    writer = writer_client.get_or_create_collection("docs")
+    writer.upsert(ids=["a", "b", "c"], embeddings=[vector(1), vector(2), vector(3)],
+                  documents=["A", "B", "C"], metadatas=[{"k": 1}, {"k": 2}, {"k": 3}])
+    reader = reader_client.get_collection("docs")
+    assert reader.count() == 3
+
+    writer.upsert(ids=["a"], embeddings=[vector(2)], documents=["A2"], metadatas=[{"k": 10}])
+    writer.update(ids=["b"], metadatas=[{"k": 20}])
+    writer.delete(ids=["c"])
+    writer.add(ids=["b"], embeddings=[vector(9)], documents=["ignored"])   # 既にある id は無視する
+
+    assert reader.count() == 2
+    stored = reader.get(include=["documents", "metadatas", "embeddings"])
+    assert dict(zip(stored["ids"], stored["documents"])) == {"a": "A2", "b": "B"}
+    assert dict(zip(stored["ids"], stored["metadatas"])) == {"a": {"k": 10}, "b": {"k": 20}}
+    assert np.allclose(stored["embeddings"][stored["ids"].index("a")], stored["embeddings"][stored["ids"].index("b")],
+                       atol=1e-6)
+    results = reader.query(query_embeddings=[vector(2)], n_results=5)
+    assert sorted(results["ids"][0]) == ["a", "b"]   # 置き換え前の a も、消した c も出てこない
+    assert reader.query(query_embeddings=[vector(3)], n_results=5, where={"k": 20})["ids"] == [["b"]]
+
+
+def test_dead_rows_are_compacted_into_a_new_generation(clients, monkeypatch):
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_DEAD_ROWS", 4)
+    writer = clients[0].get_or_create_collection("docs")
+    writer.upsert(ids=["a", "b"], embeddings=[vector(1), vector(2)], documents=["A", "B"])
+    generation = manifest(writer)["generation"]
+
+    for n in range(6):
+        writer.upsert(ids=["a"], embeddings=[vector(10 + n)], documents=[f"A{n}"])
+
+    current = manifest(writer)
+    assert current["generation"] > generation
+    assert current["rows"] < 8
+    reader = clients[1].get_collection("docs")
+    assert reader.get()["documents"] == ["B", "A5"]
+    assert reader.get(ids=["a"], include=["embeddings"])["embeddings"][0] == pytest.approx(
+        np.asarray(vector(15)) / np.linalg.norm(vector(15)), abs=1e-6)
+
+
+def test_old_generation_is_kept_while_a_reader_has_it_open(clients, monkeypatch):
+    monkeypatch.setattr(vector_store, "VECTOR_STORE_MIN_CAPACITY", 2)
+    writer_client, reader_client = clients
+    writer = writer_client.get_or_create_collection("docs")
+    writer.upsert(ids=["a"], embeddings=[vector(1)], documents=["A"])
+    reader = reader_client.get_collection("docs")
+    opened = manifest(writer)["generation"]
+
+    for i in range(10):   # 容量が小さいので何度も新しい世代に移る
+        writer.upsert(ids=[f"doc{i}"], embeddings=[vector(i)], documents=[f"text {i}"])
+    assert manifest(writer)["generation"] > opened + 1
+    assert opened in generations(writer)
+
+    assert reader.count() == 11   # 読み手が新しい世代に移ると、次の書き込みで古い世代が消える
+    writer.upsert(ids=["last"], embeddings=[vector(99)])
+    assert generations(writer) == {manifest(writer)["generation"]}
+
+
+def test_unpublished_log_tail_is_ignored_and_overwritten(clients):
+    writer_client, reader_client = clients
+    writer = writer_client.get_or_create_collection("docs")
+    writer.upsert(ids=["a"], embeddings=[vector(1)], documents=["A"])
+    records_path = os.path.join(writer.path, f"records-{manifest(writer)['generation']}.jsonl")
+    with open(records_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "put", "id": "ghost", "row": 1, "document": "half-writ')   # manifest を書く前に落ちた
+
+    reader = reader_client.get_collection("docs")
+    assert reader.get()["ids"] == ["a"]
+    writer.upsert(ids=["b"], embeddings=[vector(2)], documents=["B"])
+    assert reader.get()["documents"] == ["A", "B"]
+    with open(records_path, encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["a", "b"]
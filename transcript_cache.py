@@ -0,0 +1,207 @@
+# transcript_cache.py
+# YouTube 字幕の取得結果をディスクにキャッシュする
+# これまでは /api/messages/transcript/{video_id} のたびに YouTubeTranscriptApi へ取りに行き、
+# フロントエンド（ChatApp.jsx の fetchTranscriptForVideo）の再試行もあって、同じ動画の同じ字幕を何度も取得していた。
+#   - 取得できた字幕は TTL 付きで transcript_cache/<video_id>.json に保存する
+#   - 字幕が無い（TranscriptsDisabled / NoTranscriptFound）ことも短めの TTL で覚えておく（ネガティブキャッシュ）
+#   - 同じ video_id への同時リクエストは1回の取得にまとめる（single-flight）
+#   - 取得に失敗したときは、期限切れでも保存済みの字幕があればそれを返す
+# 字幕の取得元は fetch 引数で差し替えられる（既定は youtube_transcript_api）
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from metrics import stage
+from retrieval import LRUCache
+
+log = logging.getLogger(__name__)
+
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "transcript_cache")
+TRANSCRIPT_CACHE_TTL = float(os.getenv("TRANSCRIPT_CACHE_TTL", str(7 * 24 * 3600)))   # 秒。字幕が取れた動画
+TRANSCRIPT_NEGATIVE_TTL = float(os.getenv("TRANSCRIPT_NEGATIVE_TTL", "3600"))          # 秒。字幕が無かった動画
+TRANSCRIPT_MEMORY_SIZE = 64    # ディスクから読んだエントリをメモリにも置いておく件数
+TRANSCRIPT_LANGUAGES = ["ja", "en"]
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")   # ファイル名に使うので、それ以外の文字は受け付けない
+
+STATUS_OK = "ok"
+STATUS_DISABLED = "disabled"
+STATUS_NOT_FOUND = "not_found"
+
+
+class TranscriptUnavailable(Exception):
+    """Raised by a transcript provider when the video has no usable transcript (cached negatively)."""
+
+    def __init__(self, status: str, detail: str = ""):
+        super().__init__(detail or status)
+        self.status = status
+
+
+def youtube_fetch(video_id: str, languages: List[str]) -> List[Dict]:
+    """Default provider: youtube_transcript_api, with its 'no transcript' errors mapped to TranscriptUnavailable."""
+    from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+
+    try:
+        return YouTubeTranscriptApi.get_transcript(video_id, languages=languages)
+    except TranscriptsDisabled as e:
+        raise TranscriptUnavailable(STATUS_DISABLED, str(e)) from e
+    except NoTranscriptFound as e:
+        raise TranscriptUnavailable(STATUS_NOT_FOUND, str(e)) from e
+
+
+def transcript_etag(video_id: str, status: str, transcript: List[Dict]) -> str:
+    body = json.dumps([video_id, status, transcript], ensure_ascii=False, sort_keys=True)
+    return '"' + hashlib.sha1(body.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+class TranscriptCache:
+    """
+    Disk-backed transcript cache with TTLs, negative caching and single-flight.
+
+    get() returns an entry dict {"video_id", "status", "transcript", "etag",
+    "fetched_at", "expires_at"}; status is "ok", "disabled" or "not_found"
+    (the last two with an empty transcript). A fresh entry is served from
+    memory or disk; otherwise one caller fetches from the provider while the
+    others for the same video wait for its result. If the provider fails with
+    anything other than TranscriptUnavailable, an expired entry is served
+    when there is one, else the error propagates (and nothing is cached).
+    """
+
+    def __init__(self, cache_dir: str = TRANSCRIPT_CACHE_DIR, fetch: Callable[[str, List[str]], List[Dict]] = youtube_fetch,
+                 ttl: float = TRANSCRIPT_CACHE_TTL, negative_ttl: float = TRANSCRIPT_NEGATIVE_TTL,
+                 languages: Optional[List[str]] = None):
+        self.cache_dir = cache_dir
+        self.fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.languages = list(languages or TRANSCRIPT_LANGUAGES)
+        self._memory = LRUCache(TRANSCRIPT_MEMORY_SIZE, ttl=0)   # 期限はエントリの expires_at で判定する
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def _count(self, key: str):
+        with self._lock:
+            self._counters[key] += 1
+
+    # --- ディスク ---
+    def _path(self, video_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{video_id}.json")
+
+    def _load(self, video_id: str) -> Optional[Dict]:
+        entry = self._memory.get(video_id)
+        if entry is not None:
+            return entry
+        try:
+            with open(self._path(video_id), encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning("Ignoring unreadable transcript cache entry for %s: %s", video_id, e)
+            return None
+        self._memory.put(video_id, entry)
+        return entry
+
+    def _store(self, entry: Dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(entry["video_id"])
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._memory.put(entry["video_id"], entry)
+
+    # --- 取得 ---
+    def get(self, video_id: str) -> Dict:
+        if not VIDEO_ID_PATTERN.match(video_id):
+            raise ValueError(f"Invalid video id: {video_id!r}")
+        cached = self._load(video_id)
+        if cached is not None and cached["expires_at"] > time.time():
+            self._count("hits" if cached["status"] == STATUS_OK else "negative_hits")
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(video_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[video_id] = Future()
+        if not leader:
+            # 同じ動画を取得中のリクエストがあるので、その結果を待つ
+            self._count("coalesced")
+            return future.result()
+
+        try:
+            entry = self._refresh(video_id, cached)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(entry)
+            return entry
+        finally:
+            with self._lock:
+                del self._inflight[video_id]
+
+    def _refresh(self, video_id: str, stale: Optional[Dict]) -> Dict:
+        self._count("fetches")
+        try:
+            with stage("transcript_fetch"):
+                transcript = self.fetch(video_id, self.languages)
+            status, ttl = STATUS_OK, self.ttl
+        except TranscriptUnavailable as e:
+            log.info("No transcript for %s (%s)", video_id, e.status)
+            transcript, status, ttl = [], e.status, self.negative_ttl
+        except Exception as e:
+            self._count("errors")
+            if stale is None:
+                raise
+            self._count("stale_served")
+            log.warning("Transcript fetch for %s failed, serving the expired copy: %s", video_id, e)
+            return stale
+        now = time.time()
+        entry = {
+            "video_id": video_id,
+            "status": status,
+            "transcript": transcript,
+            "etag": transcript_etag(video_id, status, transcript),
+            "fetched_at": now,
+            "expires_at": now + ttl,
+        }
+        try:
+            self._store(entry)
+        except OSError as e:
+            log.warning("Could not write transcript cache entry for %s: %s", video_id, e)
+        log.info("Transcript fetched for %s: %d lines (%s)", video_id, len(transcript), status)
+        return entry
+
+    def invalidate(self, video_id: str):
+        if not VIDEO_ID_PATTERN.match(video_id):
+            return
+        self._memory.discard_where(lambda key: key == video_id)
+        try:
+            os.remove(self._path(video_id))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+            inflight = len(self._inflight)
+        return {
+            "dir": self.cache_dir,
+            "ttl_seconds": self.ttl,
+            "negative_ttl_seconds": self.negative_ttl,
+            "in_flight": inflight,
+            **counters,
+            "memory": self._memory.stats(),
+        }
+
+
+transcript_cache = TranscriptCache()
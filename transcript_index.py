@@ -0,0 +1,209 @@
+# transcript_index.py
+# YouTube 字幕を時間幅ごとのセグメントに分けて Chroma に保存し、質問に近い場面（タイムスタンプ付き）を検索する
+# これまでは字幕全文をブラウザへ送るだけで、RAG からも検索できなかった。
+#   - 字幕の行を TRANSCRIPT_WINDOW_SECONDS ごと（トークン数の上限あり）にまとめ、前のセグメントの最後の行を重ねる
+#   - 全動画で1つのコレクション（transcript_segments）を使い、metadata の video_id で絞り込む
+#   - セグメントの ID は動画と開始時刻から作るので、登録済みのものは埋め込まずにスキップする（途中で止まっても再開できる）
+#   - 字幕が変わった（ETag が違う）動画は、その動画のセグメントを消してから登録し直す
+#   python transcript_index.py VIDEO_ID [VIDEO_ID ...]   # 事前にまとめて登録する
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from chunking import approximate_tokens, CHUNK_TOKENS
+from metrics import stage
+from transcript_cache import transcript_cache, STATUS_OK
+
+log = logging.getLogger(__name__)
+
+TRANSCRIPT_COLLECTION = os.getenv("TRANSCRIPT_COLLECTION", "transcript_segments")
+TRANSCRIPT_WINDOW_SECONDS = float(os.getenv("TRANSCRIPT_WINDOW_SECONDS", "30"))   # 1セグメントの時間幅の目安
+TRANSCRIPT_EMBED_BATCH = 64      # 一度に埋め込んで upsert するセグメント数
+TRANSCRIPT_SEARCH_MAX = 20       # 検索で返すセグメント数の上限
+TRANSCRIPT_KIND = "transcript"
+
+
+def segment_transcript(transcript: List[Dict], window_seconds: float = TRANSCRIPT_WINDOW_SECONDS,
+                       max_tokens: int = CHUNK_TOKENS) -> List[Dict]:
+    """
+    Group transcript lines ({text, start, duration}) into segments of about
+    window_seconds (never more than max_tokens), each starting with the last
+    line of the previous segment. Returns [{text, start, duration}].
+    """
+    lines = [line for line in transcript if (line.get("text") or "").strip()]
+    segments = []
+    current: List[Dict] = []
+    tokens = 0
+    added = 0  # 前のセグメントを閉じてから加えた行数（重ねた行だけなら閉じない）
+
+    def close():
+        first, last = current[0], current[-1]
+        end = float(last["start"]) + float(last.get("duration") or 0.0)
+        segments.append({
+            "text": " ".join(line["text"].strip().replace("\n", " ") for line in current),
+            "start": float(first["start"]),
+            "duration": round(max(end - float(first["start"]), 0.0), 3),
+        })
+
+    for line in lines:
+        size = approximate_tokens(line["text"])
+        if current and (float(line["start"]) - float(current[0]["start"]) >= window_seconds or tokens + size > max_tokens):
+            close()
+            # 区切りをまたぐ発言が切れないよう、前のセグメントの最後の行を重ねる
+            current = current[-1:] if len(current) > 1 else []
+            tokens = sum(approximate_tokens(l["text"]) for l in current)
+            added = 0
+        current.append(line)
+        tokens += size
+        added += 1
+    if added:
+        close()
+    return segments
+
+
+def segment_id(video_id: str, segment: Dict) -> str:
+    return f"{video_id}:{int(round(segment['start'] * 1000))}"
+
+
+def index_transcript(collection, encode: Callable[[List[str]], "object"], video_id: str, entry: Dict,
+                     batch_size: int = TRANSCRIPT_EMBED_BATCH) -> int:
+    """Store the segments of one transcript entry (from transcript_cache) that are not stored yet; returns how many were written."""
+    existing = collection.get(where={"video_id": video_id}, include=["metadatas"])
+    stored_ids = set(existing["ids"])
+    if any(meta.get("etag") != entry["etag"] for meta in existing["metadatas"] or []):
+        # 字幕が更新されたので、この動画のセグメントを作り直す
+        collection.delete(where={"video_id": video_id})
+        stored_ids = set()
+    segments = segment_transcript(entry["transcript"])
+    todo = [s for s in segments if segment_id(video_id, s) not in stored_ids]
+    for i in range(0, len(todo), batch_size):
+        batch = todo[i:i + batch_size]
+        embeddings = encode([s["text"] for s in batch])
+        collection.upsert(
+            ids=[segment_id(video_id, s) for s in batch],
+            documents=[s["text"] for s in batch],
+            embeddings=[list(map(float, vector)) for vector in embeddings],
+            metadatas=[{"kind": TRANSCRIPT_KIND, "video_id": video_id, "start": s["start"],
+                        "duration": s["duration"], "etag": entry["etag"]} for s in batch],
+        )
+    return len(todo)
+
+
+class TranscriptIndexer:
+    """
+    Background job that puts transcript segments into Chroma, and the search over them.
+
+    schedule() queues a video on a single worker thread (a video already
+    queued or indexed with the current transcript is not queued again);
+    search() embeds the question with the registry's cached embedder and
+    returns the nearest segments with their timestamps.
+    """
+
+    def __init__(self, collection_name: str = TRANSCRIPT_COLLECTION, cache=transcript_cache):
+        self.collection_name = collection_name
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcript-index")
+        self._pending: Dict[str, Future] = {}
+        self._indexed: Dict[str, str] = {}  # video_id -> 登録済みの字幕の ETag
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self.last_index_seconds = 0.0
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._counters[key] += amount
+
+    def indexed(self, video_id: str) -> bool:
+        return video_id in self._indexed
+
+    def schedule(self, resources, video_id: str) -> Future:
+        with self._lock:
+            future = self._pending.get(video_id)
+            if future is None:
+                future = self._pending[video_id] = self._executor.submit(self._run, resources, video_id)
+            return future
+
+    def _run(self, resources, video_id: str) -> int:
+        try:
+            return self.index(resources, video_id)
+        except Exception as e:
+            self._count("failures")
+            log.exception("Transcript indexing failed for %s: %s", video_id, e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(video_id, None)
+
+    def index(self, resources, video_id: str) -> int:
+        entry = self.cache.get(video_id)
+        if entry["status"] != STATUS_OK or self._indexed.get(video_id) == entry["etag"]:
+            return 0
+        started = time.perf_counter()
+        collection = resources.collection(self.collection_name)
+        written = index_transcript(collection, resources.embedding_service.encode, video_id, entry)
+        if written:
+            resources.retrieval.invalidate(self.collection_name)
+        self._indexed[video_id] = entry["etag"]
+        self.last_index_seconds = time.perf_counter() - started
+        self._count("videos")
+        self._count("segments_written", written)
+        log.info("Indexed transcript %s: %d new segments in %.3fs", video_id, written, self.last_index_seconds)
+        return written
+
+    def search(self, resources, question: str, video_id: Optional[str] = None, n_results: int = 5) -> List[Dict]:
+        collection = resources.collection(self.collection_name)
+        n_results = max(1, min(n_results, TRANSCRIPT_SEARCH_MAX))
+        with stage("transcript_search"):
+            if collection.count() == 0:
+                return []
+            vector = resources.retrieval.embed(resources.embedding_service, question)
+            where = {"video_id": video_id} if video_id else None
+            results = collection.query(query_embeddings=[vector], n_results=n_results, where=where,
+                                       include=["documents", "metadatas", "distances"])
+        self._count("searches")
+        return [
+            {"video_id": meta["video_id"], "start": meta["start"], "duration": meta["duration"],
+             "text": document, "distance": round(distance, 4)}
+            for document, meta, distance in zip(results["documents"][0], results["metadatas"][0], results["distances"][0])
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "collection": self.collection_name,
+            "indexed_videos": len(self._indexed),
+            "pending": pending,
+            **dict(self._counters),
+            "last_index_seconds": round(self.last_index_seconds, 3),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+transcript_indexer = TranscriptIndexer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch YouTube transcripts and store their time-windowed segments in ChromaDB")
+    parser.add_argument("video_ids", nargs="+")
+    args = parser.parse_args()
+
+    from resources import registry
+    registry.load()
+    try:
+        for video_id in args.video_ids:
+            written = transcript_indexer.index(registry, video_id)
+            print(f"{video_id}: {written} 件のセグメントを '{transcript_indexer.collection_name}' に登録しました")
+    finally:
+        registry.llm.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,690 @@
+# vector_store.py
+# ベクトルストアの差し替え口と、NumPy の memmap を使う小さなコレクション向けのバックエンド
+# book や validated_responses_store は数千件程度しかないのに、プロセスごとに Chroma の SQLite と HNSW の
+# 起動コスト、クエリごとのオーバーヘッドを払っていた。VECTOR_STORE=numpy にすると
+#   - 埋め込みは正規化して .npy（float32 / float16）に保存し、np.load(mmap_mode="r") で開く（起動はほぼ一瞬）
+#   - 文書とメタデータは同じ世代の追記専用ログ（records-<世代>.jsonl）に置く
+#   - 検索は全件とのコサイン類似度を行列積で求める厳密な top-k（件数が少なければ HNSW より速くて正確）
+#   - 書き込みは世代ファイルの空き行とログの末尾に追記してから manifest.json の行数・バイト数を置き換えるので、
+#     1件の upsert でも全件を書き直さない。読み取り専用で開いている他のワーカープロセスは manifest の変化を見て
+#     ログの増えた分だけを読む（ページキャッシュは共有される）。容量が尽きたときと、使わなくなった行が
+#     生きている行より多くなったときだけ新しい世代に書き直す
+# コレクションは api_server が使う Chroma の API（count / get / query / add / upsert / update / delete）だけを実装する。
+# サーバーも登録スクリプト（save_*_to_chroma.py, bulk_ingest.py）も open_client を通すので、読み書きは同じバックエンドに向く。
+# どちらのバックエンドのコレクションも write_version() を持ち、どのプロセスが書いても書き込みのたびに値が変わる
+# （NumPy は manifest.json、Chroma は書き込みのたびに置き換える <db>/.write_versions/<コレクション名>）。
+# retrieval.py はこれを検索結果のキャッシュと BM25 インデックスの世代に使う（count() は件数が同じ書き換えを見分けられない）。
+#   python vector_store.py export --from chroma_db --to vector_store     # Chroma のコレクションを移す
+import argparse
+import json
+import math
+import os
+import threading
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl  # 複数プロセスからの書き込みを直列にする（Windows では同じプロセス内だけ）
+except ImportError:
+    fcntl = None
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")               # chroma / numpy
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "vector_store")
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")  # float32 / float16（ファイルとページキャッシュは半分、検索は変換の分だけ遅い）
+SCORE_BLOCK_ROWS = 65536   # float16 を float32 に直しながら行列積を取るときの1ブロックの行数
+VECTOR_STORE_MIN_CAPACITY = 1024   # 世代ファイルに確保する最小の行数（空きはスパースなのでディスクは食わない）
+CAPACITY_GROWTH = 1.5              # 世代を書き直すとき、行数のこの倍率の容量を確保する（追記は償却 O(1)）
+COMPACT_MIN_DEAD_ROWS = 1024       # 置き換え・削除で使わなくなった行がこれ以上、かつ生きている行より多ければ詰め直す
+OPEN_RETRIES = 5                   # 開こうとした世代が直後に消されていたときに manifest を読み直す回数
+EXPORT_PAGE_SIZE = 5000
+
+MANIFEST = "manifest.json"
+WRITE_VERSIONS_DIR = ".write_versions"
+DEFAULT_GET_INCLUDE = ("documents", "metadatas")
+DEFAULT_QUERY_INCLUDE = ("documents", "metadatas", "distances")
+
+
+def _matches(metadata: Optional[Dict], where: Optional[Dict]) -> bool:
+    """Chroma-style metadata filter: equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, $and/$or."""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq":
+                    ok = value == operand
+                elif op == "$ne":
+                    ok = value != operand
+                elif op == "$in":
+                    ok = value in operand
+                elif op == "$nin":
+                    ok = value not in operand
+                elif op in ("$gt", "$gte", "$lt", "$lte"):
+                    ok = value is not None and {"$gt": value > operand, "$gte": value >= operand,
+                                                "$lt": value < operand, "$lte": value <= operand}[op]
+                else:
+                    raise ValueError(f"Unsupported where operator: {op}")
+                if not ok:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _file_signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+class NumpyCollection:
+    """
+    One collection, stored as generations. A generation is a preallocated
+    vectors-<gen>.npy (opened with mmap) whose rows are appended in place,
+    plus records-<gen>.jsonl, an append-only log of put / set / del
+    operations carrying the ids, documents and metadatas. manifest.json names
+    the generation and how many rows and log bytes are published, so a write
+    costs only what it adds, and readers in any process catch up by reading
+    the new tail of the log. A new generation is written only when the file
+    is full (its capacity grows geometrically) or when replaced and deleted
+    rows outnumber live ones. Readers hold a shared lock on the generation
+    they have mapped, and an old generation is removed only once nobody does.
+    Distances are cosine distances (1 - cos), and the collection metadata
+    says so ("hnsw:space": "cosine").
+    """
+
+    def __init__(self, path: str, name: str, dtype: str = VECTOR_STORE_DTYPE, metadata: Optional[Dict] = None):
+        self.path = path
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.metadata = {**(metadata or {}), "hnsw:space": "cosine"}
+        self._lock = threading.RLock()
+        self._signature = None
+        self._manifest: Optional[Dict] = None
+        self._generation = 0
+        self._pin = None                       # 開いている世代のファイル（共有ロックを持ち、削除させない）
+        self._mapped: Optional[np.ndarray] = None   # 世代ファイル全体（容量分）
+        self._vectors: Optional[np.ndarray] = None  # 公開済みの行だけ
+        self._ids: List[str] = []              # 以下3つは行ごと（置き換え・削除された行も残る）
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict]] = []
+        self._index: Dict[str, int] = {}       # id -> 生きている行
+        self._records_offset = 0               # records-<gen>.jsonl のここまでを読み込み済み
+        self._live: Optional[List[int]] = None
+        self._where_rows: Dict[str, np.ndarray] = {}  # where の条件 -> 該当する行（変更があったら捨てる）
+        os.makedirs(path, exist_ok=True)
+        self._refresh()
+
+    # --- 読み込み ---
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, MANIFEST)
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"vectors-{generation}.npy")
+
+    def _records_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"records-{generation}.jsonl")
+
+    def write_version(self) -> Optional[tuple]:
+        """Changes whenever any process publishes a write."""
+        return _file_signature(self._manifest_path())
+
+    def _refresh(self):
+        """Catch up with writes published by another process (or this one) since the last call."""
+        signature = _file_signature(self._manifest_path())
+        if signature is None or signature == self._signature:
+            return
+        with self._lock:
+            for attempt in range(OPEN_RETRIES):
+                try:
+                    with open(self._manifest_path(), encoding="utf-8") as f:
+                        manifest = json.load(f)
+                    if (manifest["generation"] == self._generation and "records_bytes" in manifest
+                            and manifest["records_bytes"] >= self._records_offset):
+                        self._catch_up(manifest)
+                    else:
+                        self._open_generation(manifest)
+                    break
+                except FileNotFoundError:
+                    # manifest を読んだ直後に、その世代が置き換えられて消された。読み直す
+                    if attempt == OPEN_RETRIES - 1:
+                        raise
+                    signature = _file_signature(self._manifest_path())
+            self._signature = signature
+
+    def _read_records(self, manifest: Dict, start: int) -> List[Dict]:
+        generation = manifest["generation"]
+        if "records_bytes" not in manifest:
+            # 追記ログになる前の形式（世代ごとに全件を書いた records-<gen>.json）
+            with open(os.path.join(self.path, f"records-{generation}.json"), encoding="utf-8") as f:
+                records = json.load(f)
+            return [{"op": "put", "id": entry_id, "row": row, "document": document, "metadata": metadata}
+                    for row, (entry_id, document, metadata)
+                    in enumerate(zip(records["ids"], records["documents"], records["metadatas"]))]
+        with open(self._records_path(generation), "rb") as f:
+            f.seek(start)
+            data = f.read(manifest["records_bytes"] - start)
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+    def _open_generation(self, manifest: Dict):
+        generation = manifest["generation"]
+        pin = mapped = None
+        if manifest.get("dim"):
+            pin = open(self._vectors_path(generation), "rb")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(pin, fcntl.LOCK_SH)
+                mapped = np.load(self._vectors_path(generation), mmap_mode="r")
+            except BaseException:
+                pin.close()
+                raise
+        try:
+            records = self._read_records(manifest, 0)
+        except BaseException:
+            if pin is not None:
+                pin.close()
+            raise
+        if self._pin is not None:
+            self._pin.close()
+        self._pin = pin
+        self._mapped = mapped
+        self._generation = generation
+        self.metadata = {**manifest.get("metadata", {}), "hnsw:space": "cosine"}
+        self.dtype = np.dtype(manifest.get("dtype", self.dtype.name))
+        self._ids, self._documents, self._metadatas, self._index = [], [], [], {}
+        self._apply(records, manifest)
+
+    def _catch_up(self, manifest: Dict):
+        self._apply(self._read_records(manifest, self._records_offset), manifest)
+
+    def _apply(self, records: List[Dict], manifest: Dict):
+        for record in records:
+            op, entry_id = record["op"], record["id"]
+            if op == "put":
+                row = record["row"]
+                while len(self._ids) <= row:
+                    self._ids.append(None)
+                    self._documents.append(None)
+                    self._metadatas.append(None)
+                self._ids[row] = entry_id
+                self._documents[row] = record["document"]
+                self._metadatas[row] = record["metadata"]
+                self._index[entry_id] = row
+            elif op == "set":
+                row = self._index.get(entry_id)
+                if row is None:
+                    continue
+                if "document" in record:
+                    self._documents[row] = record["document"]
+                if "metadata" in record:
+                    self._metadatas[row] = record["metadata"]
+            elif op == "del":
+                self._index.pop(entry_id, None)
+        rows = manifest.get("rows", manifest.get("count", 0))
+        self._vectors = self._mapped[:rows] if self._mapped is not None else None
+        self._records_offset = manifest.get("records_bytes", 0)
+        self._manifest = manifest
+        self._live = None
+        self._where_rows = {}
+
+    def _live_rows(self) -> List[int]:
+        if self._live is None:
+            self._live = sorted(self._index.values())
+        return self._live
+
+    def count(self) -> int:
+        self._refresh()
+        return len(self._index)
+
+    def _rows(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None) -> List[int]:
+        if ids is not None:
+            rows = [self._index[entry_id] for entry_id in ids if entry_id in self._index]
+        else:
+            rows = self._live_rows()
+        if where:
+            return [row for row in rows if _matches(self._metadatas[row], where)]
+        return list(rows)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include=DEFAULT_GET_INCLUDE) -> Dict:
+        self._refresh()
+        with self._lock:
+            rows = self._rows(ids, where)
+            rows = rows[offset or 0:(offset or 0) + limit if limit is not None else None]
+            result = {"ids": [self._ids[row] for row in rows]}
+            result["documents"] = [self._documents[row] for row in rows] if "documents" in include else None
+            result["metadatas"] = [self._metadatas[row] for row in rows] if "metadatas" in include else None
+            if "embeddings" in include:
+                result["embeddings"] = (np.asarray(self._vectors[rows], dtype=np.float32) if rows
+                                        else np.zeros((0, 0), dtype=np.float32))
+            else:
+                result["embeddings"] = None
+            return result
+
+    def _filtered_rows(self, where: Dict) -> np.ndarray:
+        # メタデータの照合は Python のループなので、同じ条件の結果は次の変更まで使い回す
+        key = json.dumps(where, sort_keys=True)
+        rows = self._where_rows.get(key)
+        if rows is None:
+            rows = self._where_rows[key] = np.asarray(self._rows(where=where), dtype=np.int64)
+        return rows
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every published row with every query: shape (rows, queries)."""
+        vectors = self._vectors
+        if vectors.dtype == np.float32:
+            return vectors @ queries.T
+        # float16 の行列積は BLAS を使えず遅いので、ブロックごとに float32 に直してから掛ける
+        return np.concatenate([np.asarray(vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32) @ queries.T
+                               for start in range(0, len(vectors), SCORE_BLOCK_ROWS)])
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict] = None,
+              include=DEFAULT_QUERY_INCLUDE) -> Dict:
+        self._refresh()
+        queries = _normalize(query_embeddings)
+        result = {"ids": [], "documents": [] if "documents" in include else None,
+                  "metadatas": [] if "metadatas" in include else None,
+                  "distances": [] if "distances" in include else None, "embeddings": None}
+        with self._lock:
+            if where:
+                rows = self._filtered_rows(where)
+            elif len(self._index) < len(self._ids):
+                rows = np.asarray(self._live_rows(), dtype=np.int64)  # 置き換え・削除された行を除く
+            else:
+                rows = None
+            candidates = len(self._ids) if rows is None else len(rows)
+            k = min(n_results, candidates)
+            scores = None
+            if k:
+                # 絞り込んだ行だけを取り出すより、全件の行列積を取ってから選ぶ方が速い（コピーが要らない）
+                scores = self._scores(queries)
+                if rows is not None:
+                    scores = scores[rows]
+            for column in range(len(queries)):
+                top = []
+                if k:
+                    similarities = scores[:, column]
+                    top = np.argpartition(-similarities, k - 1)[:k] if k < candidates else np.arange(candidates)
+                    top = top[np.argsort(-similarities[top], kind="stable")]
+                picked = [int(i) if rows is None else int(rows[i]) for i in top]
+                result["ids"].append([self._ids[row] for row in picked])
+                if result["documents"] is not None:
+                    result["documents"].append([self._documents[row] for row in picked])
+                if result["metadatas"] is not None:
+                    result["metadatas"].append([self._metadatas[row] for row in picked])
+                if result["distances"] is not None:
+                    result["distances"].append([float(1.0 - similarities[i]) for i in top] if k else [])
+        return result
+
+    # --- 書き込み ---
+    def _write(self, plan):
+        """
+        Publish the changes plan() computes from the latest state: (vectors, records),
+        where each "put" record names its row in vectors as "vector".
+        """
+        lock_file = open(os.path.join(self.path, ".lock"), "a")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self._lock:
+                self._refresh()  # 他のプロセスが書いた分を取り込んでから変更する
+                vectors, records = plan()
+                if not records:
+                    return
+                rows = len(self._ids)
+                for record in records:
+                    if record["op"] == "put":
+                        record["row"] = rows + record.pop("vector")
+                added = len(vectors) if vectors is not None else 0
+                manifest = self._manifest or {}
+                dead = rows - len(self._index)
+                if (self._mapped is None or "records_bytes" not in manifest or rows + added > len(self._mapped)
+                        or dead > max(COMPACT_MIN_DEAD_ROWS, len(self._index))):
+                    self._write_generation(vectors, records, rows)
+                else:
+                    self._append(vectors, records, rows)
+                self._refresh()
+                self._remove_old_generations()
+        finally:
+            lock_file.close()
+
+    def _publish(self, manifest: Dict):
+        with open(self._manifest_path() + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(self._manifest_path() + ".tmp", self._manifest_path())
+
+    def _append(self, vectors: Optional[np.ndarray], records: List[Dict], rows: int):
+        """Write the new rows into the free capacity and the records onto the log, then publish the counts."""
+        generation = self._generation
+        if vectors is not None and len(vectors):
+            mapped = np.load(self._vectors_path(generation), mmap_mode="r+")
+            mapped[rows:rows + len(vectors)] = vectors
+            mapped.flush()
+            del mapped
+        payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        with open(self._records_path(generation), "r+b") as f:
+            f.truncate(self._records_offset)  # 公開前に落ちた書き込みの残りは捨てる
+            f.seek(self._records_offset)
+            f.write(payload)
+        self._publish({**self._manifest, "rows": rows + (len(vectors) if vectors is not None else 0),
+                       "records_bytes": self._records_offset + len(payload)})
+
+    def _write_generation(self, vectors: Optional[np.ndarray], records: List[Dict], rows: int):
+        """Rewrite the live rows plus this write's changes as a new generation with room to grow."""
+        # 生きている行に今回の変更を重ね、id -> [新しい行の出どころ, 文書, メタデータ] を作る（出どころは旧行か vectors の行）
+        entries: Dict[str, list] = {self._ids[row]: [("old", row), self._documents[row], self._metadatas[row]]
+                                    for row in self._live_rows()}
+        for record in records:
+            entry_id = record["id"]
+            if record["op"] == "put":
+                entries.pop(entry_id, None)  # 置き換えた行は末尾に移る（追記と同じ並び）
+                entries[entry_id] = [("new", record["row"] - rows), record["document"], record["metadata"]]
+            elif record["op"] == "set" and entry_id in entries:
+                if "document" in record:
+                    entries[entry_id][1] = record["document"]
+                if "metadata" in record:
+                    entries[entry_id][2] = record["metadata"]
+            elif record["op"] == "del":
+                entries.pop(entry_id, None)
+        dim = (self._manifest or {}).get("dim") or (vectors.shape[1] if vectors is not None and len(vectors) else None)
+        generation = self._generation + 1
+        count = len(entries)
+        log_records = []
+        if dim:
+            capacity = max(VECTOR_STORE_MIN_CAPACITY, math.ceil(count * CAPACITY_GROWTH))
+            vectors_path = self._vectors_path(generation)
+            out = np.lib.format.open_memmap(vectors_path + ".tmp", mode="w+", dtype=self.dtype, shape=(capacity, dim))
+            old_rows = [(i, source[1]) for i, (source, _, _) in enumerate(entries.values()) if source[0] == "old"]
+            new_rows = [(i, source[1]) for i, (source, _, _) in enumerate(entries.values()) if source[0] == "new"]
+            for start in range(0, len(old_rows), SCORE_BLOCK_ROWS):
+                block = old_rows[start:start + SCORE_BLOCK_ROWS]
+                out[[i for i, _ in block]] = self._vectors[[row for _, row in block]]
+            if new_rows:
+                out[[i for i, _ in new_rows]] = vectors[[row for _, row in new_rows]]
+            out.flush()
+            del out
+            os.replace(vectors_path + ".tmp", vectors_path)
+        for row, (entry_id, (_, document, metadata)) in enumerate(entries.items()):
+            log_records.append({"op": "put", "id": entry_id, "row": row, "document": document, "metadata": metadata})
+        payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in log_records).encode("utf-8")
+        records_path = self._records_path(generation)
+        with open(records_path + ".tmp", "wb") as f:
+            f.write(payload)
+        os.replace(records_path + ".tmp", records_path)
+        self._publish({"generation": generation, "rows": count, "records_bytes": len(payload), "dim": dim,
+                       "dtype": self.dtype.name,
+                       "metadata": {k: v for k, v in self.metadata.items() if k != "hnsw:space"}})
+
+    def _remove_old_generations(self):
+        # 読み手は開いている世代に共有ロックを持つので、排他ロックを取れた世代だけを消す
+        # （fcntl が無い環境では、manifest を読んだ直後の読み手のために直前の世代を1つ残す）
+        files: Dict[int, List[str]] = {}
+        for name in os.listdir(self.path):
+            stem = name.partition(".")[0]
+            prefix, _, number = stem.rpartition("-")
+            if prefix in ("vectors", "records") and number.isdigit():
+                files.setdefault(int(number), []).append(name)
+        keep_from = self._generation if fcntl is not None else self._generation - 1
+        for generation, names in files.items():
+            if generation >= keep_from:
+                continue
+            try:
+                f = open(self._vectors_path(generation), "rb")
+            except FileNotFoundError:
+                f = None
+            try:
+                if f is not None and fcntl is not None:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # まだこの世代を開いている読み手がいる
+                for name in names:
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+            finally:
+                if f is not None:
+                    f.close()
+
+    def upsert(self, ids: List[str], embeddings=None, documents=None, metadatas=None, skip_existing: bool = False):
+        if embeddings is None:
+            raise ValueError("NumpyCollection needs embeddings (it has no embedding function)")
+        new_vectors = _normalize(embeddings)
+        if len(new_vectors) != len(ids):
+            raise ValueError("ids and embeddings have different lengths")
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+
+        def plan():
+            dim = (self._manifest or {}).get("dim")
+            if dim and dim != new_vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {new_vectors.shape[1]} does not match {dim}")
+            picked, records, seen = [], [], set()
+            for i, entry_id in enumerate(ids):
+                if skip_existing and (entry_id in self._index or entry_id in seen):
+                    continue
+                seen.add(entry_id)
+                records.append({"op": "put", "id": entry_id, "vector": len(picked),
+                                "document": documents[i], "metadata": metadatas[i]})
+                picked.append(i)
+            return new_vectors[picked], records
+
+        self._write(plan)
+
+    def add(self, ids: List[str], embeddings=None, documents=None, metadatas=None):
+        # Chroma と同じく、既にある id は無視する
+        self.upsert(ids, embeddings, documents, metadatas, skip_existing=True)
+
+    def update(self, ids: List[str], embeddings=None, documents=None, metadatas=None):
+        new_vectors = _normalize(embeddings) if embeddings is not None else None
+
+        def plan():
+            picked, records = [], []
+            for i, entry_id in enumerate(ids):
+                row = self._index.get(entry_id)
+                if row is None:
+                    continue
+                if new_vectors is not None:
+                    # ベクトルが変わる行は新しい行として追記し、古い行は使わなくなる
+                    records.append({"op": "put", "id": entry_id, "vector": len(picked),
+                                    "document": documents[i] if documents is not None else self._documents[row],
+                                    "metadata": metadatas[i] if metadatas is not None else self._metadatas[row]})
+                    picked.append(i)
+                    continue
+                record = {"op": "set", "id": entry_id}
+                if documents is not None:
+                    record["document"] = documents[i]
+                if metadatas is not None:
+                    record["metadata"] = metadatas[i]
+                records.append(record)
+            return (new_vectors[picked] if picked else None), records
+
+        self._write(plan)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        if ids is None and not where:
+            raise ValueError("delete() needs ids or where")
+
+        def plan():
+            rows = self._rows(ids, where)
+            return None, [{"op": "del", "id": self._ids[row]} for row in rows]
+
+        self._write(plan)
+
+
+class NumpyVectorClient:
+    """Directory of NumpyCollections with the Chroma client methods the repo uses."""
+
+    def __init__(self, path: str = VECTOR_STORE_PATH, dtype: str = VECTOR_STORE_DTYPE):
+        self.path = path
+        self.dtype = dtype
+        self._collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict] = None) -> NumpyCollection:
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = self._collections[name] = NumpyCollection(os.path.join(self.path, name), name,
+                                                                       self.dtype, metadata)
+            return collection
+
+    def get_collection(self, name: str) -> NumpyCollection:
+        if not os.path.exists(os.path.join(self.path, name, MANIFEST)) and name not in self._collections:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.get_or_create_collection(name)
+
+    def list_collections(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.path) if os.path.exists(os.path.join(self.path, name, MANIFEST)))
+
+
+class TrackedCollection:
+    """
+    Chroma collection whose writes also replace a marker file in the
+    database directory, so write_version() changes after every add / upsert /
+    update / delete, whichever process made it. Other attributes pass through.
+    """
+
+    def __init__(self, collection, marker_path: str):
+        self._collection = collection
+        self._marker_path = marker_path
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def write_version(self) -> Optional[tuple]:
+        return _file_signature(self._marker_path)
+
+    def touch(self):
+        # 中身ではなく stat（mtime・inode）で比べるので、毎回別のファイルに置き換える
+        os.makedirs(os.path.dirname(self._marker_path), exist_ok=True)
+        tmp_path = f"{self._marker_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, self._marker_path)
+
+    def _tracked(self, method: str, *args, **kwargs):
+        try:
+            return getattr(self._collection, method)(*args, **kwargs)
+        finally:
+            self.touch()  # 途中で失敗しても一部は書かれているかもしれない
+
+    def add(self, *args, **kwargs):
+        return self._tracked("add", *args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self._tracked("upsert", *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._tracked("update", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._tracked("delete", *args, **kwargs)
+
+
+class TrackedChromaClient:
+    """chromadb.PersistentClient that hands out TrackedCollections."""
+
+    def __init__(self, path: str):
+        import chromadb
+        self.path = path
+        self._client = chromadb.PersistentClient(path=path)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _tracked(self, collection) -> TrackedCollection:
+        return TrackedCollection(collection, os.path.join(self.path, WRITE_VERSIONS_DIR, collection.name))
+
+    def get_or_create_collection(self, name: str, *args, **kwargs) -> TrackedCollection:
+        return self._tracked(self._client.get_or_create_collection(name, *args, **kwargs))
+
+    def get_collection(self, name: str, *args, **kwargs) -> TrackedCollection:
+        return self._tracked(self._client.get_collection(name, *args, **kwargs))
+
+    def create_collection(self, name: str, *args, **kwargs) -> TrackedCollection:
+        return self._tracked(self._client.create_collection(name, *args, **kwargs))
+
+    def delete_collection(self, name: str):
+        self._client.delete_collection(name)
+        TrackedCollection(None, os.path.join(self.path, WRITE_VERSIONS_DIR, name)).touch()
+
+
+def open_client(chroma_path: str, backend: str = VECTOR_STORE, numpy_path: str = VECTOR_STORE_PATH):
+    """Client of the configured backend: TrackedChromaClient(chroma_path) or NumpyVectorClient(numpy_path)."""
+    if backend == "numpy":
+        return NumpyVectorClient(numpy_path)
+    if backend != "chroma":
+        raise ValueError(f"Unknown vector store backend '{backend}' (choose chroma or numpy)")
+    return TrackedChromaClient(chroma_path)
+
+
+def export_chroma(chroma_path: str, target_path: str, names: Optional[List[str]] = None,
+                  dtype: str = VECTOR_STORE_DTYPE) -> Dict[str, int]:
+    """Copy Chroma collections (ids, embeddings, documents, metadatas) into a numpy store."""
+    import chromadb
+    source = chromadb.PersistentClient(path=chroma_path)
+    target = NumpyVectorClient(target_path, dtype)
+    names = names or [getattr(c, "name", c) for c in source.list_collections()]
+    copied = {}
+    for name in names:
+        collection = source.get_collection(name)
+        ids, embeddings, documents, metadatas = [], [], [], []
+        offset = 0
+        while True:
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=EXPORT_PAGE_SIZE, offset=offset)
+            ids += page["ids"]
+            embeddings += list(page["embeddings"])
+            documents += page["documents"]
+            metadatas += page["metadatas"]
+            if len(page["ids"]) < EXPORT_PAGE_SIZE:
+                break
+            offset += EXPORT_PAGE_SIZE
+        out = target.get_or_create_collection(name, metadata={k: v for k, v in (collection.metadata or {}).items()
+                                                              if not k.startswith("hnsw:")})
+        if ids:
+            out.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        copied[name] = len(ids)
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the numpy vector store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="copy collections from a Chroma database")
+    export.add_argument("--from", dest="source", default="chroma_db")
+    export.add_argument("--to", dest="target", default=VECTOR_STORE_PATH)
+    export.add_argument("--collections", nargs="*", help="default: all collections")
+    export.add_argument("--dtype", choices=["float32", "float16"], default=VECTOR_STORE_DTYPE)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        copied = export_chroma(args.source, args.target, args.collections, args.dtype)
+        for name, count in copied.items():
+            print(f"{name}: {count} 件を {os.path.join(args.target, name)} にコピーしました")
+
+
+if __name__ == "__main__":
+    main()
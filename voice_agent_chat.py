@@ -1,6 +1,6 @@
 import os
 import speech_recognition as sr
-from smolagents import LiteLLMModel
+from ollama_client import get_client
 import pyttsx3
 import requests
 from bs4 import BeautifulSoup
@@ -10,6 +10,8 @@ import json
 import time
 import concurrent.futures
 import winreg
+from chat_store import ChatHistoryStore, CHAT_HISTORY_LOG
+from conversation_memory import ConversationMemory, text_message
 
 # Set up FLAC path for SpeechRecognition
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -118,21 +120,20 @@ def fetch_web_search(query):
     except Exception as e:
         return f"ウェブ検索エラー: {e}"
 
-def load_chat_history(filename="chat_history.json"):
-    if os.path.exists(filename):
-        try:
-            with open(filename, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            pass
+def load_chat_history(store):
+    try:
+        return store.entries()
+    except Exception as e:
+        print(f"会話履歴の読み込みに失敗: {e}")
     return []
 
-def save_chat_history(history, filename="chat_history.json"):
+def save_chat_turn(store, turn):
+    # 1ターン分（ユーザー発言 + AI応答）だけを追記する
     try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+        return store.append_many(turn)
     except Exception as e:
         print(f"会話履歴の保存に失敗: {e}")
+    return None
 
 def find_mt5_path():
     # MetaTrader 5のインストールパスをレジストリから取得（標準インストールの場合）
@@ -216,13 +217,16 @@ def main():
         print(f"Exception: デフォルトマイクのdevice_index取得中に予期せぬエラー: {e}")
         # Let selected_device_index remain None
     
-    model = LiteLLMModel(
-        model_id="ollama_chat/qwen2:7b",
-        api_base="http://127.0.0.1:11434",
-        num_ctx=8192,
-    )
+    # 接続をプールする共有クライアント。起動時にモデルを読み込み、発言の合間も常駐させておく
+    model = get_client("ollama_chat/qwen2:7b", "http://127.0.0.1:11434", num_ctx=8192)
+    model.start_keep_warm()
     # 会話履歴のロード
-    chat_history = load_chat_history()
+    history_store = ChatHistoryStore(CHAT_HISTORY_LOG, legacy_json_path="chat_history.json")
+    # 直近の数往復だけをそのまま送り、それより前は要約にまとめる（要約は発言の合間にバックグラウンドで更新）
+    memory = ConversationMemory(
+        lambda prompt: model([text_message("user", prompt)]).content,
+        load_chat_history(history_store),
+    )
     print("\n音声で質問してください（'終了' または 'exit' で終了）：")
     try:
         while True:
@@ -235,9 +239,7 @@ def main():
                 if user_input.strip().lower() in ["exit", "終了"]:
                     print("終了します。")
                     break
-                messages = chat_history + [
-                    {"role": "user", "content": [{"type": "text", "text": user_input}]}
-                ]
+                messages = memory.context([text_message("user", user_input)])
                 print("AIが思考中...（しばらくお待ちください／Ctrl+Cで中断可）")
                 response = None
                 with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
@@ -251,8 +253,13 @@ def main():
                 if response:
                     print("AI:", response.content)
                     speak_text(response.content)
-                    chat_history.append({"role": "user", "content": [{"type": "text", "text": user_input}]})
-                    chat_history.append({"role": "assistant", "content": [{"type": "text", "text": response.content}]})
+                    turn = [
+                        {"role": "user", "content": [{"type": "text", "text": user_input}]},
+                        {"role": "assistant", "content": [{"type": "text", "text": response.content}]},
+                    ]
+                    ids = save_chat_turn(history_store, turn)
+                    if ids:
+                        memory.add(ids, turn)
             else:
                 print("音声を認識できませんでした。")
                 if speech["error"]:
@@ -260,7 +267,8 @@ def main():
     except KeyboardInterrupt:
         print("\n終了します。")
     finally:
-        save_chat_history(chat_history)
+        memory.close()
+        model.close()
 
 if __name__ == "__main__":
     import sys
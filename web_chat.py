@@ -1,53 +1,46 @@
 import torch
 import streamlit as st
-from smolagents import LiteLLMModel
-import chromadb
-import json # 追加
-import os # 追加
+from ollama_client import get_client
+from vector_store import open_client
+from resources import CHROMA_DB_PATH, BOOK_COLLECTION
+from chat_store import ChatHistoryStore, CHAT_HISTORY_LOG
+from embedding_service import EmbeddingService
 
 CHAT_HISTORY_FILE = "chat_history.json" # 追加
 
-# 追加: チャット履歴をファイルから読み込む関数
-def load_chat_history():
-    if os.path.exists(CHAT_HISTORY_FILE):
-        try:
-            with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError: # ファイルが空か壊れている場合
-            return []
-    return []
-
-# 追加: チャット履歴をファイルに保存する関数
-def save_chat_history(messages):
-    with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
+# 追加: チャット履歴は追記専用ストアで管理する（api_server.py と同じファイルを共有）
+@st.cache_resource
+def load_history_store():
+    return ChatHistoryStore(CHAT_HISTORY_LOG, legacy_json_path=CHAT_HISTORY_FILE)
 
 def main():
     st.title("ものがたりの作り方アシスタント")
 
     @st.cache_resource
     def load_model():
-        return LiteLLMModel(
-            model_id="ollama_chat/qwen2:7b",
-            api_base="http://ollama:11434",  # Docker運用用に修正
-            num_ctx=8192,
-        )
+        # 接続をプールし、モデルを常駐させる共有クライアント
+        model = get_client("ollama_chat/qwen2:7b", "http://ollama:11434", num_ctx=8192)  # Docker運用用に修正
+        model.start_keep_warm()
+        return model
     model = load_model()
 
     @st.cache_resource
     def load_embedder():
         from sentence_transformers import SentenceTransformer
-        return SentenceTransformer("all-MiniLM-L6-v2")
+        # セッションをまたいで同時に来た埋め込み要求をまとめて計算する
+        return EmbeddingService(SentenceTransformer("all-MiniLM-L6-v2"))
     embedder = load_embedder()
 
     @st.cache_resource
     def load_chroma():
-        client = chromadb.PersistentClient(path="chroma_db")
-        return client.get_or_create_collection("book")
+        # api_server や登録スクリプトと同じく open_client を通す（VECTOR_STORE=numpy なら同じ NumPy ストアを読む）
+        client = open_client(CHROMA_DB_PATH)
+        return client.get_or_create_collection(BOOK_COLLECTION)
     collection = load_chroma()
 
+    history_store = load_history_store()
     if "messages" not in st.session_state:
-        st.session_state["messages"] = load_chat_history()
+        st.session_state["messages"] = history_store.messages()
 
     # Display messages in reverse order (newest at the bottom)
     for msg in reversed(st.session_state["messages"]):
@@ -60,7 +53,8 @@ def main():
 
     if user_input:
         st.write(user_input)
-        st.session_state["messages"].append({"role": "user", "content": [{"type": "text", "text": user_input}]})
+        user_msg = {"role": "user", "content": [{"type": "text", "text": user_input}]}
+        st.session_state["messages"].append(user_msg)
         query_vec = embedder.encode([user_input])[0].tolist()
         results = collection.query(query_embeddings=[query_vec], n_results=3)
         related = "\n".join(results["documents"][0]) if results["documents"] else "（該当する内容が見つかりませんでした）"
@@ -76,7 +70,7 @@ def main():
         ai_text = response.content.replace("書籍の抜粋から理解すると、", "").replace("【回答】", "")
         ai_msg = {"role": "assistant", "content": [{"type": "text", "text": ai_text}]}
         st.session_state["messages"].append(ai_msg)
-        save_chat_history(st.session_state["messages"])
+        history_store.append_many([user_msg, ai_msg])
         st.rerun()
 
 if __name__ == "__main__":